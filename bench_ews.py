@@ -0,0 +1,293 @@
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import time
+
+from ews_client import option_from_argv
+
+# Benchmark defaults; every one can be overridden on the command line
+DEFAULTS = {
+    'items': 2000,
+    'mime-size': 20 * 1024,
+    'latency': 0.005,
+    'pipeline': 'detailed',
+    'profile': 'full',
+    'workers': 8,
+    'batch-size': 25,
+    'page-size': 100,
+    'samples': 20,
+    'mailboxes': 4
+}
+
+PIPELINES = ('detailed', 'listing', 'sync', 'crawl')
+
+# Seconds to wait for the fake server to accept connections
+SERVER_START_TIMEOUT = 30
+
+def free_port():
+    """Ask the OS for an unused local port"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def start_server(options):
+    """Run the fake EWS server in its own process so it does not share our GIL"""
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, 'ews_fakeserver.py', '--items', str(options['items']),
+         '--mime-size', str(options['mime-size']), '--latency', str(options['latency']), '--port', str(port)],
+        cwd=os.path.dirname(os.path.abspath(__file__)), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        wait_for_port(port, process)
+    except Exception:
+        process.terminate()
+        raise
+    return process, f"http://127.0.0.1:{port}/EWS/Exchange.asmx"
+
+def wait_for_port(port, process, timeout=SERVER_START_TIMEOUT):
+    """Poll until the server accepts connections, rather than relying on its (buffered) stdout"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Fake EWS server exited with code {process.returncode}")
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"Fake EWS server did not accept connections on port {port} within {timeout}s")
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def run_pipeline(options):
+    """Child-process entry point: run one pipeline end to end and print its stats as JSON
+
+    Running in a fresh interpreter keeps peak RSS and CPU time specific to
+    the pipeline under test.
+    """
+    import test_ews_detailed
+    import test_ews_emails
+
+    start = time.perf_counter()
+    cpu_start = os.times()
+    count = 0
+
+    if options['pipeline'] == 'listing':
+        for _ in test_ews_emails.iter_emails_from_inbox(page_size=options['page-size'], profile='summary'):
+            count += 1
+    elif options['pipeline'] == 'crawl':
+        import ews_crawler
+        accounts = [{'email': f'bench{number}@example.com', 'folders': ['inbox']} for number in range(options['mailboxes'])]
+        for _ in ews_crawler.iter_mailbox_emails(accounts, page_size=options['page-size'],
+                                                 batch_size=options['batch-size'], connections=options['workers'],
+                                                 profile=options['profile'], store_path=None):
+            count += 1
+    elif options['pipeline'] == 'sync':
+        work_dir = options['work-dir']
+        counts = test_ews_detailed.sync_detailed_emails(
+            output_path=os.path.join(work_dir, 'bench_sync.jsonl'),
+            state_path=os.path.join(work_dir, 'bench_sync_state.json'),
+            batch_size=options['batch-size'], workers=options['workers'],
+            profile=options['profile'], store_path=None
+        )
+        count = counts['created'] + counts['updated']
+    else:
+        for _ in test_ews_detailed.iter_detailed_emails(page_size=options['page-size'], batch_size=options['batch-size'],
+                                                        workers=options['workers'], profile=options['profile'],
+                                                        store_path=None):
+            count += 1
+
+    elapsed = time.perf_counter() - start
+    cpu_end = os.times()
+    return {
+        'items': count,
+        'seconds': elapsed,
+        'itemsPerSec': count / elapsed if elapsed else 0,
+        'cpuSeconds': (cpu_end.user - cpu_start.user) + (cpu_end.system - cpu_start.system),
+        # ru_maxrss is KiB on Linux
+        'peakRssMb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    }
+
+def measure_phases(options, endpoint):
+    """Time network, XML parse, item decode and MIME header extraction separately
+
+    Replays `samples` GetItem batches: each raw round-trip is timed on its
+    own, then the captured bodies are parsed, decoded and MIME-scanned
+    offline so every phase is measured without the others in the way.
+    """
+    from ews_client import create_auth_headers, qname
+    from ews_decode import decode_message, resolve_sender
+    from ews_fetch import GET_ITEM_TEMPLATE, create_session
+    from ews_profiles import build_item_shape
+    from ews_stream import iter_elements, CHUNK_SIZE
+    from ews_fakeserver import ID_PREFIX
+
+    headers = create_auth_headers()
+    session = create_session(1)
+    item_shape = build_item_shape(options['profile'])
+    batch_size = options['batch-size']
+    samples = options['samples']
+
+    latencies = []
+    bodies = []
+    for sample in range(samples):
+        first = (sample * batch_size) % max(1, options['items'] - batch_size)
+        ids = ''.join(f'<t:ItemId Id="{ID_PREFIX}{index:010d}AA==" ChangeKey="x" />'
+                      for index in range(first, first + batch_size))
+        request = GET_ITEM_TEMPLATE.format(item_shape=item_shape, item_ids=ids)
+
+        start = time.perf_counter()
+        response = session.post(endpoint, headers=headers, data=request)
+        body = response.content
+        latencies.append(time.perf_counter() - start)
+        bodies.append(body)
+    session.close()
+
+    message_tag = qname('t', 'Message')
+    parse_time = decode_time = mime_time = 0.0
+    items = 0
+
+    for body in bodies:
+        chunks = [body[i:i + CHUNK_SIZE] for i in range(0, len(body), CHUNK_SIZE)]
+
+        start = time.perf_counter()
+        for _ in iter_elements(chunks, {message_tag}):
+            pass
+        parse_time += time.perf_counter() - start
+
+        for elem in iter_elements(chunks, {message_tag}):
+            start = time.perf_counter()
+            record = decode_message(elem)
+            decode_time += time.perf_counter() - start
+
+            start = time.perf_counter()
+            resolve_sender(record)
+            mime_time += time.perf_counter() - start
+            items += 1
+
+    network_time = sum(latencies)
+    total = network_time + parse_time + decode_time + mime_time
+    share = lambda value: round(100 * value / total, 1) if total else 0
+
+    return {
+        'requests': samples,
+        'bytesPerRequest': sum(len(body) for body in bodies) / max(1, samples),
+        'latencyP50Ms': percentile(latencies, 0.5) * 1000,
+        'latencyP99Ms': percentile(latencies, 0.99) * 1000,
+        'perItemUs': {
+            'network': 1e6 * network_time / max(1, items),
+            'parse': 1e6 * parse_time / max(1, items),
+            'decode': 1e6 * decode_time / max(1, items),
+            'mime': 1e6 * mime_time / max(1, items)
+        },
+        'sharePercent': {
+            'network': share(network_time),
+            'parse': share(parse_time),
+            'decode': share(decode_time),
+            'mime': share(mime_time)
+        }
+    }
+
+def check_baseline(results, baseline_path, tolerance):
+    """Compare against a saved run; return a list of regressions beyond `tolerance`"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+
+    regressions = []
+    if results['run']['itemsPerSec'] < baseline['run']['itemsPerSec'] * (1 - tolerance):
+        regressions.append(f"items/sec {results['run']['itemsPerSec']:.0f} < baseline {baseline['run']['itemsPerSec']:.0f}")
+    if results['run']['peakRssMb'] > baseline['run']['peakRssMb'] * (1 + tolerance):
+        regressions.append(f"peak RSS {results['run']['peakRssMb']:.1f} MB > baseline {baseline['run']['peakRssMb']:.1f} MB")
+    if results['phases']['latencyP99Ms'] > baseline['phases']['latencyP99Ms'] * (1 + tolerance):
+        regressions.append(f"p99 latency {results['phases']['latencyP99Ms']:.1f} ms > baseline {baseline['phases']['latencyP99Ms']:.1f} ms")
+    return regressions
+
+def print_report(options, results):
+    run = results['run']
+    phases = results['phases']
+    print(f"\nPipeline: {options['pipeline']} (profile {options['profile']}, {options['workers']} workers, "
+          f"batch {options['batch-size']})")
+    print(f"Mailbox:  {options['items']} items, {options['mime-size']} byte MIME, {options['latency'] * 1000:.1f} ms latency")
+    print(f"\n  items          {run['items']}")
+    print(f"  items/sec      {run['itemsPerSec']:.1f}")
+    print(f"  wall seconds   {run['seconds']:.2f}")
+    print(f"  CPU seconds    {run['cpuSeconds']:.2f}")
+    print(f"  peak RSS       {run['peakRssMb']:.1f} MB")
+    print(f"\n  GetItem p50    {phases['latencyP50Ms']:.1f} ms")
+    print(f"  GetItem p99    {phases['latencyP99Ms']:.1f} ms")
+    print(f"  bytes/request  {phases['bytesPerRequest']:.0f}")
+    print("\n  phase      us/item   share")
+    for phase in ('network', 'parse', 'decode', 'mime'):
+        print(f"  {phase:<9} {phases['perItemUs'][phase]:>8.1f}   {phases['sharePercent'][phase]:>5.1f}%")
+
+if __name__ == "__main__":
+    options = {}
+    for name, default in DEFAULTS.items():
+        value = option_from_argv(sys.argv, f'--{name}', default)
+        options[name] = type(default)(value)
+
+    if options['pipeline'] not in PIPELINES:
+        print(f"Unknown pipeline '{options['pipeline']}', expected one of: {', '.join(PIPELINES)}")
+        sys.exit(2)
+
+    # Child mode: the endpoint comes from EWS_ENDPOINT, set by the parent
+    if '--child' in sys.argv:
+        options['work-dir'] = option_from_argv(sys.argv, '--work-dir', '.')
+        sys.stdout = open(os.devnull, 'w')
+        stats = run_pipeline(options)
+        sys.stdout = sys.__stdout__
+        print(json.dumps(stats))
+        sys.exit(0)
+
+    server, endpoint = start_server(options)
+    work_dir = os.path.abspath(option_from_argv(sys.argv, '--work-dir', '.'))
+
+    try:
+        child = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--child', '--work-dir', work_dir] + sys.argv[1:],
+            env=dict(os.environ, EWS_ENDPOINT=endpoint), capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        )
+        if child.returncode != 0:
+            print(child.stdout)
+            print(child.stderr)
+            sys.exit(child.returncode)
+
+        os.environ['EWS_ENDPOINT'] = endpoint
+        results = {
+            'options': options,
+            'run': json.loads(child.stdout.strip().splitlines()[-1]),
+            'phases': measure_phases(options, endpoint)
+        }
+    finally:
+        server.terminate()
+        for leftover in ('bench_sync.jsonl', 'bench_sync_state.json'):
+            if os.path.exists(os.path.join(work_dir, leftover)):
+                os.remove(os.path.join(work_dir, leftover))
+
+    print_report(options, results)
+
+    json_path = option_from_argv(sys.argv, '--json')
+    if json_path:
+        with open(json_path, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults saved to {json_path}")
+
+    baseline_path = option_from_argv(sys.argv, '--baseline')
+    if baseline_path:
+        tolerance = float(option_from_argv(sys.argv, '--tolerance', 0.2))
+        regressions = check_baseline(results, baseline_path, tolerance)
+        if regressions:
+            print("\nRegressions against baseline:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print(f"\nNo regressions beyond {tolerance:.0%} of {baseline_path}")
@@ -0,0 +1,435 @@
+import binascii
+import hashlib
+import os
+import tempfile
+import xml.etree.ElementTree as ET
+import xml.parsers.expat
+from email.parser import BytesHeaderParser
+from email.utils import collapse_rfc2231_value
+
+from ews_client import EWS_ENDPOINT, qname
+from ews_stream import CHUNK_SIZE, STREAM_ERRORS, EwsRequestError, TruncatedResponse
+from ews_mime import iter_base64, decode_words
+from ews_metrics import METRICS, timed
+from ews_throttle import ResponseCodes, retry_failed_items
+
+# SOAP template for GetAttachment; one request downloads several attachments
+GET_ATTACHMENT_TEMPLATE = """<?xml version="1.0" encoding="utf-8"?>
+<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/"
+               xmlns:t="http://schemas.microsoft.com/exchange/services/2006/types"
+               xmlns:m="http://schemas.microsoft.com/exchange/services/2006/messages">
+  <soap:Header>
+    <t:RequestServerVersion Version="Exchange2010_SP2" />
+  </soap:Header>
+  <soap:Body>
+    <m:GetAttachment>
+      <m:AttachmentIds>
+        {attachment_ids}
+      </m:AttachmentIds>
+    </m:GetAttachment>
+  </soap:Body>
+</soap:Envelope>"""
+
+# Directory holding attachment bodies, one file per distinct SHA-256
+ATTACHMENTS_PATH = 'ews_attachments'
+
+# Attachments per GetAttachment request; the byte cap (the same as for GetItem batches) uses the sizes GetItem reported
+ATTACHMENT_BATCH_SIZE = 10
+ATTACHMENT_BATCH_BYTES = 8 * 1024 * 1024
+
+# Base64 characters decoded per step when extracting attachments from MIME content
+EXTRACT_CHUNK = 256 * 1024
+
+# A MIME line longer than this cannot be a boundary; it is written out without waiting for its end
+MAX_LINE = 64 * 1024
+
+# Header lines kept per MIME part; anything past this is junk and only costs memory
+MAX_HEADER_LINES = 200
+
+# Text expat collects before calling back with it
+EXPAT_BUFFER = 256 * 1024
+
+WHITESPACE = b' \t\r\n'
+
+class AttachmentStore:
+    """Content-addressed attachment files under `root`, named by the SHA-256 of their bytes
+
+    A body is hashed while it is written to a temporary file, which is then
+    renamed to root/ab/abcdef... . If that file already exists (the same
+    quote PDF down a whole thread, a signature logo) the new copy is
+    dropped, so each distinct attachment is stored once. Safe to share
+    between threads: renames are atomic and equal names mean equal bytes.
+    """
+
+    def __init__(self, root=ATTACHMENTS_PATH):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path_for(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def open_blob(self):
+        return BlobWriter(self)
+
+class BlobWriter:
+    """One attachment body on its way into an AttachmentStore
+
+    Write raw bytes with `write` or base64 text in pieces of any length with
+    `write_base64`, then `commit` to file it under its digest or `abort` to
+    drop it. Only the file buffer is held in memory.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        descriptor, self.temp_path = tempfile.mkstemp(dir=store.root, suffix='.part')
+        self.file = os.fdopen(descriptor, 'wb')
+        self.hash = hashlib.sha256()
+        self.size = 0
+        self.carry = b''
+
+    def write(self, data):
+        self.hash.update(data)
+        self.file.write(data)
+        self.size += len(data)
+
+    def write_base64(self, text):
+        if isinstance(text, str):
+            text = text.encode('ascii', 'ignore')
+        piece = self.carry + text.translate(None, WHITESPACE)
+
+        # Only whole 4-character groups can be decoded; keep the rest for the next piece
+        usable = len(piece) - len(piece) % 4
+        self.carry = piece[usable:]
+        if usable:
+            self.write(binascii.a2b_base64(piece[:usable]))
+
+    def commit(self):
+        """Close the file and move it to its content address; returns the SHA-256 hex digest"""
+        if self.carry:
+            # Truncated or unpadded base64: keep whatever decodes
+            try:
+                self.write(binascii.a2b_base64(self.carry + b'=' * (-len(self.carry) % 4)))
+            except binascii.Error:
+                pass
+        self.file.close()
+
+        digest = self.hash.hexdigest()
+        path = self.store.path_for(digest)
+        if os.path.exists(path):
+            os.remove(self.temp_path)
+            METRICS.count('attachment_duplicates')
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(self.temp_path, path)
+            METRICS.count('attachment_bytes_stored', self.size)
+        METRICS.count('attachments')
+        return digest
+
+    def abort(self):
+        self.file.close()
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+class MimeAttachmentParser:
+    """Incremental MIME scanner that streams attachment parts into an AttachmentStore
+
+    Feed it the raw message in pieces of any size. Multipart boundaries are
+    tracked line by line; a part is an attachment when its
+    Content-Disposition says so or it carries a file name. Base64 and
+    quoted-printable bodies are decoded as their lines arrive, so memory
+    holds one line, not one part. Text bodies and preambles are skipped.
+    `attachments` lists a reference dict for each stored part.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.attachments = []
+        self.boundaries = []
+        self.in_headers = True
+        self.header_lines = []
+        self.blob = None
+        self.part = None
+        self.encoding = None
+        self.pending_newline = b''
+        self.buffer = b''
+        self.mid_line = False
+
+    def feed(self, data):
+        buffer = self.buffer + data if self.buffer else data
+        start = 0
+
+        while True:
+            if self._bulk_body() and not buffer.startswith(b'--', start):
+                # Only a line starting with '--' can end this body, so everything before one goes over in one piece
+                end = buffer.find(b'\n--', start)
+                end = buffer.rfind(b'\n', start) if end == -1 else end
+                if end == -1:
+                    break
+                self._body(buffer[start:end + 1])
+                start = end + 1
+                continue
+
+            end = buffer.find(b'\n', start)
+            if end == -1:
+                break
+            self._line(buffer[start:end + 1])
+            start = end + 1
+        self.buffer = buffer[start:]
+
+        if len(self.buffer) > MAX_LINE and not self.in_headers:
+            self._body(self.buffer)
+            self.buffer = b''
+            self.mid_line = True
+
+    def close(self):
+        """Finish the last part (even if the message was cut short) and return the attachment references"""
+        if self.buffer:
+            self._line(self.buffer)
+            self.buffer = b''
+        self._end_part()
+        return self.attachments
+
+    def abort(self):
+        if self.blob is not None:
+            self.blob.abort()
+            self.blob = None
+
+    def _bulk_body(self):
+        """True inside a body whose line breaks do not matter: base64, or one being skipped"""
+        return not self.in_headers and not self.mid_line and (self.blob is None or self.encoding == 'base64')
+
+    def _line(self, line):
+        if self.mid_line:
+            # The rest of an over-long line, which cannot be a boundary
+            self.mid_line = False
+            self._body(line)
+            return
+
+        if self.boundaries and line.startswith(b'--'):
+            marker = line.rstrip()
+            for depth in range(len(self.boundaries) - 1, -1, -1):
+                boundary = self.boundaries[depth]
+                if marker == boundary:
+                    self._end_part()
+                    del self.boundaries[depth + 1:]
+                    self.in_headers = True
+                    return
+                if marker == boundary + b'--':
+                    # Closing delimiter: skip the epilogue until an outer boundary
+                    self._end_part()
+                    del self.boundaries[depth:]
+                    self.in_headers = False
+                    return
+
+        if not self.in_headers:
+            self._body(line)
+            return
+
+        header_line = line.rstrip(b'\r\n')
+        if header_line:
+            if len(self.header_lines) < MAX_HEADER_LINES:
+                self.header_lines.append(header_line)
+            return
+        self.in_headers = False
+        self._start_part()
+
+    def _start_part(self):
+        headers = BytesHeaderParser().parsebytes(b'\r\n'.join(self.header_lines) + b'\r\n\r\n')
+        self.header_lines = []
+
+        if headers.get_content_maintype() == 'multipart':
+            boundary = headers.get_boundary()
+            if boundary:
+                self.boundaries.append(b'--' + boundary.encode('utf-8', 'replace'))
+            return
+
+        disposition = headers.get_content_disposition()
+        name = headers.get_filename() or headers.get_param('name')
+        if disposition != 'attachment' and not name:
+            return
+
+        self.encoding = (headers.get('Content-Transfer-Encoding') or '').strip().lower()
+        self.part = {
+            'name': decode_words(collapse_rfc2231_value(name)) if name else None,
+            'contentType': headers.get_content_type(),
+            'contentId': (headers.get('Content-ID') or '').strip().strip('<>') or None,
+            'isInline': disposition == 'inline'
+        }
+        self.blob = self.store.open_blob()
+        self.pending_newline = b''
+
+    def _body(self, line):
+        if self.blob is None:
+            return
+        if self.encoding == 'base64':
+            self.blob.write_base64(line)
+            return
+
+        # The line break before a boundary belongs to the boundary, so each one is held back until the next line
+        content = line.rstrip(b'\r\n')
+        ending = line[len(content):]
+        if self.encoding == 'quoted-printable':
+            if content.endswith(b'='):
+                ending = b''
+            content = binascii.a2b_qp(content)
+        self.blob.write(self.pending_newline + content)
+        self.pending_newline = ending
+
+    def _end_part(self):
+        if self.blob is None:
+            return
+        self.part['sha256'] = self.blob.commit()
+        self.part['size'] = self.blob.size
+        self.attachments.append(self.part)
+        self.blob = None
+        self.part = None
+
+@timed('attachment_extract')
+def extract_mime_attachments(mime_base64, store, chunk_size=EXTRACT_CHUNK):
+    """Store the attachments inside base64 MIME content and return their references
+
+    The message is decoded a chunk at a time straight into a
+    MimeAttachmentParser, so neither the decoded message nor any attachment
+    body is ever held in memory as a whole.
+    """
+    parser = MimeAttachmentParser(store)
+    try:
+        for chunk in iter_base64(mime_base64, chunk_size):
+            parser.feed(chunk)
+        return parser.close()
+    except Exception:
+        parser.abort()
+        raise
+
+class AttachmentResponseParser:
+    """Parses a streamed GetAttachment response, writing each t:Content straight into the store
+
+    ElementTree would build every t:Content as one string (a 25 MB file is
+    about 33 MB of base64), so this uses expat callbacks instead: character
+    data inside t:Content goes to a BlobWriter as it arrives. `stored` maps
+    AttachmentIds to (sha256, size); `codes` (a ResponseCodes) collects the
+    per-attachment response codes for retry_failed_items.
+    """
+
+    CONTENT_TAG = qname('t', 'Content')
+    ATTACHMENT_ID_TAG = qname('t', 'AttachmentId')
+
+    def __init__(self, store, codes=None):
+        self.store = store
+        self.codes = codes if codes is not None else ResponseCodes()
+        self.stored = {}
+        self.attachment_id = None
+        self.blob = None
+        self.text = None
+        self.attributes = None
+
+        self.parser = xml.parsers.expat.ParserCreate(namespace_separator='}')
+        self.parser.buffer_text = True
+        self.parser.buffer_size = EXPAT_BUFFER
+        self.parser.StartElementHandler = self._start
+        self.parser.EndElementHandler = self._end
+        self.parser.CharacterDataHandler = self._characters
+
+    def feed(self, chunk):
+        self.parser.Parse(chunk, False)
+
+    def close(self):
+        self.parser.Parse(b'', True)
+
+    def abort(self):
+        if self.blob is not None:
+            self.blob.abort()
+            self.blob = None
+
+    def _start(self, name, attributes):
+        tag = '{' + name
+        if tag == self.ATTACHMENT_ID_TAG:
+            self.attachment_id = attributes.get('Id')
+        elif tag == self.CONTENT_TAG:
+            self.blob = self.store.open_blob()
+        elif tag in ResponseCodes.TAGS:
+            self.text = []
+            self.attributes = attributes
+
+    def _characters(self, data):
+        if self.blob is not None:
+            self.blob.write_base64(data)
+        elif self.text is not None:
+            self.text.append(data)
+
+    def _end(self, name):
+        tag = '{' + name
+        if tag == self.CONTENT_TAG and self.blob is not None:
+            self.stored[self.attachment_id] = (self.blob.commit(), self.blob.size)
+            self.blob = None
+        elif tag in ResponseCodes.TAGS and self.text is not None:
+            elem = ET.Element(tag, self.attributes)
+            elem.text = ''.join(self.text)
+            self.codes.feed(elem)
+            self.text = None
+
+@timed('attachment_fetch')
+def fetch_attachments(session, headers, attachments, store, endpoint=EWS_ENDPOINT,
+                      batch_size=ATTACHMENT_BATCH_SIZE, max_batch_bytes=ATTACHMENT_BATCH_BYTES):
+    """Download file attachments into the store with batched GetAttachment calls
+
+    `attachments` are reference dicts from GetItem's t:Attachments (see
+    ews_decode); each downloaded one gains its `sha256` and exact `size` in
+    place. References that already have a digest, and item attachments
+    (attached messages have no file body), are left alone. Attachments that
+    fail transiently are requested again, like GetItem items. Returns the set
+    of attachment ids that were given up on; their references keep no digest.
+    """
+    by_id = {}
+    for attachment in attachments:
+        if attachment.get('attachmentId') and not attachment.get('sha256') and not attachment.get('isItem'):
+            by_id.setdefault(attachment['attachmentId'], []).append(attachment)
+    entries = [(attachment_id, None, refs[0].get('size') or 0) for attachment_id, refs in by_id.items()]
+
+    def attempt(pending, codes):
+        attachment_ids = ''.join(f'<t:AttachmentId Id="{entry[0]}" />' for entry in pending)
+        parser = AttachmentResponseParser(store, codes)
+        response = session.post(endpoint, headers=headers, data=GET_ATTACHMENT_TEMPLATE.format(attachment_ids=attachment_ids),
+                                stream=True)
+
+        try:
+            if response.status_code != 200:
+                raise EwsRequestError(f"Received status code {response.status_code}: {response.text}")
+
+            try:
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    METRICS.count('bytes_received', len(chunk))
+                    parser.feed(chunk)
+                parser.close()
+            except STREAM_ERRORS + (xml.parsers.expat.ExpatError,) as e:
+                raise TruncatedResponse(f"Response cut short: {e}") from e
+        finally:
+            parser.abort()
+            response.close()
+
+            # Bodies stored before a cut are kept
+            for attachment_id, (digest, size) in parser.stored.items():
+                for attachment in by_id.get(attachment_id, []):
+                    attachment['sha256'] = digest
+                    attachment['size'] = size
+
+    # Imported here: ews_fetch imports this module for its GetItem batch fetchers
+    from ews_fetch import batch_item_ids
+    failed = set()
+    for batch in batch_item_ids(entries, batch_size=batch_size, max_batch_bytes=max_batch_bytes):
+        failed.update(entry[0] for entry in retry_failed_items(session, batch, attempt, 'GetAttachment'))
+    return failed
+
+def attachment_refs(record, store):
+    """Return the attachment reference dicts for a decoded EmailRecord
+
+    With MIME content ("full" profile) the bodies are extracted into the
+    store straight away; otherwise the t:Attachments metadata is copied
+    and fetch_attachments downloads the bodies afterwards.
+    """
+    if record.mime_content:
+        try:
+            return extract_mime_attachments(record.mime_content, store)
+        except Exception as e:
+            print(f"Error extracting attachments from MIME content: {e}")
+    return [dict(attachment) for attachment in record.attachments]
@@ -0,0 +1,182 @@
+import requests
+import xml.etree.ElementTree as ET
+import base64
+import os
+from xml.sax.saxutils import escape, quoteattr
+
+from ews_stream import EwsRequestError, TruncatedResponse, stream_soap, numbered_path
+
+# Constants
+EWS_ENDPOINT = os.environ.get('EWS_ENDPOINT', "https://ews.mail.us-east-1.awsapps.com/EWS/Exchange.asmx")
+EMAIL = os.environ.get('WORKMAIL_EMAIL', "j.black@weroofamerica.com")
+PASSWORD = os.environ.get('WORKMAIL_PASSWORD', "RestoreMastersLLC2024")
+
+# Number of items requested per FindItem page
+DEFAULT_PAGE_SIZE = 100
+
+# Times a FindItem page cut off part way is requested again
+DEFAULT_PAGE_RETRIES = 3
+
+# Maximum changes per SyncFolderItems call (the EWS limit is 512)
+DEFAULT_SYNC_CHANGES = 512
+
+# Well-known folder names EWS accepts as a DistinguishedFolderId
+DISTINGUISHED_FOLDERS = ('inbox', 'sentitems', 'drafts', 'deleteditems', 'junkemail', 'outbox', 'archiveinbox',
+                         'msgfolderroot')
+
+# Namespaces used in EWS SOAP responses
+NAMESPACES = {
+    'soap': 'http://schemas.xmlsoap.org/soap/envelope/',
+    't': 'http://schemas.microsoft.com/exchange/services/2006/types',
+    'm': 'http://schemas.microsoft.com/exchange/services/2006/messages'
+}
+
+def option_from_argv(argv, name, default=None):
+    """Return the value of a `--name VALUE` command-line option, or `default`"""
+    if name in argv:
+        index = argv.index(name)
+        if index + 1 < len(argv):
+            return argv[index + 1]
+    return default
+
+def qname(prefix, tag):
+    """Return the Clark-notation name ElementTree uses for `prefix:tag`"""
+    return f"{{{NAMESPACES[prefix]}}}{tag}"
+
+def folder_id_element(folder_id, mailbox=None):
+    """Return the ParentFolderIds/SyncFolderId child element for a folder
+
+    Distinguished names (see DISTINGUISHED_FOLDERS) become a
+    DistinguishedFolderId, scoped to `mailbox` for delegate access to another
+    user's mailbox; anything else is taken as a FolderId from FindFolder.
+    """
+    if folder_id.lower() in DISTINGUISHED_FOLDERS:
+        mailbox_element = f'<t:Mailbox><t:EmailAddress>{escape(mailbox)}</t:EmailAddress></t:Mailbox>' if mailbox else ''
+        return f'<t:DistinguishedFolderId Id="{folder_id.lower()}">{mailbox_element}</t:DistinguishedFolderId>'
+    return f'<t:FolderId Id={quoteattr(folder_id)} />'
+
+def create_auth_headers(email=EMAIL, password=PASSWORD):
+    """Create authentication headers for EWS requests"""
+    auth_string = f"{email}:{password}"
+    auth_bytes = auth_string.encode('ascii')
+    base64_bytes = base64.b64encode(auth_bytes)
+    base64_auth = base64_bytes.decode('ascii')
+
+    return {
+        'Content-Type': 'text/xml; charset=utf-8',
+        'Authorization': f'Basic {base64_auth}'
+    }
+
+def crawl_folder(template, headers, page_size=DEFAULT_PAGE_SIZE, endpoint=EWS_ENDPOINT, session=None, tee_path=None,
+                 template_fields=None, item_tags=None):
+    """Walk a folder with paged FindItem requests, yielding each t:Message element as it is parsed
+
+    `template` is a FindItem envelope containing `{page_size}` and `{offset}`
+    placeholders in its IndexedPageItemView; any other placeholders (such as
+    `{item_shape}`) are filled from `template_fields`. Paging follows the RootFolder's
+    IncludesLastItemInRange / IndexedPagingOffset attributes. Responses are
+    decoded incrementally and each element is discarded once the caller moves
+    on, so memory stays bounded by one message rather than one page.
+    Pass a `session` to reuse its keep-alive connections across pages, and a
+    `tee_path` to save each raw page (page N goes to `name.N.xml`).
+    The same paging drives FindFolder when `item_tags` is e.g. {qname('t', 'Folder')}.
+    A page that fails raises EwsRequestError rather than ending the crawl
+    early; one cut off part way is requested again up to DEFAULT_PAGE_RETRIES times.
+    """
+    post = session.post if session is not None else requests.post
+    item_tags = item_tags or {qname('t', 'Message')}
+    root_folder_tag = qname('m', 'RootFolder')
+    tags = set(item_tags) | {root_folder_tag, qname('m', 'ResponseCode')}
+    offset = 0
+    page_number = 0
+
+    while True:
+        page_number += 1
+        request_body = template.format(page_size=page_size, offset=offset, **(template_fields or {}))
+        root_folder = None
+        response_code = None
+        count = 0
+
+        for retry in range(DEFAULT_PAGE_RETRIES + 1):
+            # A page cut off part way is requested again, skipping the items already yielded from it
+            seen = 0
+            try:
+                for elem in stream_soap(post, endpoint, headers, request_body, tags, numbered_path(tee_path, page_number)):
+                    if elem.tag in item_tags:
+                        seen += 1
+                        if seen > count:
+                            count += 1
+                            yield elem
+                    elif elem.tag == root_folder_tag:
+                        root_folder = dict(elem.attrib)
+                    else:
+                        response_code = elem.text
+                break
+            except TruncatedResponse as e:
+                if retry == DEFAULT_PAGE_RETRIES:
+                    raise
+                print(f"Find page {page_number} was cut short after {count} items ({e}); requesting it again")
+
+        if root_folder is None:
+            raise EwsRequestError(f"Find page {page_number} returned no RootFolder ({response_code or 'Unknown'})")
+
+        total = root_folder.get('TotalItemsInView')
+        print(f"Page {page_number}: {count} items at offset {offset} (total in view: {total})")
+
+        # Stop at the end of the folder, or if the server stops handing out items
+        if root_folder.get('IncludesLastItemInRange', 'true').lower() == 'true' or not count:
+            return
+
+        next_offset = root_folder.get('IndexedPagingOffset')
+        offset = int(next_offset) if next_offset is not None else offset + count
+
+def sync_folder_items(template, headers, sync_state=None, max_changes=DEFAULT_SYNC_CHANGES, endpoint=EWS_ENDPOINT, session=None):
+    """Drain a folder's change log with SyncFolderItems, yielding (changes, sync_state) per round
+
+    `template` is a SyncFolderItems envelope with `{sync_state}` and
+    `{max_changes}` placeholders. Each change is a dict with `type` (Create,
+    Update, Delete or ReadFlagChange), `id`, `changeKey` and, for read flag
+    changes, `isRead`. The caller should persist the yielded sync_state only
+    after applying that round's changes, so an interrupted run resumes cleanly.
+    Without a starting sync_state every item in the folder comes back as a Create.
+    A failed call raises EwsRequestError.
+    """
+    post = session.post if session is not None else requests.post
+
+    while True:
+        sync_state_element = f'<m:SyncState>{sync_state}</m:SyncState>' if sync_state else ''
+        request_body = template.format(sync_state=sync_state_element, max_changes=max_changes)
+        response = post(endpoint, headers=headers, data=request_body)
+
+        if response.status_code != 200:
+            raise EwsRequestError(f"Received status code {response.status_code} from SyncFolderItems: {response.text}")
+
+        root = ET.fromstring(response.content)
+        message = root.find('.//m:SyncFolderItemsResponseMessage', NAMESPACES)
+        response_code = message.find('m:ResponseCode', NAMESPACES) if message is not None else None
+
+        if response_code is None or response_code.text != 'NoError':
+            code = response_code.text if response_code is not None else 'Unknown'
+            raise EwsRequestError(f"SyncFolderItems failed ({code})")
+
+        changes = []
+        changes_elem = message.find('m:Changes', NAMESPACES)
+        for change in (changes_elem if changes_elem is not None else []):
+            change_type = change.tag.split('}')[-1]
+            item_id = change.find('.//t:ItemId', NAMESPACES)
+            if item_id is None:
+                continue
+
+            entry = {'type': change_type, 'id': item_id.get('Id'), 'changeKey': item_id.get('ChangeKey')}
+            if change_type == 'ReadFlagChange':
+                is_read = change.find('t:IsRead', NAMESPACES)
+                entry['isRead'] = is_read is not None and is_read.text.lower() == 'true'
+            changes.append(entry)
+
+        sync_state = message.find('m:SyncState', NAMESPACES).text
+        includes_last = message.find('m:IncludesLastItemInRange', NAMESPACES)
+
+        yield changes, sync_state
+
+        if includes_last is None or includes_last.text.lower() == 'true':
+            return
@@ -0,0 +1,315 @@
+import calendar
+import re
+import sys
+import time
+import zlib
+from array import array
+
+from ews_client import option_from_argv
+from ews_sinks import open_sink, iter_records
+
+# An id shares its pooled prefix only if at least this much is common with the previous id
+MIN_ID_PREFIX = 32
+
+# Subjects are zlib-compressed this many rows at a time
+SUBJECT_BLOCK = 128
+
+# Only timestamps in exactly this form are stored as epoch seconds; anything else is kept verbatim
+TIMESTAMP_PATTERN = re.compile(r'\d{4}-\d\d-\d\dT\d\d:\d\d:\d\dZ\Z')
+TIMESTAMP_FORMAT = '%04d-%02d-%02dT%02d:%02d:%02dZ'
+
+# Fields stored as columns, in output order; anything else goes to a sparse per-row dict
+# (displayTo is what FindItem listings call the to field)
+INTERNED_FIELDS = ('from', 'fromName', 'to', 'displayTo')
+TIMESTAMP_FIELDS = ('receivedDate', 'sentDate')
+FLAG_FIELDS = ('hasAttachments', 'isRead')
+OPTIONAL_FIELDS = ('mailbox', 'folder')
+COLUMN_FIELDS = ('id', 'subject') + INTERNED_FIELDS + TIMESTAMP_FIELDS + FLAG_FIELDS + OPTIONAL_FIELDS + ('recipients',)
+
+# One bit per column field in a row's presence mask, so keys an email did not have stay absent
+FIELD_BITS = {field: 1 << position for position, field in enumerate(COLUMN_FIELDS)}
+
+# Recipient dicts with exactly these keys are pooled as (type, name, address) tuples
+RECIPIENT_KEYS = {'type', 'address', 'name'}
+
+def parse_timestamp(value):
+    """Epoch seconds for an EWS 'YYYY-MM-DDTHH:MM:SSZ' timestamp, or None if it cannot be stored as one"""
+    if not isinstance(value, str) or not TIMESTAMP_PATTERN.match(value):
+        return None
+    seconds = calendar.timegm((int(value[0:4]), int(value[5:7]), int(value[8:10]),
+                               int(value[11:13]), int(value[14:16]), int(value[17:19])))
+    # 0 marks a missing value and the column is unsigned 32-bit
+    return seconds if 0 < seconds < 2 ** 32 else None
+
+def deep_size(value):
+    """sys.getsizeof of a value plus everything its dicts, lists and tuples hold"""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(deep_size(key) + deep_size(item) for key, item in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(deep_size(item) for item in value)
+    return size
+
+class StringPool:
+    """Interned strings addressed by small ints; 0 stands for None"""
+
+    __slots__ = ('values', 'indexes')
+
+    def __init__(self):
+        self.values = [None]
+        self.indexes = {None: 0}
+
+    def add(self, value):
+        index = self.indexes.get(value)
+        if index is None:
+            index = self.indexes[value] = len(self.values)
+            self.values.append(value)
+        return index
+
+    def __getitem__(self, index):
+        return self.values[index]
+
+class EmailTable:
+    """Compact, append-only columnar store for large sets of email dicts
+
+    Each field is a column rather than a key in a per-email dict:
+
+    - ids are split into a pooled prefix (WorkMail ItemIds in one folder
+      share ~200 of their ~216 characters) and a short suffix in one buffer;
+    - from / fromName / to / displayTo (and mailbox / folder) are interned in pools;
+    - subjects are zlib-compressed SUBJECT_BLOCK rows at a time;
+    - receivedDate / sentDate are epoch seconds in an array('I');
+    - hasAttachments / isRead are one bit each;
+    - recipients are (type, name, address) tuples interned in a pool, each
+      row's run of pool indexes delimited by an offsets array.
+
+    A 16-bit mask per row records which of these keys the email had, so
+    indexing and iteration rebuild dicts equal to the ones that went in.
+    Other keys (body, attachments...) and values a column cannot hold
+    exactly are kept as-is in a sparse side table.
+    """
+
+    __slots__ = ('id_prefixes', 'id_prefix_column', 'id_suffixes', 'id_offsets', 'last_id',
+                 'subject_blocks', 'open_subjects', 'cached_block', 'pools', 'interned', 'timestamps', 'flags',
+                 'recipient_pool', 'recipient_ids', 'recipient_offsets', 'present', 'extras', 'count')
+
+    def __init__(self, emails=()):
+        self.id_prefixes = StringPool()
+        self.id_prefix_column = array('I')
+        self.id_suffixes = bytearray()
+        self.id_offsets = array('I', [0])
+        self.last_id = ''
+        self.subject_blocks = []
+        self.open_subjects = []
+        self.cached_block = (None, None)
+        self.pools = {field: StringPool() for field in INTERNED_FIELDS + OPTIONAL_FIELDS}
+        self.interned = {field: array('I') for field in INTERNED_FIELDS + OPTIONAL_FIELDS}
+        self.timestamps = {field: array('I') for field in TIMESTAMP_FIELDS}
+        self.flags = {field: bytearray() for field in FLAG_FIELDS}
+        self.recipient_pool = StringPool()
+        self.recipient_ids = array('I')
+        self.recipient_offsets = array('I', [0])
+        self.present = array('H')
+        self.extras = {}
+        self.count = 0
+        self.extend(emails)
+
+    def append(self, email):
+        row = self.count
+        mask = 0
+        extra = {}
+        for key, value in email.items():
+            bit = FIELD_BITS.get(key)
+            if bit is None:
+                extra[key] = value
+            else:
+                mask |= bit
+
+        # Values a column cannot give back exactly go to the extras, which take precedence
+        email_id = email.get('id')
+        if not isinstance(email_id, str):
+            if 'id' in email:
+                extra['id'] = email_id
+            email_id = ''
+        self._append_id(email_id)
+
+        subject = email.get('subject')
+        if subject is not None and (not isinstance(subject, str) or '\x00' in subject or subject == '\x01'):
+            extra['subject'] = subject
+            subject = None
+        self._append_subject(subject)
+
+        for field in INTERNED_FIELDS + OPTIONAL_FIELDS:
+            value = email.get(field)
+            if value is not None and not isinstance(value, str):
+                extra[field] = value
+                value = None
+            self.interned[field].append(self.pools[field].add(value))
+
+        for field in TIMESTAMP_FIELDS:
+            value = email.get(field)
+            seconds = parse_timestamp(value) if value is not None else 0
+            if seconds is None:
+                extra[field] = value
+                seconds = 0
+            self.timestamps[field].append(seconds)
+
+        if row % 8 == 0:
+            for field in FLAG_FIELDS:
+                self.flags[field].append(0)
+        for field in FLAG_FIELDS:
+            value = email.get(field)
+            if value is True:
+                self.flags[field][row // 8] |= 1 << (row % 8)
+            elif value is not False and field in email:
+                extra[field] = value
+
+        if 'recipients' in email and not self._append_recipients(email['recipients']):
+            extra['recipients'] = email['recipients']
+        self.recipient_offsets.append(len(self.recipient_ids))
+
+        self.present.append(mask)
+        if extra:
+            self.extras[row] = extra
+        self.count += 1
+
+    def extend(self, emails):
+        for email in emails:
+            self.append(email)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, row):
+        if row < 0:
+            row += self.count
+        if not 0 <= row < self.count:
+            raise IndexError('EmailTable index out of range')
+
+        mask = self.present[row]
+        email = {field: self._value(row, field) for field in COLUMN_FIELDS if mask & FIELD_BITS[field]}
+        email.update(self.extras.get(row, ()))
+        return email
+
+    def __iter__(self):
+        for row in range(self.count):
+            yield self[row]
+
+    def column(self, field):
+        """Yield one field for every row (None where missing) without building the other fields"""
+        bit = FIELD_BITS.get(field, 0)
+        for row in range(self.count):
+            value = self._value(row, field) if self.present[row] & bit else None
+            yield self.extras.get(row, {}).get(field, value)
+
+    def write(self, path):
+        """Export as JSON / JSON Lines (any ews_sinks format), one dict per row"""
+        with open_sink(path, checkpoint_every=0) as sink:
+            for email in self:
+                sink.write(email)
+
+    def nbytes(self):
+        """Approximate bytes held by the table: columns, pools and the extras side table"""
+        columns = [self.id_prefix_column, self.id_suffixes, self.id_offsets, self.recipient_ids,
+                   self.recipient_offsets, self.present]
+        columns += list(self.interned.values()) + list(self.timestamps.values()) + list(self.flags.values())
+        total = sum(sys.getsizeof(column) for column in columns)
+        total += deep_size(self.subject_blocks) + deep_size(self.open_subjects)
+        for pool in [self.id_prefixes, self.recipient_pool] + list(self.pools.values()):
+            total += deep_size(pool.values) + sys.getsizeof(pool.indexes)
+        return total + deep_size(self.extras)
+
+    def _value(self, row, field):
+        """The column value of `field` for a row that has it"""
+        if field in self.interned:
+            return self.pools[field][self.interned[field][row]]
+        if field in self.timestamps:
+            seconds = self.timestamps[field][row]
+            return TIMESTAMP_FORMAT % time.gmtime(seconds)[:6] if seconds else None
+        if field in self.flags:
+            return bool(self.flags[field][row // 8] >> (row % 8) & 1)
+        if field == 'id':
+            return self._id(row)
+        if field == 'subject':
+            return self._subject(row)
+        if field == 'recipients':
+            return self._recipients(row)
+        return None
+
+    def _append_id(self, email_id):
+        prefix_index = self.id_prefix_column[-1] if self.count else 0
+        prefix = self.id_prefixes[prefix_index] or ''
+        if not prefix or not email_id.startswith(prefix):
+            # Start a new prefix from what this id shares with the previous one
+            shared = 0
+            for a, b in zip(email_id, self.last_id):
+                if a != b:
+                    break
+                shared += 1
+            prefix = email_id[:shared] if shared >= MIN_ID_PREFIX else ''
+            prefix_index = self.id_prefixes.add(prefix or None)
+
+        self.id_prefix_column.append(prefix_index)
+        self.id_suffixes += email_id[len(prefix):].encode('utf-8')
+        self.id_offsets.append(len(self.id_suffixes))
+        self.last_id = email_id
+
+    def _id(self, row):
+        prefix = self.id_prefixes[self.id_prefix_column[row]] or ''
+        return prefix + self.id_suffixes[self.id_offsets[row]:self.id_offsets[row + 1]].decode('utf-8')
+
+    def _append_subject(self, subject):
+        # NUL cannot appear in XML text, so it separates subjects; \x01 marks a missing one
+        self.open_subjects.append('\x01' if subject is None else subject)
+        if len(self.open_subjects) == SUBJECT_BLOCK:
+            self.subject_blocks.append(zlib.compress('\x00'.join(self.open_subjects).encode('utf-8')))
+            self.open_subjects = []
+
+    def _subject(self, row):
+        block, position = divmod(row, SUBJECT_BLOCK)
+        if block == len(self.subject_blocks):
+            subject = self.open_subjects[position]
+        else:
+            if self.cached_block[0] != block:
+                self.cached_block = (block, zlib.decompress(self.subject_blocks[block]).decode('utf-8').split('\x00'))
+            subject = self.cached_block[1][position]
+        return None if subject == '\x01' else subject
+
+    def _append_recipients(self, recipients):
+        """Pool a recipients list; returns False, storing nothing, unless it holds only plain recipient dicts"""
+        if not isinstance(recipients, list):
+            return False
+        entries = []
+        for recipient in recipients:
+            if not isinstance(recipient, dict) or recipient.keys() != RECIPIENT_KEYS:
+                return False
+            entry = (recipient['type'], recipient['name'], recipient['address'])
+            if not all(value is None or isinstance(value, str) for value in entry):
+                return False
+            entries.append(entry)
+        self.recipient_ids.extend(self.recipient_pool.add(entry) for entry in entries)
+        return True
+
+    def _recipients(self, row):
+        indexes = self.recipient_ids[self.recipient_offsets[row]:self.recipient_offsets[row + 1]]
+        return [{'type': recipient_type, 'address': address, 'name': name}
+                for recipient_type, name, address in (self.recipient_pool[index] for index in indexes)]
+
+def load_table(path):
+    """Read an export (any ews_sinks format) into an EmailTable"""
+    return EmailTable(iter_records(path))
+
+if __name__ == "__main__":
+    # Load an export into an EmailTable and report how much smaller it is held
+    input_path = option_from_argv(sys.argv, '--input', 'ews_detailed_emails.json')
+
+    start = time.perf_counter()
+    table = load_table(input_path)
+    print(f"Loaded {len(table)} emails from {input_path} in {time.perf_counter() - start:.2f}s")
+    print(f"Table holds about {table.nbytes() / 1024:.1f} KB "
+          f"({table.nbytes() / max(1, len(table)):.0f} bytes per email, {len(table.extras)} rows with extra fields)")
+
+    output_path = option_from_argv(sys.argv, '--output')
+    if output_path:
+        table.write(output_path)
+        print(f"Exported to {output_path}")
@@ -0,0 +1,372 @@
+import json
+import sys
+import threading
+from collections import Counter
+
+from ews_client import (
+    EMAIL, PASSWORD, DEFAULT_PAGE_SIZE, DISTINGUISHED_FOLDERS,
+    create_auth_headers, crawl_folder, folder_id_element, qname, option_from_argv
+)
+from ews_store import DEFAULT_STORE_PATH, MessageStore
+from ews_stream import EwsRequestError
+from ews_sinks import open_sink
+from ews_profiles import DETAILED_PROFILE, INDEX_PROFILE, get_profile, fetches_body, build_item_shape, profile_from_argv
+from ews_fetch import (
+    DEFAULT_BATCH_SIZE, DEFAULT_MAX_BATCH_BYTES, DEFAULT_PER_MAILBOX,
+    create_session, batch_item_ids, fetch_round_robin, iter_folder_item_ids, fetch_detailed_batch, fetch_with_store,
+    ItemsNotFetched
+)
+from ews_metrics import instrument
+from ews_loader import EmailLoader
+from ews_attachments import AttachmentStore
+from ews_search import SearchIndex
+
+# SOAP template for a paged FindFolder listing every folder below the mailbox root
+FIND_FOLDER_TEMPLATE = """<?xml version="1.0" encoding="utf-8"?>
+<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/"
+               xmlns:t="http://schemas.microsoft.com/exchange/services/2006/types"
+               xmlns:m="http://schemas.microsoft.com/exchange/services/2006/messages">
+  <soap:Header>
+    <t:RequestServerVersion Version="Exchange2010_SP2" />
+  </soap:Header>
+  <soap:Body>
+    <m:FindFolder Traversal="Deep">
+      <m:FolderShape>
+        <t:BaseShape>IdOnly</t:BaseShape>
+        <t:AdditionalProperties>
+          <t:FieldURI FieldURI="folder:DisplayName" />
+          <t:FieldURI FieldURI="folder:FolderClass" />
+          <t:FieldURI FieldURI="folder:TotalCount" />
+          <t:FieldURI FieldURI="folder:ParentFolderId" />
+        </t:AdditionalProperties>
+      </m:FolderShape>
+      <m:IndexedPageFolderView MaxEntriesReturned="{page_size}" Offset="{offset}" BasePoint="Beginning" />
+      <m:ParentFolderIds>
+        {folder_id}
+      </m:ParentFolderIds>
+    </m:FindFolder>
+  </soap:Body>
+</soap:Envelope>"""
+
+# Accounts file: a JSON list of {"email", "password", "folders"} objects.
+# Accounts without a password are opened as a delegate of WORKMAIL_EMAIL.
+ACCOUNTS_PATH = 'ews_accounts.json'
+OUTPUT_PATH = 'ews_crawl_emails.jsonl'
+
+# Folders crawled when neither the account nor --folders names any;
+# '*' stands for every mail (IPF.Note) folder FindFolder returns
+DEFAULT_FOLDERS = ('inbox', 'sentitems')
+
+# Total concurrent EWS requests across all mailboxes
+DEFAULT_CONNECTIONS = 16
+
+class CrawlFailed(EwsRequestError):
+    """Some folders or batches could not be crawled
+
+    Raised once everything that could be fetched has been yielded.
+    `failures` lists {'mailbox', 'folder', 'error'} dicts; `folder` is None
+    when the mailbox's folder list itself could not be read.
+    """
+
+    def __init__(self, failures):
+        super().__init__(f"{len(failures)} folders or batches failed")
+        self.failures = failures
+
+def load_accounts(path=ACCOUNTS_PATH, folders=None):
+    """Read the accounts file, or fall back to the single WORKMAIL_EMAIL account
+
+    `folders` is used for any account that does not list its own.
+    """
+    folders = list(folders or DEFAULT_FOLDERS)
+    if path is None:
+        return [{'email': EMAIL, 'password': PASSWORD, 'folders': folders}]
+
+    with open(path) as f:
+        accounts = json.load(f)
+
+    for account in accounts:
+        account.setdefault('folders', folders)
+    return accounts
+
+def account_headers(account):
+    """Return (headers, delegate mailbox) for an account entry"""
+    if account.get('password'):
+        return create_auth_headers(account['email'], account['password']), None
+    return create_auth_headers(), account['email']
+
+def list_folders(session, headers, mailbox=None, page_size=DEFAULT_PAGE_SIZE):
+    """List every folder below the mailbox root with FindFolder
+
+    Returns dicts with `id`, `name`, `path` (display names joined with '/'),
+    `folderClass` and `totalCount`.
+    """
+    text = lambda elem, tag: elem.findtext(qname('t', tag))
+    folders = []
+
+    for elem in crawl_folder(FIND_FOLDER_TEMPLATE, headers, page_size=page_size, session=session,
+                             template_fields={'folder_id': folder_id_element('msgfolderroot', mailbox)},
+                             item_tags={qname('t', 'Folder')}):
+        folder_id = elem.find(qname('t', 'FolderId'))
+        parent_id = elem.find(qname('t', 'ParentFolderId'))
+        folders.append({
+            'id': folder_id.get('Id') if folder_id is not None else None,
+            'parentId': parent_id.get('Id') if parent_id is not None else None,
+            'name': text(elem, 'DisplayName') or '',
+            'folderClass': text(elem, 'FolderClass'),
+            'totalCount': int(text(elem, 'TotalCount') or 0)
+        })
+
+    # Build "Parent/Child" paths from the parent links; the root itself is not listed
+    by_id = {folder['id']: folder for folder in folders}
+    for folder in folders:
+        names = [folder['name']]
+        parent = by_id.get(folder['parentId'])
+        while parent is not None and len(names) < len(folders):
+            names.append(parent['name'])
+            parent = by_id.get(parent['parentId'])
+        folder['path'] = '/'.join(reversed(names))
+
+    return folders
+
+def resolve_folders(specs, session, headers, mailbox=None):
+    """Turn folder specs into (label, folder id element) pairs
+
+    A spec is a distinguished folder name (inbox, sentitems, ...), a display
+    name or "Parent/Child" path (case-insensitive), or '*' for every mail
+    folder. FindFolder is only called when a spec needs it.
+    """
+    resolved = []
+    listed = None
+
+    for spec in specs:
+        if spec.lower() in DISTINGUISHED_FOLDERS:
+            resolved.append((spec.lower(), folder_id_element(spec, mailbox)))
+            continue
+
+        if listed is None:
+            listed = list_folders(session, headers, mailbox)
+
+        if spec == '*':
+            matches = [folder for folder in listed if (folder['folderClass'] or 'IPF.Note').startswith('IPF.Note')]
+        else:
+            matches = [folder for folder in listed if spec.lower() in (folder['path'].lower(), folder['name'].lower())]
+
+        if not matches:
+            print(f"Warning: no folder named '{spec}' in {mailbox or 'the mailbox'}")
+        for folder in matches:
+            resolved.append((folder['path'], folder_id_element(folder['id'])))
+
+    # The same folder may be named twice (e.g. by name and by path)
+    unique = {}
+    for label, element in resolved:
+        unique.setdefault(element, label)
+    return [(label, element) for element, label in unique.items()]
+
+def account_sessions(accounts, connections=DEFAULT_CONNECTIONS, per_mailbox=DEFAULT_PER_MAILBOX):
+    """Return a session for each account, shared only by accounts that sign in with the same credentials
+
+    EWS throttles per account, so each set of credentials gets its own
+    ConcurrencyController: an ErrorServerBusy (and its BackOffMilliseconds
+    pause) for one account does not slow down the others. Delegate
+    mailboxes opened through WORKMAIL_EMAIL all share its session.
+    """
+    credentials = [account_headers(account)[0]['Authorization'] for account in accounts]
+    sharing = Counter(credentials)
+    sessions = {}
+    for key in credentials:
+        if key not in sessions:
+            sessions[key] = create_session(min(connections, per_mailbox * sharing[key]))
+    return [sessions[key] for key in credentials]
+
+class MailboxCrawl:
+    """One account's folders, handed out to the scheduler one GetItem batch at a time
+
+    Batches come from a single generator that pages through each folder in
+    turn; a lock lets several worker threads take batches from the same
+    mailbox, so its next FindItem page overlaps with GetItem for earlier ones.
+    Folders and batches that fail are recorded in `failures` (see CrawlFailed).
+    """
+
+    def __init__(self, account, session, page_size=DEFAULT_PAGE_SIZE, batch_size=DEFAULT_BATCH_SIZE,
+                 max_batch_bytes=DEFAULT_MAX_BATCH_BYTES):
+        self.email = account['email']
+        self.folders = account['folders']
+        self.headers, self.mailbox = account_headers(account)
+        self.session = session
+        self.page_size = page_size
+        self.batch_size = batch_size
+        self.max_batch_bytes = max_batch_bytes
+        self.lock = threading.Lock()
+        self.failures = []
+        self.batches = self._iter_batches()
+
+    def fail(self, folder, error):
+        print(f"Error crawling {self.email} / {folder or '(folder list)'}: {error}")
+        self.failures.append({'mailbox': self.email, 'folder': folder, 'error': str(error)})
+
+    def _iter_batches(self):
+        try:
+            folders = resolve_folders(self.folders, self.session, self.headers, self.mailbox)
+        except Exception as e:
+            self.fail(None, e)
+            return
+
+        for label, folder_element in folders:
+            print(f"Crawling {self.email} / {label}")
+            try:
+                item_ids = iter_folder_item_ids(self.session, self.headers, folder_element, page_size=self.page_size)
+                for batch in batch_item_ids(item_ids, batch_size=self.batch_size,
+                                            max_batch_bytes=self.max_batch_bytes):
+                    yield label, batch
+            except Exception as e:
+                # Move on to the mailbox's next folder rather than dropping the mailbox
+                self.fail(label, e)
+
+    def next_batch(self):
+        """Return the next (folder label, item ids) batch, or None when every folder is done"""
+        with self.lock:
+            return next(self.batches, None)
+
+def iter_mailbox_emails(accounts, page_size=DEFAULT_PAGE_SIZE, batch_size=DEFAULT_BATCH_SIZE,
+                        max_batch_bytes=DEFAULT_MAX_BATCH_BYTES, connections=DEFAULT_CONNECTIONS,
+                        per_mailbox=DEFAULT_PER_MAILBOX, profile=DETAILED_PROFILE, store_path=DEFAULT_STORE_PATH,
+                        attachments_path=None):
+    """Yield detailed emails from every folder of every account, tagged with `mailbox` and `folder`
+
+    All mailboxes share `connections` worker threads; each set of
+    credentials has its own pooled session and throttling (account_sessions).
+    Threads are handed to mailboxes in round-robin order with at most
+    `per_mailbox` requests in flight against any one of them, so total time
+    scales with the connections available rather than with mailboxes x folders.
+    Emails arrive in completion order; within a batch they keep folder order.
+    With `attachments_path` attachment bodies from every mailbox go to one
+    content-addressed directory, so a file sent to several people is kept once.
+    Failed folders and batches don't stop the other mailboxes; they are raised
+    together as CrawlFailed at the end.
+    """
+    sessions = account_sessions(accounts, connections=connections, per_mailbox=per_mailbox)
+    store = MessageStore(store_path) if store_path else None
+    attachment_store = AttachmentStore(attachments_path) if attachments_path else None
+    store_profile = f"{profile}+attachments" if attachment_store else profile
+    item_shape = build_item_shape(profile, attachments=attachment_store is not None)
+    if not get_profile(profile)['mime']:
+        max_batch_bytes = None
+
+    crawls = [MailboxCrawl(account, session, page_size=page_size, batch_size=batch_size,
+                           max_batch_bytes=max_batch_bytes) for account, session in zip(accounts, sessions)]
+
+    def fetch_next(crawl):
+        batch = crawl.next_batch()
+        if batch is None:
+            return None
+
+        label, item_ids = batch
+        try:
+            if store is not None:
+                emails = fetch_with_store(store, crawl.session, crawl.headers, item_ids, item_shape, store_profile,
+                                          attachment_store=attachment_store)
+            else:
+                emails = fetch_detailed_batch(crawl.session, crawl.headers, item_ids, item_shape,
+                                              attachment_store=attachment_store)
+        except ItemsNotFetched as e:
+            crawl.fail(label, e)
+            emails = e.emails
+        except Exception as e:
+            crawl.fail(label, e)
+            return []
+
+        return [dict(email, mailbox=crawl.email, folder=label) for email in emails]
+
+    try:
+        for _, emails in fetch_round_robin(crawls, fetch_next, workers=connections, per_source=per_mailbox):
+            for email in emails:
+                yield email
+    finally:
+        for session in set(sessions):
+            session.close()
+        if store is not None:
+            store.close()
+
+    failures = [failure for crawl in crawls for failure in crawl.failures]
+    if failures:
+        raise CrawlFailed(failures)
+
+if __name__ == "__main__":
+    folders = option_from_argv(sys.argv, '--folders')
+    folders = folders.split(',') if folders else None
+    accounts = load_accounts(option_from_argv(sys.argv, '--accounts'), folders)
+
+    # --list-folders prints each mailbox's folder tree and exits
+    if '--list-folders' in sys.argv:
+        session = create_session(1)
+        for account in accounts:
+            headers, mailbox = account_headers(account)
+            print(f"\n{account['email']}:")
+            for folder in list_folders(session, headers, mailbox):
+                print(f"  {folder['path']} ({folder['folderClass']}, {folder['totalCount']} items)")
+        session.close()
+        sys.exit(0)
+
+    output_path = option_from_argv(sys.argv, '--output', OUTPUT_PATH)
+    connections = int(option_from_argv(sys.argv, '--connections', DEFAULT_CONNECTIONS))
+    per_mailbox = int(option_from_argv(sys.argv, '--per-mailbox', DEFAULT_PER_MAILBOX))
+    store_path = None if '--no-cache' in sys.argv else DEFAULT_STORE_PATH
+
+    # --attachments DIR saves attachment bodies there, content-addressed; emails keep references
+    attachments_path = option_from_argv(sys.argv, '--attachments')
+
+    # --index PATH adds every email to a local full-text search index (see ews_search.py)
+    index_path = option_from_argv(sys.argv, '--index')
+    search_index = SearchIndex(index_path) if index_path else None
+
+    # Indexing defaults to the body profile; other profiles only index subjects, senders and recipients
+    profile = profile_from_argv(sys.argv, INDEX_PROFILE if index_path else DETAILED_PROFILE)
+    if index_path and not fetches_body(profile):
+        print(f"Warning: the {profile} profile fetches no body, so --index will not cover body text")
+
+    # --db TARGET also loads every email into the app's tables (Postgres URL or SQLite path)
+    db_target = option_from_argv(sys.argv, '--db')
+    loader = EmailLoader(db_target) if db_target else None
+
+    print(f"Crawling {len(accounts)} mailboxes with {connections} connections ({per_mailbox} per mailbox)...")
+    counts = Counter()
+
+    instrumentation = instrument(metrics_path=option_from_argv(sys.argv, '--metrics'),
+                                 trace_mode=option_from_argv(sys.argv, '--trace'), stats='--stats' in sys.argv)
+
+    # A failed folder or batch leaves the sink's checkpoint in place and the run exits non-zero
+    failures = []
+    try:
+        with instrumentation, open_sink(output_path) as sink:
+            for email in iter_mailbox_emails(accounts, connections=connections, per_mailbox=per_mailbox,
+                                             profile=profile,
+                                             store_path=store_path, attachments_path=attachments_path):
+                sink.write(email)
+                if loader is not None:
+                    loader.add(email)
+                if search_index is not None:
+                    search_index.add(email)
+                counts[(email['mailbox'], email['folder'])] += 1
+    except CrawlFailed as e:
+        failures = e.failures
+
+    if loader is not None:
+        loader.close()
+        print(f"Loaded {loader.counts['emails']} emails and {loader.counts['recipients']} recipients into the database")
+    if search_index is not None:
+        search_index.close()
+        print(f"Search index updated: {index_path}")
+
+    print("\nEmails per mailbox and folder:")
+    for (mailbox, folder), count in sorted(counts.items()):
+        print(f"  {mailbox} / {folder}: {count}")
+    if failures:
+        print("\nFailed folders and batches:")
+        for failure in failures:
+            print(f"  {failure['mailbox']} / {failure['folder'] or '(folder list)'}: {failure['error']}")
+    print(f"\nRetrieved {sum(counts.values())} emails from {len(accounts)} mailboxes")
+
+    if failures:
+        print(f"Incomplete results saved to {output_path}; {len(failures)} folders or batches failed")
+        sys.exit(1)
+    print(f"Full results saved to {output_path}")
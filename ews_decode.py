@@ -0,0 +1,181 @@
+import logging
+from dataclasses import dataclass, field
+
+from ews_client import qname
+from ews_mime import extract_mime_addresses, addresses_from_headers, pick_sender
+from ews_metrics import timed
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class EmailRecord:
+    """Typed view of the t:Message properties the scripts use"""
+    id: str = None
+    change_key: str = None
+    subject: str = None
+    from_name: str = ''
+    from_address: str = ''
+    display_to: str = None
+    display_cc: str = None
+    received_date: str = None
+    sent_date: str = None
+    has_attachments: bool = False
+    is_read: bool = False
+    size: int = None
+    importance: str = None
+    internet_message_id: str = None
+    received_by_name: str = ''
+    received_by_address: str = ''
+    internet_headers: list = field(default_factory=list)
+    body: str = None
+    mime_content: str = None
+    # Metadata from t:Attachments; the bodies are fetched separately (ews_attachments)
+    attachments: list = field(default_factory=list)
+    # Address headers parsed out of mime_content, filled on first use
+    mime_addresses: dict = None
+
+def _text(record_field):
+    """Decoder that stores the element text on `record_field`"""
+    def decode(record, elem):
+        setattr(record, record_field, elem.text)
+    return decode
+
+def _flag(record_field):
+    """Decoder that stores an xs:boolean element on `record_field`"""
+    def decode(record, elem):
+        setattr(record, record_field, (elem.text or '').lower() == 'true')
+    return decode
+
+def _mailbox(name_field, address_field):
+    """Decoder for a t:Mailbox wrapper such as t:From or t:ReceivedBy"""
+    name_tag = qname('t', 'Name')
+    address_tag = qname('t', 'EmailAddress')
+
+    def decode(record, elem):
+        for mailbox in elem:
+            for part in mailbox:
+                if part.tag == name_tag and part.text:
+                    setattr(record, name_field, part.text)
+                elif part.tag == address_tag and part.text:
+                    setattr(record, address_field, part.text)
+    return decode
+
+def _item_id(record, elem):
+    record.id = elem.get('Id')
+    record.change_key = elem.get('ChangeKey')
+
+def _size(record, elem):
+    record.size = int(elem.text) if elem.text else None
+
+def _internet_headers(record, elem):
+    record.internet_headers = [(header.get('HeaderName'), header.text) for header in elem]
+
+# t:FileAttachment / t:ItemAttachment children copied onto attachment reference dicts
+ATTACHMENT_FIELDS = {
+    qname('t', 'Name'): 'name',
+    qname('t', 'ContentType'): 'contentType',
+    qname('t', 'ContentId'): 'contentId'
+}
+
+def _attachments(record, elem):
+    record.attachments = []
+    for attachment in elem:
+        reference = {'attachmentId': None, 'name': None, 'contentType': None, 'size': None, 'contentId': None,
+                     'isInline': False}
+        for part in attachment:
+            if part.tag == qname('t', 'AttachmentId'):
+                reference['attachmentId'] = part.get('Id')
+            elif part.tag == qname('t', 'Size'):
+                reference['size'] = int(part.text) if part.text else None
+            elif part.tag == qname('t', 'IsInline'):
+                reference['isInline'] = (part.text or '').lower() == 'true'
+            elif part.tag in ATTACHMENT_FIELDS:
+                reference[ATTACHMENT_FIELDS[part.tag]] = part.text
+        if attachment.tag == qname('t', 'ItemAttachment'):
+            # An attached message: no file body to download
+            reference['contentType'] = reference['contentType'] or 'message/rfc822'
+            reference['isItem'] = True
+        record.attachments.append(reference)
+
+# Tag -> decoder for each direct child of t:Message; anything else is skipped unread
+FIELD_DECODERS = {
+    qname('t', 'ItemId'): _item_id,
+    qname('t', 'Subject'): _text('subject'),
+    qname('t', 'From'): _mailbox('from_name', 'from_address'),
+    qname('t', 'ReceivedBy'): _mailbox('received_by_name', 'received_by_address'),
+    qname('t', 'DisplayTo'): _text('display_to'),
+    qname('t', 'DisplayCc'): _text('display_cc'),
+    qname('t', 'DateTimeReceived'): _text('received_date'),
+    qname('t', 'DateTimeSent'): _text('sent_date'),
+    qname('t', 'HasAttachments'): _flag('has_attachments'),
+    qname('t', 'IsRead'): _flag('is_read'),
+    qname('t', 'Size'): _size,
+    qname('t', 'Importance'): _text('importance'),
+    qname('t', 'InternetMessageId'): _text('internet_message_id'),
+    qname('t', 'InternetMessageHeaders'): _internet_headers,
+    qname('t', 'Body'): _text('body'),
+    qname('t', 'MimeContent'): _text('mime_content'),
+    qname('t', 'Attachments'): _attachments
+}
+
+@timed('record_decode')
+def decode_message(item):
+    """Decode a t:Message element into an EmailRecord in a single pass over its children"""
+    record = EmailRecord()
+    for child in item:
+        decoder = FIELD_DECODERS.get(child.tag)
+        if decoder is not None:
+            decoder(record, child)
+    return record
+
+def resolve_sender(record):
+    """Return the best (name, address) sender available for whatever profile was fetched
+
+    Tries the MIME header block ("full"), then InternetMessageHeaders
+    ("headers"), then the t:From mailbox ("summary"). Returns ('', '') if
+    none of them name a sender.
+    """
+    if record.mime_content:
+        name, address = pick_sender(_mime_addresses(record))
+        if address:
+            return name, address
+
+    if record.internet_headers:
+        name, address = pick_sender(addresses_from_headers(record.internet_headers))
+        if address:
+            return name, address
+
+    if record.from_address:
+        return record.from_name, record.from_address
+
+    logger.debug("No sender found for email '%s'", record.subject)
+    return '', ''
+
+def _mime_addresses(record):
+    """Parse the MIME address headers once per record; sender and recipients both need them"""
+    if record.mime_addresses is None:
+        try:
+            record.mime_addresses = extract_mime_addresses(record.mime_content)
+        except Exception as e:
+            print(f"Error decoding MIME content: {e}")
+            record.mime_addresses = {}
+    return record.mime_addresses
+
+def resolve_recipients(record):
+    """Return [(type, name, address)] for the To and Cc recipients, or None if the profile has no header source
+
+    Uses the MIME header block ("full") or InternetMessageHeaders
+    ("headers"); "summary" only carries display names, so it returns None.
+    """
+    if record.mime_content:
+        addresses = _mime_addresses(record)
+    elif record.internet_headers:
+        addresses = addresses_from_headers(record.internet_headers)
+    else:
+        return None
+
+    return [
+        (recipient_type, name, address)
+        for recipient_type in ('to', 'cc')
+        for name, address in addresses.get(recipient_type, [])
+    ]
@@ -0,0 +1,457 @@
+import base64
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from ews_client import option_from_argv
+
+# Defaults for the synthetic mailbox
+DEFAULT_ITEMS = 1000
+DEFAULT_MIME_SIZE = 20 * 1024
+DEFAULT_LATENCY = 0.0
+DEFAULT_FOLDERS = 3
+DEFAULT_ATTACHMENT_SIZE = 64 * 1024
+
+# Messages with attachments carry one of this many distinct quote PDFs plus a shared signature image
+QUOTE_VARIANTS = 5
+SIGNATURE_SIZE = 4 * 1024
+
+# Properties a real server rejects in a FindItem shape
+GET_ITEM_ONLY_FIELDS = {'item:Body', 'item:UniqueBody', 'item:Attachments', 'item:MimeContent'}
+
+# Back-off hint sent with simulated ErrorServerBusy responses
+DEFAULT_BACK_OFF_MS = 100
+DEFAULT_PORT = 8765
+
+# Synthetic ids share a long common prefix, like real WorkMail ItemIds
+ID_PREFIX = 'AABuL089bS0xY2QzM2RlMWE1NTM0YmU5YmM2YTlmOTUwMTNmMmJjOC9PVT1BbWF6b24gV29ya01haWwvQ049UmVjaXBpZW50cy9D'
+
+ENVELOPE_START = ('<?xml version="1.0" encoding="utf-8"?>'
+                  '<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/">'
+                  '<soap:Body>')
+ENVELOPE_END = '</soap:Body></soap:Envelope>'
+MESSAGES_NS = 'xmlns:m="http://schemas.microsoft.com/exchange/services/2006/messages" ' \
+              'xmlns:t="http://schemas.microsoft.com/exchange/services/2006/types"'
+
+class FakeMailbox:
+    """A synthetic inbox of `items` messages with `mime_size`-byte MIME bodies
+
+    Item i is deterministic (sender, subject, dates, flags), so benchmark
+    runs are repeatable. `churn` items get a new ChangeKey after each
+    SyncFolderItems round that has caught up, to exercise incremental sync.
+    FindFolder lists Inbox, Sent Items and `folders` custom folders; every
+    folder of every mailbox serves the same synthetic items. With
+    `busy_rate` that fraction of GetItem items (and GetAttachment
+    attachments) fails with ErrorServerBusy. Every seventh message has a
+    quote PDF of `attachment_size` bytes and an inline signature image,
+    both drawn from a small pool so the same bytes repeat across messages.
+    `calls` counts the requests served per operation (e.g. calls['GetItem']).
+    Setting `available` to False answers every request with HTTP 503, like an outage.
+    """
+
+    def __init__(self, items=DEFAULT_ITEMS, mime_size=DEFAULT_MIME_SIZE, churn=0, folders=DEFAULT_FOLDERS,
+                 busy_rate=0.0, attachment_size=DEFAULT_ATTACHMENT_SIZE):
+        self.items = items
+        self.attachment_size = attachment_size
+        self.blobs = {}
+        self.folders = folders
+        self.busy_rate = busy_rate
+        self.mime_size = mime_size
+        self.churn = churn
+        self.versions = {}
+        self.churn_cursor = 0
+        self.calls = Counter()
+        self.available = True
+        self.lock = threading.Lock()
+        self.start_date = datetime(2025, 1, 1)
+        self.padding = ('Lorem ipsum dolor sit amet, consectetur adipiscing elit. ' * (mime_size // 56 + 1))[:mime_size]
+
+    def item_id(self, index):
+        return f"{ID_PREFIX}{index:010d}AA=="
+
+    def index_of(self, item_id):
+        if not item_id.startswith(ID_PREFIX):
+            return None
+        try:
+            index = int(item_id[len(ID_PREFIX):len(ID_PREFIX) + 10])
+        except ValueError:
+            return None
+        return index if 0 <= index < self.items else None
+
+    def has_attachments(self, index):
+        return index % 7 == 0
+
+    def attachments(self, index):
+        """Return (attachment id, name, content type, content id, body) for each attachment of item `index`"""
+        if not self.has_attachments(index):
+            return []
+        variant = index % QUOTE_VARIANTS
+        return [
+            (f"{self.item_id(index)}-1", f"Quote-{variant}.pdf", 'application/pdf', None, self.blob('quote', variant)),
+            (f"{self.item_id(index)}-2", 'signature.png', 'image/png', 'signature@example.com', self.blob('signature', 0))
+        ]
+
+    def blob(self, kind, variant):
+        """Deterministic attachment bytes, built once and kept with their base64"""
+        key = (kind, variant)
+        if key not in self.blobs:
+            size = self.attachment_size if kind == 'quote' else SIGNATURE_SIZE
+            seed = f"%{kind.upper()} {variant} ".encode('ascii')
+            body = (seed * (size // len(seed) + 1))[:size]
+            self.blobs[key] = (body, base64.b64encode(body).decode('ascii'))
+        return self.blobs[key]
+
+    def attachment_of(self, attachment_id):
+        index = self.index_of(attachment_id)
+        if index is None:
+            return None
+        for attachment in self.attachments(index):
+            if attachment[0] == attachment_id:
+                return attachment
+        return None
+
+    def change_key(self, index):
+        return f"CQAAABYAAAB{self.versions.get(index, 0):08d}"
+
+    def sender(self, index):
+        number = index % 50
+        return f"Sender {number}", f"sender{number}@example.com"
+
+    def received(self, index):
+        return (self.start_date - timedelta(minutes=index)).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    def mime(self, index):
+        name, address = self.sender(index)
+        headers = (
+            f"Return-Path: <{address}>\r\n"
+            f"From: {name} <{address}>\r\n"
+            f"To: Sales Team <sales@example.com>\r\n"
+            f"Subject: Synthetic message {index}\r\n"
+            f"Message-ID: <{index}@example.com>\r\n"
+        )
+        if not self.has_attachments(index):
+            message = f"{headers}Content-Type: text/plain; charset=utf-8\r\n\r\n{self.padding}"
+            return base64.b64encode(message.encode('utf-8')).decode('ascii')
+
+        boundary = f"----=_Part_{index}"
+        parts = [f"{headers}MIME-Version: 1.0\r\nContent-Type: multipart/mixed; boundary=\"{boundary}\"\r\n\r\n",
+                 f"--{boundary}\r\nContent-Type: text/plain; charset=utf-8\r\n\r\n{self.padding}\r\n"]
+        for _, name, content_type, content_id, (_, encoded) in self.attachments(index):
+            disposition = 'inline' if content_id else 'attachment'
+            lines = '\r\n'.join(encoded[start:start + 76] for start in range(0, len(encoded), 76))
+            parts.append(f"--{boundary}\r\nContent-Type: {content_type}; name=\"{name}\"\r\n"
+                         f"Content-Disposition: {disposition}; filename=\"{name}\"\r\n"
+                         + (f"Content-ID: <{content_id}>\r\n" if content_id else '')
+                         + f"Content-Transfer-Encoding: base64\r\n\r\n{lines}\r\n")
+        parts.append(f"--{boundary}--\r\n")
+        return base64.b64encode(''.join(parts).encode('utf-8')).decode('ascii')
+
+    def render_message(self, index, shape):
+        """Render one t:Message, honouring the requested BaseShape, FieldURIs and MIME flag"""
+        name, address = self.sender(index)
+        all_properties = shape['base_shape'] == 'AllProperties'
+        fields = shape['fields']
+        wants = lambda field: all_properties or field in fields
+
+        parts = ['<t:Message>']
+        if shape['mime']:
+            parts.append(f'<t:MimeContent CharacterSet="UTF-8">{self.mime(index)}</t:MimeContent>')
+        parts.append(f'<t:ItemId Id="{self.item_id(index)}" ChangeKey="{self.change_key(index)}" />')
+        if wants('item:Subject'):
+            parts.append(f'<t:Subject>Synthetic message {index}</t:Subject>')
+        if wants('item:DateTimeReceived'):
+            parts.append(f'<t:DateTimeReceived>{self.received(index)}</t:DateTimeReceived>')
+        if wants('item:Size'):
+            parts.append(f'<t:Size>{self.mime_size}</t:Size>')
+        if wants('item:DateTimeSent'):
+            parts.append(f'<t:DateTimeSent>{self.received(index)}</t:DateTimeSent>')
+        if wants('item:DisplayTo'):
+            parts.append('<t:DisplayTo>Sales Team</t:DisplayTo>')
+        if wants('item:HasAttachments'):
+            parts.append(f'<t:HasAttachments>{str(self.has_attachments(index)).lower()}</t:HasAttachments>')
+        if wants('item:Attachments') and not shape['find_item'] and self.has_attachments(index):
+            parts.append('<t:Attachments>' + ''.join(
+                f'<t:FileAttachment><t:AttachmentId Id="{attachment_id}" /><t:Name>{name}</t:Name>'
+                f'<t:ContentType>{content_type}</t:ContentType>'
+                + (f'<t:ContentId>{content_id}</t:ContentId>' if content_id else '')
+                + f'<t:Size>{len(body)}</t:Size><t:IsInline>{str(bool(content_id)).lower()}</t:IsInline>'
+                '</t:FileAttachment>'
+                for attachment_id, name, content_type, content_id, (body, _) in self.attachments(index)
+            ) + '</t:Attachments>')
+        if wants('item:InternetMessageHeaders') and not shape['find_item']:
+            parts.append(
+                '<t:InternetMessageHeaders>'
+                f'<t:InternetMessageHeader HeaderName="Return-Path">&lt;{address}&gt;</t:InternetMessageHeader>'
+                f'<t:InternetMessageHeader HeaderName="From">{name} &lt;{address}&gt;</t:InternetMessageHeader>'
+                '<t:InternetMessageHeader HeaderName="To">Sales Team &lt;sales@example.com&gt;</t:InternetMessageHeader>'
+                '</t:InternetMessageHeaders>'
+            )
+        if wants('message:From'):
+            parts.append(f'<t:From><t:Mailbox><t:Name>{name}</t:Name><t:EmailAddress>{address}</t:EmailAddress>'
+                         '<t:RoutingType>SMTP</t:RoutingType></t:Mailbox></t:From>')
+        if wants('item:Body') and not shape['find_item']:
+            parts.append(f'<t:Body BodyType="Text">Synthetic message {index} from {name}. {self.padding[:200]}</t:Body>')
+        if wants('message:IsRead'):
+            parts.append(f'<t:IsRead>{str(index % 3 == 0).lower()}</t:IsRead>')
+        parts.append('</t:Message>')
+        return ''.join(parts)
+
+    def find_item(self, body):
+        shape = parse_shape(body, find_item=True)
+        invalid = shape['fields'] & GET_ITEM_ONLY_FIELDS
+        if invalid:
+            # Like EWS, refuse the whole request rather than silently dropping the property
+            return (f'<m:FindItemResponse {MESSAGES_NS}><m:ResponseMessages>'
+                    '<m:FindItemResponseMessage ResponseClass="Error">'
+                    f'<m:MessageText>The property {min(invalid)} is not valid for this operation.</m:MessageText>'
+                    '<m:ResponseCode>ErrorInvalidPropertyRequest</m:ResponseCode><m:DescriptiveLinkKey>0</m:DescriptiveLinkKey>'
+                    '</m:FindItemResponseMessage></m:ResponseMessages></m:FindItemResponse>')
+        offset = int(re.search(r'Offset="(\d+)"', body).group(1))
+        page_size = int(re.search(r'MaxEntriesReturned="(\d+)"', body).group(1))
+        end = min(offset + page_size, self.items)
+        messages = ''.join(self.render_message(index, shape) for index in range(offset, end))
+        includes_last = 'true' if end >= self.items else 'false'
+
+        return (f'<m:FindItemResponse {MESSAGES_NS}><m:ResponseMessages>'
+                '<m:FindItemResponseMessage ResponseClass="Success"><m:ResponseCode>NoError</m:ResponseCode>'
+                f'<m:RootFolder IndexedPagingOffset="{end}" TotalItemsInView="{self.items}" '
+                f'IncludesLastItemInRange="{includes_last}"><t:Items>{messages}</t:Items></m:RootFolder>'
+                '</m:FindItemResponseMessage></m:ResponseMessages></m:FindItemResponse>')
+
+    def folder_list(self):
+        """Return (id, parent id, display name) for every folder below the root"""
+        root = 'FOLDER-ROOT'
+        listing = [('FOLDER-INBOX', root, 'Inbox'), ('FOLDER-SENT', root, 'Sent Items')]
+        for number in range(1, self.folders + 1):
+            # Every third custom folder is nested under the one before it
+            parent = f'FOLDER-{number - 1:04d}' if number % 3 == 0 else root
+            listing.append((f'FOLDER-{number:04d}', parent, f'Folder {number}'))
+        return listing
+
+    def find_folder(self, body):
+        offset = int(re.search(r'Offset="(\d+)"', body).group(1))
+        page_size = int(re.search(r'MaxEntriesReturned="(\d+)"', body).group(1))
+        listing = self.folder_list()
+        end = min(offset + page_size, len(listing))
+        folders = ''.join(
+            f'<t:Folder><t:FolderId Id="{folder_id}" ChangeKey="AQAAAA==" /><t:ParentFolderId Id="{parent}" />'
+            f'<t:FolderClass>IPF.Note</t:FolderClass><t:DisplayName>{name}</t:DisplayName>'
+            f'<t:TotalCount>{self.items}</t:TotalCount></t:Folder>'
+            for folder_id, parent, name in listing[offset:end]
+        )
+        includes_last = 'true' if end >= len(listing) else 'false'
+
+        return (f'<m:FindFolderResponse {MESSAGES_NS}><m:ResponseMessages>'
+                '<m:FindFolderResponseMessage ResponseClass="Success"><m:ResponseCode>NoError</m:ResponseCode>'
+                f'<m:RootFolder IndexedPagingOffset="{end}" TotalItemsInView="{len(listing)}" '
+                f'IncludesLastItemInRange="{includes_last}"><t:Folders>{folders}</t:Folders></m:RootFolder>'
+                '</m:FindFolderResponseMessage></m:ResponseMessages></m:FindFolderResponse>')
+
+    def get_item(self, body):
+        shape = parse_shape(body, find_item=False)
+        parts = []
+        for item_id in re.findall(r'<t:ItemId Id="([^"]+)"', body):
+            index = self.index_of(item_id)
+            if index is None:
+                parts.append('<m:GetItemResponseMessage ResponseClass="Error">'
+                             '<m:MessageText>The specified object was not found in the store.</m:MessageText>'
+                             '<m:ResponseCode>ErrorItemNotFound</m:ResponseCode><m:DescriptiveLinkKey>0</m:DescriptiveLinkKey>'
+                             '<m:Items /></m:GetItemResponseMessage>')
+            elif self.busy_rate and random.random() < self.busy_rate:
+                parts.append('<m:GetItemResponseMessage ResponseClass="Error">'
+                             '<m:MessageText>The server cannot service this request right now. Try again later.</m:MessageText>'
+                             '<m:ResponseCode>ErrorServerBusy</m:ResponseCode><m:DescriptiveLinkKey>0</m:DescriptiveLinkKey>'
+                             f'<m:MessageXml><t:Value Name="BackOffMilliseconds">{DEFAULT_BACK_OFF_MS}</t:Value></m:MessageXml>'
+                             '<m:Items /></m:GetItemResponseMessage>')
+            else:
+                parts.append('<m:GetItemResponseMessage ResponseClass="Success"><m:ResponseCode>NoError</m:ResponseCode>'
+                             f'<m:Items>{self.render_message(index, shape)}</m:Items></m:GetItemResponseMessage>')
+
+        return f'<m:GetItemResponse {MESSAGES_NS}><m:ResponseMessages>{"".join(parts)}</m:ResponseMessages></m:GetItemResponse>'
+
+    def get_attachment(self, body):
+        parts = []
+        for attachment_id in re.findall(r'<t:AttachmentId Id="([^"]+)"', body):
+            attachment = self.attachment_of(attachment_id)
+            if attachment is None:
+                parts.append('<m:GetAttachmentResponseMessage ResponseClass="Error">'
+                             '<m:MessageText>The attachment could not be found.</m:MessageText>'
+                             '<m:ResponseCode>ErrorCannotFindFileAttachment</m:ResponseCode>'
+                             '<m:DescriptiveLinkKey>0</m:DescriptiveLinkKey><m:Attachments /></m:GetAttachmentResponseMessage>')
+            elif self.busy_rate and random.random() < self.busy_rate:
+                parts.append('<m:GetAttachmentResponseMessage ResponseClass="Error">'
+                             '<m:MessageText>The server cannot service this request right now. Try again later.</m:MessageText>'
+                             '<m:ResponseCode>ErrorServerBusy</m:ResponseCode><m:DescriptiveLinkKey>0</m:DescriptiveLinkKey>'
+                             f'<m:MessageXml><t:Value Name="BackOffMilliseconds">{DEFAULT_BACK_OFF_MS}</t:Value></m:MessageXml>'
+                             '<m:Attachments /></m:GetAttachmentResponseMessage>')
+            else:
+                _, name, content_type, content_id, (content, encoded) = attachment
+                parts.append('<m:GetAttachmentResponseMessage ResponseClass="Success"><m:ResponseCode>NoError</m:ResponseCode>'
+                             f'<m:Attachments><t:FileAttachment><t:AttachmentId Id="{attachment_id}" />'
+                             f'<t:Name>{name}</t:Name><t:ContentType>{content_type}</t:ContentType>'
+                             + (f'<t:ContentId>{content_id}</t:ContentId>' if content_id else '')
+                             + f'<t:Size>{len(content)}</t:Size><t:IsInline>{str(bool(content_id)).lower()}</t:IsInline>'
+                             f'<t:Content>{encoded}</t:Content></t:FileAttachment></m:Attachments>'
+                             '</m:GetAttachmentResponseMessage>')
+
+        return (f'<m:GetAttachmentResponse {MESSAGES_NS}><m:ResponseMessages>{"".join(parts)}</m:ResponseMessages>'
+                '</m:GetAttachmentResponse>')
+
+    def sync_folder_items(self, body):
+        state_match = re.search(r'<m:SyncState>([^<]*)</m:SyncState>', body)
+        position = int(state_match.group(1).split(':')[1]) if state_match else 0
+        max_changes = int(re.search(r'<m:MaxChangesReturned>(\d+)</m:MaxChangesReturned>', body).group(1))
+
+        changes = []
+        if position < self.items:
+            end = min(position + max_changes, self.items)
+            for index in range(position, end):
+                changes.append(f'<t:Create><t:Message><t:ItemId Id="{self.item_id(index)}" '
+                               f'ChangeKey="{self.change_key(index)}" /></t:Message></t:Create>')
+            position = end
+        elif self.churn:
+            with self.lock:
+                for _ in range(min(self.churn, max_changes)):
+                    index = self.churn_cursor % self.items
+                    self.churn_cursor += 1
+                    self.versions[index] = self.versions.get(index, 0) + 1
+                    changes.append(f'<t:Update><t:Message><t:ItemId Id="{self.item_id(index)}" '
+                                   f'ChangeKey="{self.change_key(index)}" /></t:Message></t:Update>')
+
+        includes_last = 'true' if position >= self.items else 'false'
+        return (f'<m:SyncFolderItemsResponse {MESSAGES_NS}><m:ResponseMessages>'
+                '<m:SyncFolderItemsResponseMessage ResponseClass="Success"><m:ResponseCode>NoError</m:ResponseCode>'
+                f'<m:SyncState>pos:{position}</m:SyncState>'
+                f'<m:IncludesLastItemInRange>{includes_last}</m:IncludesLastItemInRange>'
+                f'<m:Changes>{"".join(changes)}</m:Changes>'
+                '</m:SyncFolderItemsResponseMessage></m:ResponseMessages></m:SyncFolderItemsResponse>')
+
+    def handle(self, body):
+        """Return (status, response body) for a SOAP request body"""
+        if not self.available:
+            return 503, 'Service Unavailable'
+        for operation, handler in (('<m:FindItem', self.find_item), ('<m:GetItem', self.get_item),
+                                   ('<m:SyncFolderItems', self.sync_folder_items), ('<m:FindFolder', self.find_folder),
+                                   ('<m:GetAttachment', self.get_attachment)):
+            if operation in body:
+                with self.lock:
+                    self.calls[operation[3:]] += 1
+                return 200, ENVELOPE_START + handler(body) + ENVELOPE_END
+        return 500, ENVELOPE_START + '<soap:Fault><faultstring>Unsupported operation</faultstring></soap:Fault>' + ENVELOPE_END
+
+def parse_shape(body, find_item):
+    """Pull the BaseShape, FieldURIs and MIME flag out of a request's ItemShape"""
+    base_shape = re.search(r'<t:BaseShape>(\w+)</t:BaseShape>', body)
+    return {
+        'base_shape': base_shape.group(1) if base_shape else 'IdOnly',
+        'fields': set(re.findall(r'FieldURI="([^"]+)"', body)),
+        'mime': not find_item and '<t:IncludeMimeContent>true</t:IncludeMimeContent>' in body,
+        'find_item': find_item
+    }
+
+def busy_fault(back_off_ms):
+    """The SOAP fault EWS returns when a caller exceeds its throttling budget"""
+    return (ENVELOPE_START + '<soap:Fault><faultcode>soap:Server</faultcode>'
+            '<faultstring>The server cannot service this request right now. Try again later.</faultstring>'
+            '<detail><e:ResponseCode xmlns:e="http://schemas.microsoft.com/exchange/services/2006/errors">'
+            'ErrorServerBusy</e:ResponseCode>'
+            '<t:MessageXml xmlns:t="http://schemas.microsoft.com/exchange/services/2006/types">'
+            f'<t:Value Name="BackOffMilliseconds">{back_off_ms}</t:Value></t:MessageXml></detail>'
+            '</soap:Fault>' + ENVELOPE_END)
+
+def make_handler(mailbox, latency, max_concurrency=0, truncate_rate=0.0):
+    """Build the request handler; past `max_concurrency` concurrent requests it answers ErrorServerBusy
+
+    With `truncate_rate` that fraction of successful responses is cut off
+    half way and the connection dropped, like a network failure mid-body;
+    a request is only cut off the first time it is sent, so retries get through.
+    """
+    active = [0]
+    truncated = set()
+    lock = threading.Lock()
+
+    class FakeEwsHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8')
+            with lock:
+                active[0] += 1
+                over_budget = max_concurrency and active[0] > max_concurrency
+
+            try:
+                if latency:
+                    time.sleep(latency)
+                if over_budget:
+                    status, response = 500, busy_fault(DEFAULT_BACK_OFF_MS)
+                else:
+                    status, response = mailbox.handle(body)
+            finally:
+                with lock:
+                    active[0] -= 1
+            payload = response.encode('utf-8')
+
+            self.send_response(status)
+            self.send_header('Content-Type', 'text/xml; charset=utf-8')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            with lock:
+                truncate = status == 200 and truncate_rate and body not in truncated and random.random() < truncate_rate
+                if truncate:
+                    truncated.add(body)
+            if truncate:
+                self.wfile.write(payload[:len(payload) // 2])
+                self.close_connection = True
+                return
+            self.wfile.write(payload)
+
+    return FakeEwsHandler
+
+def start_fake_server(items=DEFAULT_ITEMS, mime_size=DEFAULT_MIME_SIZE, latency=DEFAULT_LATENCY,
+                      churn=0, folders=DEFAULT_FOLDERS, busy_rate=0.0, max_concurrency=0, port=0,
+                      attachment_size=DEFAULT_ATTACHMENT_SIZE, truncate_rate=0.0):
+    """Start a fake EWS server on a background thread and return (server, endpoint URL)
+
+    Pass port=0 to pick a free port. Call `server.shutdown()` when done;
+    `server.mailbox` is the FakeMailbox it serves.
+    """
+    mailbox = FakeMailbox(items=items, mime_size=mime_size, churn=churn, folders=folders, busy_rate=busy_rate,
+                          attachment_size=attachment_size)
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(mailbox, latency, max_concurrency, truncate_rate))
+    server.daemon_threads = True
+    server.mailbox = mailbox
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/EWS/Exchange.asmx"
+
+if __name__ == "__main__":
+    items = int(option_from_argv(sys.argv, '--items', DEFAULT_ITEMS))
+    mime_size = int(option_from_argv(sys.argv, '--mime-size', DEFAULT_MIME_SIZE))
+    latency = float(option_from_argv(sys.argv, '--latency', DEFAULT_LATENCY))
+    churn = int(option_from_argv(sys.argv, '--churn', 0))
+    folders = int(option_from_argv(sys.argv, '--folders', DEFAULT_FOLDERS))
+    busy_rate = float(option_from_argv(sys.argv, '--busy-rate', 0.0))
+    max_concurrency = int(option_from_argv(sys.argv, '--max-concurrency', 0))
+    port = int(option_from_argv(sys.argv, '--port', DEFAULT_PORT))
+    attachment_size = int(option_from_argv(sys.argv, '--attachment-size', DEFAULT_ATTACHMENT_SIZE))
+    truncate_rate = float(option_from_argv(sys.argv, '--truncate-rate', 0.0))
+
+    server, endpoint = start_fake_server(items=items, mime_size=mime_size, latency=latency, churn=churn, folders=folders,
+                                         busy_rate=busy_rate, max_concurrency=max_concurrency, port=port,
+                                         attachment_size=attachment_size, truncate_rate=truncate_rate)
+    print(f"Fake EWS server with {items} items ({mime_size} byte MIME, {latency}s latency) at {endpoint}", flush=True)
+    print(f"Point the scripts at it with EWS_ENDPOINT={endpoint}", flush=True)
+
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
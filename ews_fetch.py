@@ -0,0 +1,344 @@
+import logging
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from collections import deque
+
+from ews_client import EWS_ENDPOINT, DEFAULT_PAGE_SIZE, crawl_folder, qname
+from ews_stream import EwsRequestError, stream_soap
+from ews_throttle import ConcurrencyController, ThrottledSession, ResponseCodes, retry_failed_items
+from ews_metrics import METRICS, timed
+from ews_decode import decode_message, resolve_sender, resolve_recipients
+from ews_attachments import attachment_refs, fetch_attachments
+
+logger = logging.getLogger(__name__)
+
+# SOAP template for a paged FindItem over one folder; the item shape and folder id are filled in per call
+FIND_ITEMS_TEMPLATE = """<?xml version="1.0" encoding="utf-8"?>
+<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/"
+               xmlns:t="http://schemas.microsoft.com/exchange/services/2006/types"
+               xmlns:m="http://schemas.microsoft.com/exchange/services/2006/messages">
+  <soap:Header>
+    <t:RequestServerVersion Version="Exchange2010_SP2" />
+  </soap:Header>
+  <soap:Body>
+    <m:FindItem Traversal="Shallow">
+      {item_shape}
+      <m:IndexedPageItemView MaxEntriesReturned="{page_size}" Offset="{offset}" BasePoint="Beginning" />
+      <m:ParentFolderIds>
+        {folder_id}
+      </m:ParentFolderIds>
+    </m:FindItem>
+  </soap:Body>
+</soap:Envelope>"""
+
+# FindItem shape for collecting ids: t:Size caps MIME batches by bytes
+ITEM_ID_SHAPE = """<m:ItemShape>
+        <t:BaseShape>IdOnly</t:BaseShape>
+        <t:AdditionalProperties>
+          <t:FieldURI FieldURI="item:Size" />
+        </t:AdditionalProperties>
+      </m:ItemShape>"""
+
+# SOAP template for GetItem operation; the item shape comes from a fetch profile
+GET_ITEM_TEMPLATE = """<?xml version="1.0" encoding="utf-8"?>
+<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/"
+               xmlns:t="http://schemas.microsoft.com/exchange/services/2006/types"
+               xmlns:m="http://schemas.microsoft.com/exchange/services/2006/messages">
+  <soap:Header>
+    <t:RequestServerVersion Version="Exchange2010_SP2" />
+  </soap:Header>
+  <soap:Body>
+    <m:GetItem>
+      {item_shape}
+      <m:ItemIds>
+        {item_ids}
+      </m:ItemIds>
+    </m:GetItem>
+  </soap:Body>
+</soap:Envelope>"""
+
+# Tuning defaults for GetItem batching
+DEFAULT_BATCH_SIZE = 25
+DEFAULT_MAX_BATCH_BYTES = 8 * 1024 * 1024
+DEFAULT_WORKERS = 8
+
+# Concurrent requests allowed against any one mailbox when crawling several
+DEFAULT_PER_MAILBOX = 4
+
+class ItemsNotFetched(EwsRequestError):
+    """GetItem gave up on some items of a batch
+
+    `item_ids` are the id tuples that never arrived; `emails` holds the
+    ones that did, in batch order, for callers that can use a partial batch.
+    """
+
+    def __init__(self, item_ids, emails):
+        super().__init__(f"{len(item_ids)} items could not be fetched")
+        self.item_ids = item_ids
+        self.emails = emails
+
+def create_session(pool_size=DEFAULT_WORKERS, controller=None):
+    """Create a Session whose keep-alive pool can serve `pool_size` concurrent requests
+
+    Requests go through `controller` (by default an AIMD controller capped at
+    `pool_size`), which retries throttled calls and backs off when EWS is busy.
+    """
+    session = ThrottledSession(controller or ConcurrencyController(initial=pool_size, maximum=pool_size))
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+def batch_item_ids(item_ids, batch_size=DEFAULT_BATCH_SIZE, max_batch_bytes=DEFAULT_MAX_BATCH_BYTES):
+    """Group item IDs into batches capped by count and by estimated response size
+
+    `item_ids` is any iterable of (Id, ChangeKey) or (Id, ChangeKey, size)
+    tuples; the size (t:Size from FindItem) is used to close a batch early
+    once its estimated payload would exceed `max_batch_bytes`. Batches are
+    yielded lazily so the input can be a stream of FindItem pages.
+    """
+    batch = []
+    batch_bytes = 0
+
+    for entry in item_ids:
+        size = entry[2] if len(entry) > 2 and entry[2] else 0
+
+        if batch and (len(batch) >= batch_size or (max_batch_bytes and batch_bytes + size > max_batch_bytes)):
+            yield batch
+            batch = []
+            batch_bytes = 0
+
+        batch.append(entry)
+        batch_bytes += size
+
+    if batch:
+        yield batch
+
+def fetch_in_order(batches, fetch_batch, workers=DEFAULT_WORKERS):
+    """Run `fetch_batch` over `batches` on a bounded thread pool, yielding results in input order
+
+    At most `workers * 2` batches are in flight at once, so a lazy stream of
+    batches is only consumed as fast as results are handed back.
+    """
+    max_in_flight = max(1, workers) * 2
+    pending = deque()
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for batch in batches:
+            pending.append(executor.submit(fetch_batch, batch))
+
+            if len(pending) >= max_in_flight:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+
+def fetch_round_robin(sources, fetch_next, workers=DEFAULT_WORKERS, per_source=DEFAULT_PER_MAILBOX):
+    """Drain several work sources on one thread pool, taking turns between them
+
+    `fetch_next(source)` does one unit of work for `source` and returns its
+    result, or None once the source has nothing left; it may run on up to
+    `per_source` threads at once for the same source. Free threads go to
+    sources in round-robin order, so one large mailbox cannot starve the
+    others and the pool stays full while any source has work. Yields
+    (source, result) pairs as units complete, in completion order.
+    """
+    sources = list(sources)
+    workers = max(1, workers)
+    per_source = max(1, per_source)
+    ready = deque(range(len(sources)))
+    in_flight = [0] * len(sources)
+    finished = [False] * len(sources)
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while ready or running:
+            while ready and len(running) < workers:
+                index = ready.popleft()
+                if finished[index]:
+                    continue
+                running[executor.submit(fetch_next, sources[index])] = index
+                in_flight[index] += 1
+
+                # Back of the queue: every other source gets a turn first
+                if in_flight[index] < per_source:
+                    ready.append(index)
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = running.pop(future)
+                in_flight[index] -= 1
+                result = future.result()
+
+                if result is None:
+                    finished[index] = True
+                else:
+                    yield sources[index], result
+
+                if not finished[index] and in_flight[index] < per_source and index not in ready:
+                    ready.append(index)
+
+def iter_folder_item_ids(session, headers, folder_element, page_size=DEFAULT_PAGE_SIZE):
+    """Yield (Id, ChangeKey, size) tuples for every message in a folder (see ews_client.folder_id_element)"""
+    for item in crawl_folder(FIND_ITEMS_TEMPLATE, headers, page_size=page_size, session=session,
+                             template_fields={'item_shape': ITEM_ID_SHAPE, 'folder_id': folder_element}):
+        record = decode_message(item)
+        if record.id:
+            yield (record.id, record.change_key, record.size or 0)
+
+@timed('email_build')
+def parse_detailed_item(item, attachment_store=None):
+    """Build an email dict from a GetItem t:Message element fetched with any profile
+
+    With an `attachment_store` the email also gets an `attachments` list of
+    references; the bodies themselves only ever go to the store.
+    """
+    try:
+        # Extract basic properties in one pass over the item
+        record = decode_message(item)
+        subject = record.subject or '(No Subject)'
+
+        # MIME header block, transport headers or From mailbox, depending on the profile
+        from_name, from_address = resolve_sender(record)
+
+        if from_address:
+            logger.debug("Found sender for email '%s': %s <%s>", subject, from_name, from_address)
+
+        # Last resort: Use a placeholder
+        if not from_address:
+            from_address = "no-sender@workmail.aws"
+            from_name = "AWS WorkMail"
+
+        # Create email object
+        email = {
+            'id': record.id or 'Unknown',
+            'subject': subject,
+            'from': from_address,
+            'fromName': from_name,
+            'to': record.display_to,
+            'receivedDate': record.received_date,
+            'sentDate': record.sent_date,
+            'hasAttachments': record.has_attachments,
+            'isRead': record.is_read
+        }
+
+        # Recipient addresses, when the profile fetched a header source (see ews_loader)
+        recipients = resolve_recipients(record)
+        if recipients is not None:
+            email['recipients'] = [
+                {'type': recipient_type, 'address': address, 'name': name}
+                for recipient_type, name, address in recipients
+            ]
+
+        # Plain-text body, for profiles that fetch it (see ews_search)
+        if record.body is not None:
+            email['body'] = record.body
+
+        # Properties only AllProperties ("full") returns, named like the app's email objects (src/lib/ews.ts)
+        for key, value in (('importance', record.importance), ('internetMessageId', record.internet_message_id),
+                           ('size', record.size)):
+            if value is not None:
+                email[key] = value
+
+        if attachment_store is not None:
+            email['attachments'] = attachment_refs(record, attachment_store)
+
+        return email
+    except Exception as e:
+        print(f"Error processing detailed email: {e}")
+        return None
+
+def fetch_detailed_batch(session, headers, item_ids, item_shape, tee_path=None, attachment_store=None):
+    """Run GetItem for one batch of item ID tuples and return the parsed emails
+
+    The response is decoded as it streams in, so only one t:Message (with its
+    MIME content) is materialised at a time. `item_shape` comes from
+    ews_profiles.build_item_shape; `tee_path` saves the raw response.
+    Items that fail transiently (e.g. ErrorServerBusy), or are lost to a
+    response cut off part way, are requested again on their own; emails keep
+    the batch order. If some are still missing when the retries run out,
+    ItemsNotFetched is raised with the emails that did arrive. With an
+    `attachment_store` the attachment bodies are downloaded into it (see
+    ews_attachments); an email whose attachments could not all be downloaded
+    counts as not fetched, so it is never stored without its bodies.
+    """
+    emails_by_id = {}
+    message_tag = qname('t', 'Message')
+
+    def attempt(pending, codes):
+        # Create ItemId elements for the GetItem request
+        item_id_elements = "".join(
+            f'<t:ItemId Id="{entry[0]}" ChangeKey="{entry[1]}" />' for entry in pending
+        )
+
+        # Create the GetItem request with the item IDs
+        get_item_request = GET_ITEM_TEMPLATE.format(item_shape=item_shape, item_ids=item_id_elements)
+
+        # Extract detailed email information as each message closes
+        for elem in stream_soap(session.post, EWS_ENDPOINT, headers, get_item_request,
+                                ResponseCodes.TAGS | {message_tag}, tee_path):
+            if elem.tag != message_tag:
+                codes.feed(elem)
+                continue
+            email = parse_detailed_item(elem, attachment_store)
+            if email is not None:
+                emails_by_id[email['id']] = email
+
+    missing = retry_failed_items(session, item_ids, attempt)
+    emails = [emails_by_id.pop(entry[0]) for entry in item_ids if entry[0] in emails_by_id]
+    emails.extend(emails_by_id.values())
+
+    # Bodies that were not in the MIME content come from batched GetAttachment calls
+    if attachment_store is not None:
+        failed = fetch_attachments(session, headers, [attachment for email in emails for attachment in email.get('attachments', [])],
+                                   attachment_store)
+        if failed:
+            incomplete = {email['id'] for email in emails
+                          if any(attachment.get('attachmentId') in failed for attachment in email.get('attachments', []))}
+            missing.extend(entry for entry in item_ids if entry[0] in incomplete)
+            emails = [email for email in emails if email['id'] not in incomplete]
+    METRICS.count('items', len(emails))
+
+    logger.debug("Processed %d detailed emails", len(emails))
+
+    if missing:
+        raise ItemsNotFetched(missing, emails)
+    return emails
+
+def fetch_with_store(store, session, headers, item_ids, item_shape, profile, tee_path=None, attachment_store=None):
+    """Serve a batch from the local message store, running GetItem only for new or changed items
+
+    Freshly fetched emails are written back to the store under the ChangeKey
+    FindItem (or SyncFolderItems) reported. Results keep the batch order.
+    Like fetch_detailed_batch, raises ItemsNotFetched when GetItem gave up
+    on some items; the ones that did arrive are stored first.
+    """
+    cached = store.get_current(item_ids, profile)
+    missing = [entry for entry in item_ids if entry[0] not in cached]
+    fetched = {}
+    error = None
+
+    if missing:
+        change_keys = {entry[0]: entry[1] for entry in missing}
+        try:
+            fetched_emails = fetch_detailed_batch(session, headers, missing, item_shape, tee_path, attachment_store)
+        except ItemsNotFetched as e:
+            fetched_emails, error = e.emails, e
+        for email in fetched_emails:
+            fetched[email['id']] = email
+        store.put_many([(item_id, change_keys.get(item_id), email) for item_id, email in fetched.items()], profile)
+
+    if cached:
+        METRICS.count('store_hits', len(cached))
+        METRICS.count('items', len(cached))
+        logger.debug("Served %d unchanged emails from the local store", len(cached))
+
+    emails = []
+    for entry in item_ids:
+        email = cached.get(entry[0]) or fetched.get(entry[0])
+        if email is not None:
+            emails.append(email)
+
+    if error is not None:
+        raise ItemsNotFetched(error.item_ids, emails)
+    return emails
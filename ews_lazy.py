@@ -0,0 +1,333 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+from itertools import islice
+
+from ews_client import (
+    EWS_ENDPOINT, EMAIL, create_auth_headers, crawl_folder, folder_id_element, qname, option_from_argv
+)
+from ews_stream import stream_soap
+from ews_decode import decode_message
+from ews_profiles import build_item_shape
+from ews_throttle import ResponseCodes, retry_failed_items
+from ews_attachments import attachment_refs, fetch_attachments
+from ews_metrics import METRICS
+from ews_fetch import (
+    DEFAULT_BATCH_SIZE, DEFAULT_MAX_BATCH_BYTES, DEFAULT_WORKERS,
+    FIND_ITEMS_TEMPLATE, GET_ITEM_TEMPLATE, ItemsNotFetched, create_session, batch_item_ids
+)
+
+# FindItem shape for listing: the summary fields plus t:Size, which caps MIME batches by bytes
+LIST_SHAPE = build_item_shape('summary', find_item=True, extra_fields=['item:Size'])
+
+# GetItem shapes for the parts a LazyEmail loads on access, each just the one property
+DETAIL_SHAPES = {
+    'body': """<m:ItemShape>
+        <t:BaseShape>IdOnly</t:BaseShape>
+        <t:BodyType>Text</t:BodyType>
+        <t:AdditionalProperties>
+          <t:FieldURI FieldURI="item:Body" />
+        </t:AdditionalProperties>
+      </m:ItemShape>""",
+    'mime': """<m:ItemShape>
+        <t:BaseShape>IdOnly</t:BaseShape>
+        <t:IncludeMimeContent>true</t:IncludeMimeContent>
+      </m:ItemShape>""",
+    'attachments': """<m:ItemShape>
+        <t:BaseShape>IdOnly</t:BaseShape>
+        <t:AdditionalProperties>
+          <t:FieldURI FieldURI="item:Attachments" />
+        </t:AdditionalProperties>
+      </m:ItemShape>"""
+}
+
+# Seconds an access waits for others to join its GetItem request
+COALESCE_WINDOW = 0.02
+
+# Loaded parts kept in memory, least recently used dropped first
+DEFAULT_CACHE_ITEMS = 1000
+
+DEFAULT_LIST_LIMIT = 500
+MAX_PAGE_SIZE = 1000
+
+class LazyEmail:
+    """An email summary whose body, MIME content and attachments load on first access
+
+    Listing fields (id, subject, from, dates, flags) come from FindItem and
+    are read like a dict (`email['subject']`, `email.get('to')`). The
+    `body`, `mime` and `attachments` properties ask the DetailLoader, which
+    batches and caches the GetItem calls behind them.
+    """
+
+    __slots__ = ('summary', 'loader')
+
+    def __init__(self, summary, loader):
+        self.summary = summary
+        self.loader = loader
+
+    @property
+    def body(self):
+        return self.loader.load(self, 'body')
+
+    @property
+    def mime(self):
+        return self.loader.load(self, 'mime')
+
+    @property
+    def attachments(self):
+        return self.loader.load(self, 'attachments')
+
+    def __getitem__(self, key):
+        if key in self.summary:
+            return self.summary[key]
+        if key in DETAIL_SHAPES:
+            return self.loader.load(self, key)
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def to_dict(self):
+        """The summary as a plain email dict, without loading anything"""
+        return dict(self.summary)
+
+    def __repr__(self):
+        return f"LazyEmail({self.summary.get('subject')!r}, {self.summary.get('from')!r})"
+
+class _Waiter:
+    __slots__ = ('event', 'value', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+class DetailLoader:
+    """Loads LazyEmail parts with batched, cached GetItem calls
+
+    The first access to a part that is not cached waits COALESCE_WINDOW
+    seconds; every other access to the same part made meanwhile (from any
+    thread) joins it, and the whole group goes out as one GetItem of up to
+    `batch_size` items asking for only that property. Accesses to an item
+    already being fetched wait for that request instead of sending their
+    own. Only accesses from different threads can join each other: a
+    single-threaded caller waits out the window on every access and still
+    sends one GetItem per email, so it should `prefetch` the emails it is
+    about to open (e.g. the rows on screen), which fetches them together
+    without waiting. Results are cached per (Id, ChangeKey, part), so an
+    edited message is fetched again. When a request fails, or retries run
+    out, every access waiting on it raises the error and nothing is cached,
+    so the next access tries again.
+    """
+
+    def __init__(self, session, headers, endpoint=EWS_ENDPOINT, window=COALESCE_WINDOW, batch_size=DEFAULT_BATCH_SIZE,
+                 max_batch_bytes=DEFAULT_MAX_BATCH_BYTES, cache_items=DEFAULT_CACHE_ITEMS, attachment_store=None):
+        self.session = session
+        self.headers = headers
+        self.endpoint = endpoint
+        self.window = window
+        self.batch_size = batch_size
+        self.max_batch_bytes = max_batch_bytes
+        self.cache_items = cache_items
+        self.attachment_store = attachment_store
+        self.lock = threading.Lock()
+        self.cache = OrderedDict()
+        self.pending = {}
+        self.waiters = {}
+
+    def load(self, email, part):
+        """Return `part` ('body', 'mime' or 'attachments') for a LazyEmail, fetching it if needed
+
+        Raises the request's error (e.g. ItemsNotFetched) if it could not be loaded.
+        """
+        with self.lock:
+            found, value = self._cached(email, part)
+            if found:
+                return value
+            waiter, leader = self._register(email, part)
+
+        if leader:
+            time.sleep(self.window)
+            self._flush(part)
+        waiter.event.wait()
+        if waiter.error is not None:
+            raise waiter.error
+        return waiter.value
+
+    def prefetch(self, emails, part):
+        """Fetch `part` for several emails now, in as few GetItem calls as the batch limits allow
+
+        Failures are not raised here; those emails are fetched again when loaded.
+        """
+        with self.lock:
+            for email in emails:
+                if not self._cached(email, part)[0]:
+                    self._register(email, part)
+        self._flush(part)
+
+    def _key(self, email, part):
+        return email['id'], email['changeKey'], part
+
+    def _cached(self, email, part):
+        key = self._key(email, part)
+        if key not in self.cache:
+            return False, None
+        self.cache.move_to_end(key)
+        METRICS.count('lazy_cache_hits')
+        return True, self.cache[key]
+
+    def _register(self, email, part):
+        """Queue an access (lock held); returns its waiter and whether it should start the window"""
+        key = self._key(email, part)
+        waiter = self.waiters.get(key)
+        if waiter is not None:
+            return waiter, False
+
+        waiter = self.waiters[key] = _Waiter()
+        queue = self.pending.setdefault(part, {})
+        leader = not queue
+        queue[key] = (email['id'], email['changeKey'], email.get('size') or 0)
+        return waiter, leader
+
+    def _flush(self, part):
+        with self.lock:
+            queue = self.pending.pop(part, {})
+        if not queue:
+            return
+
+        # Only MIME is big enough to be worth capping by bytes
+        max_batch_bytes = self.max_batch_bytes if part == 'mime' else None
+        for batch in batch_item_ids(queue.values(), batch_size=self.batch_size, max_batch_bytes=max_batch_bytes):
+            values, error, failed = {}, None, set()
+            try:
+                values = self._fetch(part, batch)
+            except ItemsNotFetched as e:
+                values, error, failed = e.emails, e, {entry[0] for entry in e.item_ids}
+            except Exception as e:
+                error, failed = e, {entry[0] for entry in batch}
+            finally:
+                self._deliver([(entry[0], entry[1], part) for entry in batch], values, error, failed)
+
+    def _deliver(self, keys, values, error=None, failed=()):
+        with self.lock:
+            for key in keys:
+                found = key[0] in values
+                value = values.get(key[0])
+                if found:
+                    self.cache[key] = value
+                    self.cache.move_to_end(key)
+                waiter = self.waiters.pop(key, None)
+                if waiter is not None:
+                    waiter.value = value
+                    if key[0] in failed:
+                        waiter.error = error
+                    waiter.event.set()
+            while len(self.cache) > self.cache_items:
+                self.cache.popitem(last=False)
+
+    def _fetch(self, part, entries):
+        """One GetItem (plus retries) for `part` of the (Id, ChangeKey, size) entries; returns {Id: value}
+
+        Raises ItemsNotFetched, with the {Id: value} that did load as its
+        `emails`, for entries the retries gave up on (including attachments
+        whose bodies could not be downloaded).
+        """
+        values = {}
+        message_tag = qname('t', 'Message')
+
+        def attempt(pending, codes):
+            item_ids = ''.join(f'<t:ItemId Id="{entry[0]}" ChangeKey="{entry[1]}" />' for entry in pending)
+            request = GET_ITEM_TEMPLATE.format(item_shape=DETAIL_SHAPES[part], item_ids=item_ids)
+            for elem in stream_soap(self.session.post, self.endpoint, self.headers, request,
+                                    ResponseCodes.TAGS | {message_tag}):
+                if elem.tag != message_tag:
+                    codes.feed(elem)
+                    continue
+                record = decode_message(elem)
+                if part == 'body':
+                    values[record.id] = record.body or ''
+                elif part == 'mime':
+                    values[record.id] = record.mime_content
+                else:
+                    values[record.id] = attachment_refs(record, self.attachment_store)
+
+        missing = retry_failed_items(self.session, entries, attempt)
+        if part == 'attachments' and self.attachment_store is not None:
+            failed = fetch_attachments(self.session, self.headers, [ref for refs in values.values() for ref in refs],
+                                       self.attachment_store, self.endpoint)
+            incomplete = {item_id for item_id, refs in values.items()
+                          if any(ref.get('attachmentId') in failed for ref in refs)}
+            missing.extend(entry for entry in entries if entry[0] in incomplete)
+            for item_id in incomplete:
+                del values[item_id]
+
+        METRICS.count('lazy_requests')
+        METRICS.count('lazy_items', len(values))
+        if missing:
+            raise ItemsNotFetched(missing, values)
+        return values
+
+def list_emails(loader, folder='inbox', limit=DEFAULT_LIST_LIMIT, mailbox=None):
+    """Return LazyEmail summaries for the first `limit` emails of a folder
+
+    Only the listing fields are requested, in pages of up to `limit` items,
+    and paging stops as soon as `limit` emails have been read.
+    """
+    items = crawl_folder(FIND_ITEMS_TEMPLATE, loader.headers, page_size=min(limit, MAX_PAGE_SIZE),
+                         endpoint=loader.endpoint, session=loader.session,
+                         template_fields={'item_shape': LIST_SHAPE, 'folder_id': folder_id_element(folder, mailbox)})
+
+    emails = []
+    for item in islice(items, limit):
+        record = decode_message(item)
+        if not record.id:
+            continue
+        emails.append(LazyEmail({
+            'id': record.id,
+            'changeKey': record.change_key,
+            'subject': record.subject or '(No Subject)',
+            'from': record.from_address,
+            'fromName': record.from_name,
+            'to': record.display_to,
+            'receivedDate': record.received_date,
+            'sentDate': record.sent_date,
+            'hasAttachments': record.has_attachments,
+            'isRead': record.is_read,
+            'size': record.size
+        }, loader))
+    items.close()
+    return emails
+
+if __name__ == "__main__":
+    # List the newest emails, then open a few of them: the "list 500, open 3" pattern of the app
+    limit = int(option_from_argv(sys.argv, '--list', DEFAULT_LIST_LIMIT))
+    opened = int(option_from_argv(sys.argv, '--open', 3))
+    part = option_from_argv(sys.argv, '--part', 'body')
+    folder = option_from_argv(sys.argv, '--folder', 'inbox')
+
+    print(f"Connecting to WorkMail with email: {EMAIL}")
+    session = create_session(DEFAULT_WORKERS)
+    loader = DetailLoader(session, create_auth_headers())
+
+    start = time.perf_counter()
+    emails = list_emails(loader, folder=folder, limit=limit)
+    print(f"Listed {len(emails)} emails in {time.perf_counter() - start:.2f}s")
+
+    # One GetItem for everything about to be opened, instead of one per email
+    loader.prefetch(emails[:opened], part)
+    for email in emails[:opened]:
+        value = loader.load(email, part)
+        print(f"\n{email['subject']}")
+        print(f"  From: {email['fromName']} <{email['from']}>")
+        if part == 'attachments':
+            print(f"  Attachments: {', '.join(attachment['name'] or '(unnamed)' for attachment in value or [])}")
+        else:
+            print(f"  {part}: {len(value or '')} characters")
+
+    session.close()
+    counters = METRICS.snapshot()['counters']
+    print(f"\n{counters.get('http_requests', 0)} requests, {counters.get('bytes_received', 0) / 1024:.1f} KB received")
@@ -0,0 +1,366 @@
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime
+
+try:
+    import psycopg
+except ImportError:
+    psycopg = None
+
+from ews_client import EMAIL, option_from_argv
+from ews_store import MAX_QUERY_IDS
+from ews_sinks import iter_records
+from ews_metrics import METRICS
+
+# Emails written per transaction
+DEFAULT_LOAD_BATCH = 500
+
+# SQLite stand-in used when no Postgres URL is given (tests, local runs)
+DEFAULT_DB_PATH = 'ews_emails.db'
+SQLITE_CACHE_KB = 64 * 1024
+
+# Distinguished folders map onto the app's WorkMailFolderName values (src/lib/ews.ts)
+WORKMAIL_FOLDERS = {
+    'inbox': ('INBOX', 'Inbox'),
+    'sentitems': ('SENT_ITEMS', 'Sent Items'),
+    'deleteditems': ('DELETED_ITEMS', 'Deleted Items'),
+    'drafts': ('DRAFTS', 'Drafts'),
+    'junkemail': ('JUNK_EMAIL', 'Junk Email')
+}
+
+# The prisma tables, with SQLite types, for the stand-in database
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS monday_users (
+    id TEXT PRIMARY KEY,
+    email TEXT UNIQUE
+);
+CREATE TABLE IF NOT EXISTS email_folders (
+    id TEXT PRIMARY KEY,
+    folder_id TEXT NOT NULL,
+    display_name TEXT NOT NULL,
+    parent_folder_id TEXT,
+    monday_user_id TEXT REFERENCES monday_users(id) ON DELETE CASCADE,
+    total_count INTEGER DEFAULT 0,
+    child_folder_count INTEGER DEFAULT 0,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    last_synced_at TEXT,
+    last_sync_count INTEGER DEFAULT 0,
+    UNIQUE (monday_user_id, folder_id)
+);
+CREATE TABLE IF NOT EXISTS emails (
+    id TEXT PRIMARY KEY,
+    email_id TEXT NOT NULL,
+    monday_user_id TEXT REFERENCES monday_users(id) ON DELETE CASCADE,
+    folder_id TEXT REFERENCES email_folders(id) ON DELETE SET NULL,
+    subject TEXT,
+    from_address TEXT,
+    from_name TEXT,
+    body TEXT,
+    received_date TEXT,
+    has_attachments INTEGER DEFAULT 0,
+    is_read INTEGER DEFAULT 0,
+    importance TEXT,
+    internet_message_id TEXT,
+    size INTEGER,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    last_synced_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (monday_user_id, email_id)
+);
+CREATE TABLE IF NOT EXISTS email_recipients (
+    id TEXT PRIMARY KEY,
+    email_id TEXT REFERENCES emails(id) ON DELETE CASCADE,
+    recipient_type TEXT NOT NULL,
+    email_address TEXT NOT NULL,
+    display_name TEXT,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS email_attachments (
+    id TEXT PRIMARY KEY,
+    email_id TEXT REFERENCES emails(id) ON DELETE CASCADE,
+    file_name TEXT NOT NULL,
+    content_type TEXT,
+    size INTEGER,
+    content_id TEXT,
+    is_inline INTEGER DEFAULT 0,
+    attachment_id TEXT,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_emails_user_id ON emails(monday_user_id);
+CREATE INDEX IF NOT EXISTS idx_emails_folder_id ON emails(folder_id);
+CREATE INDEX IF NOT EXISTS idx_emails_received_date ON emails(received_date);
+CREATE INDEX IF NOT EXISTS idx_email_recipients_email_id ON email_recipients(email_id);
+CREATE INDEX IF NOT EXISTS idx_email_recipients_email_address ON email_recipients(email_address);
+CREATE INDEX IF NOT EXISTS idx_email_attachments_email_id ON email_attachments(email_id);
+"""
+
+EMAIL_COLUMNS = ('id', 'email_id', 'monday_user_id', 'folder_id', 'subject', 'from_address', 'from_name',
+                 'received_date', 'has_attachments', 'is_read', 'last_synced_at', 'body', 'importance',
+                 'internet_message_id', 'size')
+# Columns only some fetch profiles carry; an email without them keeps the values already stored
+OPTIONAL_EMAIL_COLUMNS = ('body', 'importance', 'internet_message_id', 'size')
+RECIPIENT_COLUMNS = ('id', 'email_id', 'recipient_type', 'email_address', 'display_name')
+ATTACHMENT_COLUMNS = ('id', 'email_id', 'file_name', 'content_type', 'size', 'content_id', 'is_inline', 'attachment_id')
+
+def new_uuid():
+    """A random (version 4) UUID string, built from raw bytes because uuid.UUID is slow for bulk rows"""
+    digits = os.urandom(16).hex()
+    return f"{digits[:8]}-{digits[8:12]}-4{digits[13:16]}-{'89ab'[int(digits[16], 16) & 3]}{digits[17:20]}-{digits[20:]}"
+
+def is_postgres(target):
+    return target.startswith(('postgres://', 'postgresql://'))
+
+class EmailLoader:
+    """Bulk-load email dicts into the app's emails / email_recipients / email_attachments tables
+
+    `target` is a Postgres URL (needs the optional psycopg package) or a
+    SQLite path used as a local stand-in with the same tables. Emails are
+    buffered and written `batch_size` at a time, each batch in one
+    transaction: one SELECT maps Exchange ids to existing row ids, one
+    multi-row upsert writes the emails, and recipients and attachments are
+    replaced with a DELETE plus COPY (Postgres) or executemany (SQLite).
+    Folders and monday_users ids are looked up once per run and cached.
+    Recipients and attachments are only touched for emails that carry a
+    `recipients` / `attachments` list, so summary-profile loads keep them;
+    likewise body, importance, internetMessageId and size only overwrite
+    the stored values when the email has them.
+    """
+
+    def __init__(self, target=DEFAULT_DB_PATH, batch_size=DEFAULT_LOAD_BATCH, default_mailbox=EMAIL):
+        self.target = target
+        self.batch_size = batch_size
+        self.default_mailbox = default_mailbox
+        self.postgres = is_postgres(target)
+        self.pending = []
+        self.folder_ids = {}
+        self.user_ids = {}
+        self.counts = {'emails': 0, 'recipients': 0, 'attachments': 0, 'batches': 0}
+
+        if self.postgres:
+            if psycopg is None:
+                raise RuntimeError("Loading into Postgres requires the 'psycopg' package (pip install psycopg)")
+            self.connection = psycopg.connect(target)
+            self.marker = '%s'
+        else:
+            self.connection = sqlite3.connect(target)
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('PRAGMA synchronous=NORMAL')
+            # Random UUID keys touch pages all over each index; keep them in memory between batches
+            self.connection.execute(f'PRAGMA cache_size=-{SQLITE_CACHE_KB}')
+            self.connection.execute('PRAGMA foreign_keys=ON')
+            self.connection.executescript(SQLITE_SCHEMA)
+            self.marker = '?'
+
+    def add(self, email):
+        """Queue one email dict, writing a batch once `batch_size` are queued"""
+        self.pending.append(email)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Write every queued email in a single transaction"""
+        if not self.pending:
+            return
+
+        start = time.perf_counter()
+        batch, self.pending = self.pending, []
+
+        if self.postgres:
+            with self.connection.transaction():
+                self._write_batch(batch)
+        else:
+            with self.connection:
+                self._write_batch(batch)
+
+        METRICS.observe('db_batch', time.perf_counter() - start)
+        self.counts['batches'] += 1
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.connection.close()
+
+    def _execute(self, sql, params=()):
+        return self.connection.execute(sql.replace('?', self.marker), params)
+
+    def _user_id(self, mailbox):
+        """monday_users.id for a mailbox address, or None if the app has no such user"""
+        if mailbox not in self.user_ids:
+            row = self._execute('SELECT id FROM monday_users WHERE email = ?', (mailbox,)).fetchone()
+            self.user_ids[mailbox] = str(row[0]) if row else None
+        return self.user_ids[mailbox]
+
+    def _folder_id(self, user_id, folder):
+        """email_folders.id for a folder label, creating the row on first use
+
+        Like the app, a user's own folder row wins over the shared default
+        (monday_user_id NULL) row. Custom folders are keyed by their path.
+        """
+        key = (user_id, folder)
+        if key in self.folder_ids:
+            return self.folder_ids[key]
+
+        folder_key, display_name = WORKMAIL_FOLDERS.get(folder.lower(), (folder, folder.rsplit('/', 1)[-1]))
+        null_match = 'IS NOT DISTINCT FROM ?' if self.postgres else 'IS ?'
+        row = self._execute(
+            f'SELECT id FROM email_folders WHERE folder_id = ? AND monday_user_id {null_match} '
+            f'ORDER BY monday_user_id IS NULL LIMIT 1',
+            (folder_key, user_id)
+        ).fetchone()
+        if row is None and user_id is not None:
+            row = self._execute('SELECT id FROM email_folders WHERE folder_id = ? AND monday_user_id IS NULL LIMIT 1',
+                                (folder_key,)).fetchone()
+
+        if row is None:
+            folder_uuid = new_uuid()
+            self._execute('INSERT INTO email_folders (id, folder_id, display_name, monday_user_id) VALUES (?, ?, ?, ?)',
+                          (folder_uuid, folder_key, display_name, user_id))
+        else:
+            folder_uuid = str(row[0])
+
+        self.folder_ids[key] = folder_uuid
+        return folder_uuid
+
+    def _existing_ids(self, user_id, email_ids):
+        """Map Exchange ids already in `emails` for this user to their row ids"""
+        null_match = 'IS NOT DISTINCT FROM ?' if self.postgres else 'IS ?'
+        existing = {}
+
+        if self.postgres:
+            rows = self._execute(f'SELECT email_id, id FROM emails WHERE monday_user_id {null_match} AND email_id = ANY(?)',
+                                 (user_id, list(email_ids)))
+            existing.update((email_id, str(row_id)) for email_id, row_id in rows)
+            return existing
+
+        email_ids = list(email_ids)
+        for start in range(0, len(email_ids), MAX_QUERY_IDS):
+            chunk = email_ids[start:start + MAX_QUERY_IDS]
+            placeholders = ','.join('?' * len(chunk))
+            rows = self._execute(f'SELECT email_id, id FROM emails WHERE monday_user_id {null_match} '
+                                 f'AND email_id IN ({placeholders})', [user_id] + chunk)
+            existing.update(rows)
+        return existing
+
+    def _write_batch(self, batch):
+        synced_at = datetime.utcnow().isoformat() + 'Z'
+
+        # Group by user, keeping only the last copy of any email repeated in the batch
+        by_user = {}
+        for email in batch:
+            user_id = self._user_id(email.get('mailbox') or self.default_mailbox)
+            by_user.setdefault(user_id, {})[email['id']] = email
+
+        email_rows = []
+        recipient_rows = []
+        attachment_rows = []
+        replaced = []
+
+        for user_id, emails in by_user.items():
+            existing = self._existing_ids(user_id, emails.keys())
+
+            for email_id, email in emails.items():
+                row_id = existing.get(email_id) or new_uuid()
+                folder_id = self._folder_id(user_id, email.get('folder') or 'inbox')
+                email_rows.append((
+                    row_id, email_id, user_id, folder_id, email.get('subject'), email.get('from'),
+                    email.get('fromName'), email.get('receivedDate'), bool(email.get('hasAttachments')),
+                    bool(email.get('isRead')), synced_at, email.get('body'), email.get('importance'),
+                    email.get('internetMessageId'), email.get('size')
+                ))
+
+                if 'recipients' in email or 'attachments' in email:
+                    replaced.append(row_id)
+                for recipient in email.get('recipients') or []:
+                    recipient_rows.append((new_uuid(), row_id, recipient['type'], recipient['address'],
+                                           recipient.get('name') or None))
+                for attachment in email.get('attachments') or []:
+                    attachment_rows.append((
+                        new_uuid(), row_id, attachment.get('name') or '(unnamed)', attachment.get('contentType'),
+                        attachment.get('size'), attachment.get('contentId'), bool(attachment.get('isInline')),
+                        attachment.get('attachmentId')
+                    ))
+
+        self._upsert_emails(email_rows)
+
+        # Child rows are replaced wholesale for the emails that carried them
+        if replaced:
+            for table in ('email_recipients', 'email_attachments'):
+                self._delete_children(table, replaced)
+        self._bulk_insert('email_recipients', RECIPIENT_COLUMNS, recipient_rows)
+        self._bulk_insert('email_attachments', ATTACHMENT_COLUMNS, attachment_rows)
+
+        self.counts['emails'] += len(email_rows)
+        self.counts['recipients'] += len(recipient_rows)
+        self.counts['attachments'] += len(attachment_rows)
+        METRICS.count('db_rows', len(email_rows) + len(recipient_rows) + len(attachment_rows))
+
+    def _upsert_emails(self, rows):
+        if not rows:
+            return
+
+        columns = ', '.join(EMAIL_COLUMNS)
+        updates = ', '.join(f'{column} = COALESCE(excluded.{column}, emails.{column})' if column in OPTIONAL_EMAIL_COLUMNS
+                            else f'{column} = excluded.{column}' for column in EMAIL_COLUMNS if column != 'id')
+        row_placeholders = '(' + ', '.join('?' * len(EMAIL_COLUMNS)) + ')'
+        sql = f'INSERT INTO emails ({columns}) VALUES {{values}} ON CONFLICT (id) DO UPDATE SET {updates}, ' \
+              f'updated_at = CURRENT_TIMESTAMP'
+
+        if self.postgres:
+            # One multi-row statement per batch
+            params = [value for row in rows for value in row]
+            self._execute(sql.format(values=', '.join([row_placeholders] * len(rows))), params)
+        else:
+            self.connection.executemany(sql.format(values=row_placeholders), rows)
+
+    def _delete_children(self, table, email_row_ids):
+        if self.postgres:
+            self._execute(f'DELETE FROM {table} WHERE email_id = ANY(?::uuid[])', (email_row_ids,))
+            return
+
+        for start in range(0, len(email_row_ids), MAX_QUERY_IDS):
+            chunk = email_row_ids[start:start + MAX_QUERY_IDS]
+            self._execute(f'DELETE FROM {table} WHERE email_id IN ({",".join("?" * len(chunk))})', chunk)
+
+    def _bulk_insert(self, table, columns, rows):
+        if not rows:
+            return
+
+        if self.postgres:
+            with self.connection.cursor().copy(f'COPY {table} ({", ".join(columns)}) FROM STDIN') as copy:
+                for row in rows:
+                    copy.write_row(row)
+        else:
+            placeholders = ', '.join('?' * len(columns))
+            self.connection.executemany(f'INSERT INTO {table} ({", ".join(columns)}) VALUES ({placeholders})', rows)
+
+def load_emails(emails, target=DEFAULT_DB_PATH, batch_size=DEFAULT_LOAD_BATCH):
+    """Load an iterable of email dicts and return the row counts written"""
+    with EmailLoader(target, batch_size=batch_size) as loader:
+        for email in emails:
+            loader.add(email)
+    return loader.counts
+
+if __name__ == "__main__":
+    # Load an existing export (any ews_sinks format) into the database
+    input_path = option_from_argv(sys.argv, '--input', 'ews_detailed_emails.json')
+    target = option_from_argv(sys.argv, '--db', os.environ.get('DATABASE_URL', DEFAULT_DB_PATH))
+    batch_size = int(option_from_argv(sys.argv, '--batch-size', DEFAULT_LOAD_BATCH))
+
+    print(f"Loading {input_path} into {target if not is_postgres(target) else 'Postgres'}...")
+    start = time.perf_counter()
+    counts = load_emails(iter_records(input_path), target, batch_size=batch_size)
+    elapsed = time.perf_counter() - start
+
+    print(f"Loaded {counts['emails']} emails, {counts['recipients']} recipients and {counts['attachments']} attachments "
+          f"in {counts['batches']} batches ({elapsed:.2f}s)")
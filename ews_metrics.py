@@ -0,0 +1,254 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import wraps
+
+# Prefix for every exported metric name
+METRIC_PREFIX = 'ews_'
+
+# Seconds between metric snapshots written during a run
+DEFAULT_FLUSH_INTERVAL = 15
+
+# Where --trace writes its capture
+CPU_PROFILE_PATH = 'ews_profile.prof'
+TOP_ENTRIES = 15
+
+class Metrics:
+    """Thread-safe counters, gauges and timers for the fetch pipeline
+
+    Timers record count, total and max seconds; nested timers are inclusive
+    (e.g. `email_build` contains `record_decode` and `mime_headers`).
+    Updates cost one lock round-trip, so they are safe on per-item paths.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.counters = defaultdict(int)
+            self.gauges = {}
+            self.timers = {}
+            self.started = time.perf_counter()
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    def gauge(self, name, value):
+        with self.lock:
+            self.gauges[name] = value
+
+    def observe(self, name, seconds, count=1):
+        with self.lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                self.timers[name] = [count, seconds, seconds]
+            else:
+                timer[0] += count
+                timer[1] += seconds
+                timer[2] = max(timer[2], seconds)
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def snapshot(self):
+        """Return all metrics as a JSON-ready dict, with derived items/sec"""
+        with self.lock:
+            elapsed = time.perf_counter() - self.started
+            counters = dict(self.counters)
+            snapshot = {
+                'elapsedSeconds': elapsed,
+                'itemsPerSec': counters.get('items', 0) / elapsed if elapsed else 0,
+                'counters': counters,
+                'gauges': dict(self.gauges),
+                'timers': {
+                    name: {'count': count, 'totalSeconds': total, 'maxSeconds': longest,
+                           'meanMs': 1000 * total / count if count else 0}
+                    for name, (count, total, longest) in self.timers.items()
+                }
+            }
+        return snapshot
+
+    def to_prometheus(self):
+        """Render the snapshot in the Prometheus text exposition format"""
+        snapshot = self.snapshot()
+        lines = []
+
+        for name, value in sorted(snapshot['counters'].items()):
+            metric = f"{METRIC_PREFIX}{name}_total"
+            lines += [f"# TYPE {metric} counter", f"{metric} {value:g}"]
+
+        gauges = dict(snapshot['gauges'], items_per_second=snapshot['itemsPerSec'],
+                      elapsed_seconds=snapshot['elapsedSeconds'])
+        for name, value in sorted(gauges.items()):
+            metric = f"{METRIC_PREFIX}{name}"
+            lines += [f"# TYPE {metric} gauge", f"{metric} {value:g}"]
+
+        for name, timer in sorted(snapshot['timers'].items()):
+            metric = f"{METRIC_PREFIX}{name}_seconds"
+            lines += [
+                f"# TYPE {metric} summary",
+                f"{metric}_sum {timer['totalSeconds']:.6f}",
+                f"{metric}_count {timer['count']:g}",
+                f"# TYPE {metric}_max gauge",
+                f"{metric}_max {timer['maxSeconds']:.6f}"
+            ]
+
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """Write a snapshot atomically: JSON for `.json` paths, Prometheus text otherwise (e.g. `.prom`)"""
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'w') as f:
+            if path.endswith('.json'):
+                json.dump(self.snapshot(), f, indent=2)
+            else:
+                f.write(self.to_prometheus())
+        os.replace(temp_path, path)
+
+    def summary(self):
+        """A short human-readable table of the timers, slowest total first"""
+        snapshot = self.snapshot()
+        lines = [f"{snapshot['counters'].get('items', 0):g} items in {snapshot['elapsedSeconds']:.1f}s "
+                 f"({snapshot['itemsPerSec']:.1f} items/sec)"]
+        for name, timer in sorted(snapshot['timers'].items(), key=lambda entry: -entry[1]['totalSeconds']):
+            lines.append(f"  {name:<16} {timer['count']:>8g} calls {timer['totalSeconds']:>9.3f}s "
+                         f"{timer['meanMs']:>9.3f} ms avg")
+        for name, value in sorted(snapshot['counters'].items()):
+            lines.append(f"  {name:<16} {value:>8g}")
+        return '\n'.join(lines)
+
+# Process-wide registry used by the pipeline modules
+METRICS = Metrics()
+
+def timed(name):
+    """Decorator recording each call of a plain function under timer `name`"""
+    def decorate(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                METRICS.observe(name, time.perf_counter() - start)
+        return wrapper
+    return decorate
+
+class ThreadProfiler:
+    """cProfile over the enabling thread and every thread started while it is enabled
+
+    Before Python 3.12 a cProfile profiler only sees the thread that enabled
+    it, but the pipeline parses and decodes on ThreadPoolExecutor workers.
+    Each thread started while this is enabled therefore gets its own
+    profiler, and `stats()` merges them all. From 3.12 one profiler already
+    covers every thread.
+    """
+
+    def __init__(self):
+        self.profilers = [cProfile.Profile()]
+        self.lock = threading.Lock()
+        self.per_thread = sys.version_info < (3, 12)
+
+    def _profile_new_thread(self, frame, event, arg):
+        # First profile event in a new thread: swap this hook for a profiler of the thread's own
+        sys.setprofile(None)
+        profiler = cProfile.Profile()
+        with self.lock:
+            self.profilers.append(profiler)
+        profiler.enable()
+
+    def enable(self):
+        if self.per_thread:
+            threading.setprofile(self._profile_new_thread)
+        self.profilers[0].enable()
+
+    def disable(self):
+        self.profilers[0].disable()
+        if self.per_thread:
+            threading.setprofile(None)
+
+    def stats(self, stream=None):
+        """One pstats.Stats for every thread profiled"""
+        with self.lock:
+            profilers = list(self.profilers)
+        return pstats.Stats(*profilers, stream=stream)
+
+@contextmanager
+def trace(mode):
+    """Capture a cProfile ('cpu') or tracemalloc ('memory') profile around a block and print its top entries
+
+    The cpu profile includes the threads the block starts (see ThreadProfiler).
+    """
+    if mode == 'cpu':
+        profiler = ThreadProfiler()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            output = io.StringIO()
+            stats = profiler.stats(output)
+            stats.dump_stats(CPU_PROFILE_PATH)
+            stats.sort_stats('cumulative').print_stats(TOP_ENTRIES)
+            print(output.getvalue())
+            print(f"CPU profile saved to {CPU_PROFILE_PATH}")
+    elif mode == 'memory':
+        tracemalloc.start(10)
+        try:
+            yield
+        finally:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f"\nTraced memory: {current / 1024 / 1024:.1f} MB current, {peak / 1024 / 1024:.1f} MB peak")
+            for stat in snapshot.statistics('lineno')[:TOP_ENTRIES]:
+                print(f"  {stat}")
+    else:
+        raise ValueError(f"Unknown trace mode '{mode}', expected 'cpu' or 'memory'")
+
+@contextmanager
+def instrument(metrics_path=None, trace_mode=None, stats=False, interval=DEFAULT_FLUSH_INTERVAL):
+    """Instrument a script's main block
+
+    With `metrics_path` a snapshot (JSON or Prometheus text, by extension) is
+    written every `interval` seconds and at exit; `trace_mode` ('cpu' or
+    'memory') captures a profile; `stats` prints the timer table at the end.
+    The scripts map these to --metrics PATH, --trace MODE and --stats.
+    """
+    stop = threading.Event()
+
+    def flush_periodically():
+        while not stop.wait(interval):
+            METRICS.write(metrics_path)
+
+    if metrics_path:
+        threading.Thread(target=flush_periodically, daemon=True).start()
+
+    try:
+        if trace_mode:
+            with trace(trace_mode):
+                yield
+        else:
+            yield
+    finally:
+        stop.set()
+        if metrics_path:
+            METRICS.write(metrics_path)
+            print(f"Metrics saved to {metrics_path}")
+        if stats:
+            print(f"\n{METRICS.summary()}")
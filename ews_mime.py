@@ -0,0 +1,147 @@
+import base64
+import logging
+from email.header import decode_header, make_header
+from email.utils import getaddresses
+
+from ews_metrics import timed
+
+logger = logging.getLogger(__name__)
+
+# Base64 characters decoded per step while looking for the end of the headers
+DECODE_CHUNK = 4096
+
+# Address headers returned by extract_mime_addresses, keyed by output name
+ADDRESS_HEADERS = {
+    'from': 'From',
+    'sender': 'Sender',
+    'returnPath': 'Return-Path',
+    'to': 'To',
+    'cc': 'Cc'
+}
+WANTED_HEADERS = {header_name.lower() for header_name in ADDRESS_HEADERS.values()}
+
+def find_header_end(data, start=0):
+    """Return the offset just past the blank line that ends a MIME header block, or -1"""
+    crlf = data.find(b'\r\n\r\n', start)
+    lf = data.find(b'\n\n', start)
+
+    if crlf == -1 and lf == -1:
+        return -1
+    if lf == -1 or (crlf != -1 and crlf < lf):
+        return crlf + 4
+    return lf + 2
+
+def iter_base64(text, chunk_size=DECODE_CHUNK):
+    """Yield the decoded bytes of base64 `text` a chunk at a time, skipping whitespace"""
+    carry = ''
+
+    for position in range(0, len(text), chunk_size):
+        piece = carry + ''.join(text[position:position + chunk_size].split())
+
+        # Only whole 4-character groups can be decoded; keep the rest for the next step
+        usable = len(piece) - len(piece) % 4
+        carry = piece[usable:]
+        yield base64.b64decode(piece[:usable])
+
+@timed('base64_decode')
+def decode_header_block(mime_base64, chunk_size=DECODE_CHUNK):
+    """Base64-decode MIME content only as far as the end of its header block
+
+    Decoding stops at the first blank line, so the cost depends on the size
+    of the headers rather than the size of the message and its attachments.
+    Whitespace inside the base64 text is skipped. Returns the header bytes.
+    """
+    decoded = bytearray()
+
+    for chunk in iter_base64(mime_base64, chunk_size):
+        search_from = max(0, len(decoded) - 3)
+        decoded += chunk
+
+        header_end = find_header_end(decoded, search_from)
+        if header_end != -1:
+            return bytes(decoded[:header_end])
+
+    return bytes(decoded)
+
+def parse_header_block(header_bytes, wanted):
+    """Return {lowercase name: unfolded value} for the first occurrence of each header in `wanted`
+
+    A single line scan; folded continuation lines are joined onto their header.
+    """
+    values = {}
+    current = None
+
+    for line in header_bytes.decode('utf-8', errors='replace').splitlines():
+        if not line:
+            break
+        if line[0] in ' \t':
+            if current is not None:
+                values[current] += ' ' + line.strip()
+            continue
+
+        name, separator, value = line.partition(':')
+        name = name.strip().lower()
+        current = name if separator and name in wanted and name not in values else None
+        if current is not None:
+            values[current] = value.strip()
+
+    return values
+
+def decode_words(text):
+    """Decode RFC 2047 encoded words (=?charset?q?...?=) in a display name"""
+    if '=?' not in text:
+        return text
+    try:
+        return str(make_header(decode_header(text)))
+    except Exception:
+        return text
+
+def parse_addresses(value):
+    """Parse an address header value into a list of (name, address) tuples"""
+    if not value:
+        return []
+    return [(decode_words(name), address) for name, address in getaddresses([str(value)]) if address]
+
+@timed('mime_headers')
+def extract_mime_addresses(mime_base64):
+    """Extract From, Sender, Return-Path, To and Cc from base64 MIME content in one pass
+
+    Only the header block is decoded, and only the five address headers are
+    unfolded and parsed (RFC 5322 addresses, RFC 2047 encoded display names).
+    Returns a dict of lists of (name, address) tuples keyed like ADDRESS_HEADERS.
+    """
+    header_bytes = decode_header_block(mime_base64)
+    headers = parse_header_block(header_bytes, WANTED_HEADERS)
+
+    addresses = {}
+    for key, header_name in ADDRESS_HEADERS.items():
+        addresses[key] = parse_addresses(headers.get(header_name.lower()))
+        if addresses[key]:
+            logger.debug("Found header %s: %s", header_name, addresses[key])
+
+    return addresses
+
+def addresses_from_headers(headers):
+    """Build extract_mime_addresses-style output from (name, value) header pairs
+
+    Used with t:InternetMessageHeaders when the MIME content was not requested.
+    """
+    wanted = {header_name.lower(): key for key, header_name in ADDRESS_HEADERS.items()}
+    addresses = {key: [] for key in ADDRESS_HEADERS}
+
+    for name, value in headers:
+        key = wanted.get((name or '').lower())
+        if key and not addresses[key]:
+            addresses[key] = parse_addresses(value)
+
+    return addresses
+
+def pick_sender(addresses):
+    """Return the best (name, address) sender from extract_mime_addresses output
+
+    Prefers From, then Sender, then Return-Path. Returns ('', '') if none is set.
+    """
+    for key in ('from', 'sender', 'returnPath'):
+        if addresses.get(key):
+            return addresses[key][0]
+    return '', ''
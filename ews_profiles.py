@@ -0,0 +1,107 @@
+from ews_client import option_from_argv
+
+# Properties behind the fields the scripts actually output
+SUMMARY_FIELDS = [
+    'item:Subject',
+    'message:From',
+    'item:DisplayTo',
+    'item:DateTimeReceived',
+    'item:DateTimeSent',
+    'item:HasAttachments',
+    'message:IsRead'
+]
+
+# Named fetch profiles, from cheapest to most expensive
+FETCH_PROFILES = {
+    # Listing fields only: a few hundred bytes per message
+    'summary': {
+        'base_shape': 'IdOnly',
+        'fields': SUMMARY_FIELDS,
+        'mime': False
+    },
+    # Listing fields plus the transport headers, so From/Sender/Return-Path
+    # can be read without downloading the message body
+    'headers': {
+        'base_shape': 'IdOnly',
+        'fields': SUMMARY_FIELDS + ['item:InternetMessageHeaders'],
+        'mime': False
+    },
+    # The headers profile plus the body as plain text, for the search index (ews_search)
+    'body': {
+        'base_shape': 'IdOnly',
+        'fields': SUMMARY_FIELDS + ['item:InternetMessageHeaders', 'item:Body'],
+        'mime': False,
+        'body_type': 'Text'
+    },
+    # Everything, including the base64 MIME content of the whole message
+    'full': {
+        'base_shape': 'AllProperties',
+        'fields': [],
+        'mime': True,
+        'body_type': 'Text'
+    }
+}
+
+DEFAULT_PROFILE = 'summary'
+
+# Properties only GetItem can return; EWS rejects a FindItem shape that asks for them
+GET_ITEM_ONLY_FIELDS = ('item:Body', 'item:UniqueBody', 'item:Attachments', 'item:MimeContent')
+
+# Default for the detailed export and the crawler: "headers" yields every output
+# field, including the real sender, without MIME; use "full" to download the whole message
+DETAILED_PROFILE = 'headers'
+
+# Default when a run also feeds the search index, which needs the body text
+INDEX_PROFILE = 'body'
+
+def get_profile(name):
+    """Look up a fetch profile by name"""
+    if name not in FETCH_PROFILES:
+        raise ValueError(f"Unknown fetch profile '{name}', expected one of: {', '.join(FETCH_PROFILES)}")
+    return FETCH_PROFILES[name]
+
+def fetches_body(name):
+    """Whether a fetch profile returns the message body (item:Body, or AllProperties)"""
+    profile = get_profile(name)
+    return profile['base_shape'] == 'AllProperties' or 'item:Body' in profile['fields']
+
+def build_item_shape(name, find_item=False, attachments=False, extra_fields=()):
+    """Build the <m:ItemShape> element for a fetch profile
+
+    FindItem cannot return MIME content, the body or attachments, so with
+    `find_item` those (GET_ITEM_ONLY_FIELDS) are left out even if the
+    profile asks for them. `attachments` adds the t:Attachments metadata
+    (AllProperties already includes it), and `extra_fields` any other FieldURIs.
+    """
+    profile = get_profile(name)
+    fields = list(profile['fields']) + list(extra_fields)
+    if attachments and profile['base_shape'] == 'IdOnly':
+        fields.append('item:Attachments')
+    if find_item:
+        fields = [field for field in fields if field not in GET_ITEM_ONLY_FIELDS]
+
+    lines = [
+        '<m:ItemShape>',
+        f"  <t:BaseShape>{profile['base_shape']}</t:BaseShape>"
+    ]
+
+    if profile['mime'] and not find_item:
+        lines.append('  <t:IncludeMimeContent>true</t:IncludeMimeContent>')
+
+    if profile.get('body_type') and not find_item:
+        lines.append(f"  <t:BodyType>{profile['body_type']}</t:BodyType>")
+
+    if fields:
+        lines.append('  <t:AdditionalProperties>')
+        for field in fields:
+            lines.append(f'    <t:FieldURI FieldURI="{field}" />')
+        lines.append('  </t:AdditionalProperties>')
+
+    lines.append('</m:ItemShape>')
+    return '\n'.join(lines)
+
+def profile_from_argv(argv, default=DEFAULT_PROFILE):
+    """Return the profile named by a `--profile NAME` command-line option, or `default`"""
+    name = option_from_argv(argv, '--profile', default)
+    get_profile(name)
+    return name
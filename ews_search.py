@@ -0,0 +1,242 @@
+import shlex
+import sqlite3
+import sys
+import time
+
+from ews_client import option_from_argv
+from ews_store import MAX_QUERY_IDS
+from ews_sinks import iter_records
+from ews_metrics import METRICS
+
+DEFAULT_INDEX_PATH = 'ews_search.db'
+
+# Emails indexed per transaction
+DEFAULT_INDEX_BATCH = 500
+
+# Body text indexed per email; quoted history past this adds size, not hits
+MAX_BODY_CHARS = 64 * 1024
+
+DEFAULT_LIMIT = 20
+
+# bm25 weights for subject, sender, recipients and body: a subject hit outranks a body hit
+COLUMN_WEIGHTS = (10.0, 5.0, 3.0, 1.0)
+
+# Search box prefixes that limit a term to one column
+FIELD_ALIASES = {
+    'subject': 'subject',
+    'from': 'sender',
+    'to': 'recipients',
+    'cc': 'recipients',
+    'body': 'body'
+}
+
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    rowid INTEGER PRIMARY KEY,
+    email_id TEXT NOT NULL UNIQUE,
+    mailbox TEXT,
+    received_date TEXT
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS email_text USING fts5(
+    subject, sender, recipients, body,
+    tokenize = 'unicode61 remove_diacritics 2'
+);
+"""
+
+def match_query(text):
+    """Turn a search box string into an FTS5 MATCH expression
+
+    Terms are ANDed and quoted, so punctuation in addresses and subjects is
+    safe. "double quotes" group a phrase, `from:`, `to:`, `cc:`, `subject:`
+    and `body:` limit a term to one column, and a trailing * makes it a
+    prefix search. Returns '' when nothing searchable is left.
+    """
+    try:
+        words = shlex.split(text)
+    except ValueError:
+        words = text.split()
+
+    terms = []
+    for word in words:
+        field, separator, value = word.partition(':')
+        column = FIELD_ALIASES.get(field.lower()) if separator else None
+        if column is None:
+            value = word
+
+        prefix = value.endswith('*')
+        value = value.rstrip('*').strip()
+        if not value:
+            continue
+
+        term = '"' + value.replace('"', '""') + '"' + ('*' if prefix else '')
+        terms.append(f"{column} : {term}" if column else term)
+
+    return ' AND '.join(terms)
+
+def document_text(email):
+    """Return the (subject, sender, recipients, body) text indexed for an email dict"""
+    sender = ' '.join(part for part in (email.get('fromName'), email.get('from')) if part)
+
+    if email.get('recipients'):
+        recipients = ' '.join(
+            f"{recipient.get('name') or ''} {recipient['address']}" for recipient in email['recipients']
+        )
+    else:
+        # Summary records only have the display names
+        recipients = email.get('to') or ''
+
+    return email.get('subject') or '', sender, recipients, (email.get('body') or '')[:MAX_BODY_CHARS]
+
+class SearchIndex:
+    """Local full-text index (SQLite FTS5) over email subject, sender, recipients and body
+
+    Email dicts from get_detailed_emails (or the crawler) are added as they
+    arrive and written `batch_size` at a time, one transaction per batch;
+    adding an email that is already indexed replaces it, so sync runs keep
+    the index current. `search` returns email ids ranked by bm25, with
+    subject hits weighted highest (COLUMN_WEIGHTS).
+    """
+
+    def __init__(self, path=DEFAULT_INDEX_PATH, batch_size=DEFAULT_INDEX_BATCH):
+        self.path = path
+        self.batch_size = batch_size
+        self.pending = []
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(INDEX_SCHEMA)
+
+    def add(self, email):
+        """Queue one email dict, writing a batch once `batch_size` are queued"""
+        self.pending.append(email)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+
+        start = time.perf_counter()
+        batch, self.pending = self.pending, []
+
+        with self.connection:
+            for email in batch:
+                rowid = self.connection.execute(
+                    'INSERT INTO documents (email_id, mailbox, received_date) VALUES (?, ?, ?) '
+                    'ON CONFLICT (email_id) DO UPDATE SET mailbox = excluded.mailbox, '
+                    'received_date = excluded.received_date RETURNING rowid',
+                    (email['id'], email.get('mailbox'), email.get('receivedDate'))
+                ).fetchone()[0]
+                self.connection.execute('DELETE FROM email_text WHERE rowid = ?', (rowid,))
+                self.connection.execute('INSERT INTO email_text (rowid, subject, sender, recipients, body) '
+                                        'VALUES (?, ?, ?, ?, ?)', (rowid,) + document_text(email))
+
+        METRICS.observe('index_batch', time.perf_counter() - start)
+        METRICS.count('indexed', len(batch))
+
+    def delete_many(self, email_ids):
+        """Drop emails from the index, e.g. after a SyncFolderItems delete"""
+        self.flush()
+        email_ids = list(email_ids)
+
+        with self.connection:
+            for start in range(0, len(email_ids), MAX_QUERY_IDS):
+                chunk = email_ids[start:start + MAX_QUERY_IDS]
+                placeholders = ','.join('?' * len(chunk))
+                self.connection.execute(f'DELETE FROM email_text WHERE rowid IN '
+                                        f'(SELECT rowid FROM documents WHERE email_id IN ({placeholders}))', chunk)
+                self.connection.execute(f'DELETE FROM documents WHERE email_id IN ({placeholders})', chunk)
+
+    def search(self, text, limit=DEFAULT_LIMIT, mailbox=None):
+        """Return up to `limit` email ids matching a search box string (see match_query), best first"""
+        self.flush()
+        query = match_query(text)
+        if not query:
+            return []
+
+        weights = ', '.join(str(weight) for weight in COLUMN_WEIGHTS)
+        sql = ('SELECT documents.email_id FROM email_text JOIN documents ON documents.rowid = email_text.rowid '
+               'WHERE email_text MATCH ?')
+        params = [query]
+        if mailbox:
+            sql += ' AND documents.mailbox = ?'
+            params.append(mailbox)
+        sql += f' ORDER BY bm25(email_text, {weights}) LIMIT ?'
+        params.append(limit)
+
+        start = time.perf_counter()
+        ids = [row[0] for row in self.connection.execute(sql, params)]
+        METRICS.observe('search', time.perf_counter() - start)
+        return ids
+
+    def summaries(self, email_ids):
+        """Return {email id: (subject, sender)} for display alongside search results"""
+        summaries = {}
+        email_ids = list(email_ids)
+        for start in range(0, len(email_ids), MAX_QUERY_IDS):
+            chunk = email_ids[start:start + MAX_QUERY_IDS]
+            rows = self.connection.execute(
+                'SELECT documents.email_id, email_text.subject, email_text.sender FROM documents '
+                f'JOIN email_text ON email_text.rowid = documents.rowid WHERE documents.email_id IN ({",".join("?" * len(chunk))})',
+                chunk
+            )
+            summaries.update((email_id, (subject, sender)) for email_id, subject, sender in rows)
+        return summaries
+
+    def count(self):
+        self.flush()
+        return self.connection.execute('SELECT COUNT(*) FROM documents').fetchone()[0]
+
+    def optimize(self):
+        """Merge the FTS5 index segments; worth running after a large build"""
+        self.flush()
+        with self.connection:
+            self.connection.execute("INSERT INTO email_text (email_text) VALUES ('optimize')")
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.connection.close()
+
+if __name__ == "__main__":
+    index_path = option_from_argv(sys.argv, '--index', DEFAULT_INDEX_PATH)
+
+    # --build indexes an existing export (any ews_sinks format); otherwise the first argument is the query
+    if '--build' in sys.argv:
+        input_path = option_from_argv(sys.argv, '--input', 'ews_detailed_emails.json')
+        print(f"Indexing {input_path} into {index_path}...")
+        start = time.perf_counter()
+        with SearchIndex(index_path) as index:
+            for email in iter_records(input_path):
+                index.add(email)
+            index.optimize()
+            total = index.count()
+        print(f"Indexed {total} emails in {time.perf_counter() - start:.2f}s")
+        sys.exit(0)
+
+    if len(sys.argv) < 2 or sys.argv[1].startswith('--'):
+        print('Usage: python ews_search.py "QUERY" [--index PATH] [--limit N] [--mailbox ADDRESS]')
+        print('       python ews_search.py --build [--input EXPORT] [--index PATH]')
+        sys.exit(1)
+
+    limit = int(option_from_argv(sys.argv, '--limit', DEFAULT_LIMIT))
+    with SearchIndex(index_path) as index:
+        start = time.perf_counter()
+        ids = index.search(sys.argv[1], limit=limit, mailbox=option_from_argv(sys.argv, '--mailbox'))
+        elapsed = time.perf_counter() - start
+        summaries = index.summaries(ids)
+
+    print(f"{len(ids)} results in {elapsed * 1000:.1f} ms")
+    for rank, email_id in enumerate(ids, 1):
+        subject, sender = summaries.get(email_id, ('', ''))
+        print(f"{rank}. {subject}")
+        print(f"   From: {sender}")
+        print(f"   Id: {email_id}")
@@ -0,0 +1,234 @@
+import gzip
+import io
+import json
+import os
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Records written between checkpoints unless the caller checkpoints itself
+DEFAULT_CHECKPOINT_EVERY = 100
+
+def detect_format(path):
+    """Return (layout, compression) for an output path
+
+    `.json` is a pretty-printed JSON array (the scripts' historical format);
+    `.jsonl` is JSON Lines, optionally followed by `.gz` or `.zst`.
+    """
+    compression = None
+    base = path
+    if path.endswith('.gz'):
+        compression, base = 'gzip', path[:-3]
+    elif path.endswith('.zst'):
+        compression, base = 'zstd', path[:-4]
+
+    if base.endswith('.jsonl'):
+        return 'jsonl', compression
+    if base.endswith('.json') and compression is None:
+        return 'json', None
+    raise ValueError(f"Unsupported output format for {path}: use .json, .jsonl, .jsonl.gz or .jsonl.zst")
+
+def temp_path_for(path):
+    """Insert `.tmp` before the extensions, keeping the format recognisable (a.jsonl.gz -> a.tmp.jsonl.gz)"""
+    directory, name = os.path.split(path)
+    stem, dot, extensions = name.partition('.')
+    return os.path.join(directory, f"{stem}.tmp{dot}{extensions}")
+
+class ResumePointNotFound(Exception):
+    """The last checkpointed email is no longer in the folder, so there is nowhere to resume from"""
+
+def checkpoint_path_for(path):
+    return f"{path}.checkpoint"
+
+class RecordSink:
+    """Stream email dicts to disk in constant memory, with a resumable checkpoint
+
+    Records are written as they arrive. Every `checkpoint()` closes the
+    current compressed segment (gzip members and zstd frames concatenate
+    into a valid stream), flushes to disk and saves the byte offset, record
+    count, last record id and any caller state next to the output. Opening
+    with `resume=True` truncates anything written after the last checkpoint
+    and appends from there, so an interrupted export picks up where it
+    stopped instead of starting over.
+    """
+
+    def __init__(self, path, resume=False, checkpoint_every=DEFAULT_CHECKPOINT_EVERY):
+        self.path = path
+        self.layout, self.compression = detect_format(path)
+        self.checkpoint_path = checkpoint_path_for(path)
+        self.checkpoint_every = checkpoint_every
+        self.count = 0
+        self.last_id = None
+        self.state = {}
+        self.pending = 0
+        self.segment = None
+
+        if self.compression == 'zstd' and zstandard is None:
+            raise RuntimeError("zstd output requires the 'zstandard' package (pip install zstandard)")
+
+        checkpoint = self._load_checkpoint() if resume else None
+        if checkpoint:
+            self.count = checkpoint['records']
+            self.last_id = checkpoint.get('lastId')
+            self.state = checkpoint.get('state', {})
+            self.raw = open(path, 'r+b')
+            self.raw.truncate(checkpoint['offset'])
+            self.raw.seek(checkpoint['offset'])
+            print(f"Resuming {path} after {self.count} records")
+        else:
+            self.raw = open(path, 'wb')
+            if self.layout == 'json':
+                self.raw.write(b'[')
+            self.checkpoint()
+
+    def _load_checkpoint(self):
+        if not os.path.exists(self.checkpoint_path) or not os.path.exists(self.path):
+            return None
+        with open(self.checkpoint_path) as f:
+            return json.load(f)
+
+    def _open_segment(self):
+        if self.compression == 'gzip':
+            return gzip.GzipFile(fileobj=self.raw, mode='wb')
+        if self.compression == 'zstd':
+            return zstandard.ZstdCompressor().stream_writer(self.raw, closefd=False)
+        return self.raw
+
+    def _close_segment(self):
+        if self.segment is not None and self.segment is not self.raw:
+            self.segment.close()
+        self.segment = None
+
+    def write(self, email):
+        """Append one record, checkpointing every `checkpoint_every` records"""
+        if self.segment is None:
+            self.segment = self._open_segment()
+
+        if self.layout == 'json':
+            separator = ',\n' if self.count else '\n'
+            body = '\n'.join('  ' + line for line in json.dumps(email, indent=2).split('\n'))
+            self.segment.write((separator + body).encode('utf-8'))
+        else:
+            self.segment.write((json.dumps(email, separators=(',', ':')) + '\n').encode('utf-8'))
+
+        self.count += 1
+        self.pending += 1
+        self.last_id = email.get('id')
+
+        if self.checkpoint_every and self.pending >= self.checkpoint_every:
+            self.checkpoint()
+
+    def checkpoint(self, **state):
+        """Make everything written so far durable and record where to resume from"""
+        self._close_segment()
+        self.raw.flush()
+        os.fsync(self.raw.fileno())
+        self.state.update(state)
+        self.pending = 0
+
+        temp_path = f"{self.checkpoint_path}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump({
+                'records': self.count,
+                'offset': self.raw.tell(),
+                'lastId': self.last_id,
+                'state': self.state
+            }, f)
+        os.replace(temp_path, self.checkpoint_path)
+
+    def close(self):
+        """Finish the output and drop the checkpoint, since there is nothing left to resume"""
+        self._close_segment()
+        if self.layout == 'json':
+            self.raw.write(b'\n]' if self.count else b']')
+        self.raw.close()
+
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        # Leave the checkpoint in place after a failure so the run can resume
+        if exc_type is None:
+            self.close()
+        else:
+            self.checkpoint()
+            self.raw.close()
+
+def open_text(path):
+    """Open an output file for reading as text, decompressing by extension"""
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8')
+    if path.endswith('.zst'):
+        if zstandard is None:
+            raise RuntimeError("Reading zstd output requires the 'zstandard' package (pip install zstandard)")
+        return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), read_across_frames=True),
+                                encoding='utf-8')
+    return open(path, encoding='utf-8')
+
+def iter_records(path, where=None, fields=None):
+    """Lazily yield records from any sink output, optionally filtered
+
+    JSON Lines files are read one line at a time; a line is only decoded
+    when it can match `where`, a dict of field -> value that must all be
+    equal (e.g. {'isRead': False}). `fields` limits the keys returned.
+    Legacy `.json` arrays are loaded whole.
+    """
+    layout, _ = detect_format(path)
+
+    if layout == 'json':
+        with open(path, encoding='utf-8') as f:
+            records = json.load(f)
+    else:
+        records = None
+
+    def matches(record):
+        return not where or all(record.get(key) == value for key, value in where.items())
+
+    def project(record):
+        return {key: record.get(key) for key in fields} if fields else record
+
+    if records is not None:
+        for record in records:
+            if matches(record):
+                yield project(record)
+        return
+
+    # Cheap substring pre-check on each raw line before paying for json.loads
+    needles = [json.dumps(value) for value in where.values()] if where else []
+
+    with open_text(path) as f:
+        for line in f:
+            if not line.strip() or any(needle not in line for needle in needles):
+                continue
+            record = json.loads(line)
+            if matches(record):
+                yield project(record)
+
+def skip_until(entries, last_id, key=lambda entry: entry[0]):
+    """Drop entries up to and including the one whose id is `last_id`, then yield the rest
+
+    Used to resume a crawl after the last checkpointed record. With no
+    `last_id` everything is yielded. If `last_id` never turns up (the email
+    was deleted or moved since the checkpoint) ResumePointNotFound is
+    raised, so the sink keeps its checkpoint instead of finalizing a
+    truncated export.
+    """
+    found = last_id is None
+    for entry in entries:
+        if found:
+            yield entry
+        elif key(entry) == last_id:
+            found = True
+
+    if not found:
+        raise ResumePointNotFound(f"Resume point {last_id} was not found in the folder; "
+                                  f"run again without --resume to start the export over")
+
+def open_sink(path, resume=False, checkpoint_every=DEFAULT_CHECKPOINT_EVERY):
+    """Open a RecordSink for `path`, resuming from its checkpoint when asked and one exists"""
+    return RecordSink(path, resume=resume, checkpoint_every=checkpoint_every)
@@ -0,0 +1,83 @@
+import sqlite3
+import json
+import threading
+from datetime import datetime
+
+DEFAULT_STORE_PATH = 'ews_messages.db'
+
+# SQLite limits the number of bound parameters per statement
+MAX_QUERY_IDS = 500
+
+class MessageStore:
+    """Local SQLite (WAL) cache of decoded emails keyed by ItemId
+
+    Each row keeps the ChangeKey and fetch profile the email was decoded
+    with, so callers can skip GetItem for items whose ChangeKey has not moved.
+    One connection is shared between fetch threads behind a lock.
+    """
+
+    def __init__(self, path=DEFAULT_STORE_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS messages (
+                item_id TEXT PRIMARY KEY,
+                change_key TEXT,
+                profile TEXT,
+                record TEXT NOT NULL,
+                updated_at TEXT
+            )
+        """)
+        self.connection.commit()
+
+    def get_current(self, item_ids, profile):
+        """Return {item_id: email} for the (Id, ChangeKey, ...) tuples whose cached copy is still current
+
+        A cached copy is current when its ChangeKey matches and it was
+        decoded with the same fetch profile.
+        """
+        wanted = {entry[0]: entry[1] for entry in item_ids}
+        current = {}
+        ids = list(wanted)
+
+        with self.lock:
+            for start in range(0, len(ids), MAX_QUERY_IDS):
+                chunk = ids[start:start + MAX_QUERY_IDS]
+                placeholders = ','.join('?' * len(chunk))
+                rows = self.connection.execute(
+                    f'SELECT item_id, change_key, profile, record FROM messages WHERE item_id IN ({placeholders})',
+                    chunk
+                )
+                for item_id, change_key, row_profile, record in rows:
+                    if change_key == wanted[item_id] and row_profile == profile:
+                        current[item_id] = json.loads(record)
+
+        return current
+
+    def put_many(self, entries, profile):
+        """Insert or replace (item_id, change_key, email) entries in one transaction"""
+        updated_at = datetime.utcnow().isoformat() + 'Z'
+        rows = [
+            (item_id, change_key, profile, json.dumps(email), updated_at)
+            for item_id, change_key, email in entries
+        ]
+
+        with self.lock:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO messages (item_id, change_key, profile, record, updated_at) VALUES (?, ?, ?, ?, ?)',
+                rows
+            )
+            self.connection.commit()
+
+    def delete_many(self, item_ids):
+        """Forget cached emails, e.g. after a SyncFolderItems delete"""
+        with self.lock:
+            self.connection.executemany('DELETE FROM messages WHERE item_id = ?', [(item_id,) for item_id in item_ids])
+            self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
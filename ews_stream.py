@@ -0,0 +1,99 @@
+import xml.etree.ElementTree as ET
+import os
+import time
+
+import requests
+
+from ews_metrics import METRICS
+
+# Bytes read from the HTTP stream per parser feed
+CHUNK_SIZE = 64 * 1024
+
+class EwsRequestError(Exception):
+    """An EWS request that failed outright, e.g. a non-200 status once the session's retries ran out"""
+
+class TruncatedResponse(EwsRequestError):
+    """The response body was cut off after its headers arrived, so only part of it was parsed"""
+
+# Errors raised while a streamed body is read, i.e. after the session has handed the response back
+STREAM_ERRORS = (requests.exceptions.ChunkedEncodingError, requests.ConnectionError, requests.Timeout, ET.ParseError)
+
+def numbered_path(path, number):
+    """Return `path` for the first response of a run and `name.N.ext` for the rest"""
+    if not path or number <= 1:
+        return path
+    base, ext = os.path.splitext(path)
+    return f"{base}.{number}{ext}"
+
+def iter_elements(chunks, tags, tee_path=None):
+    """Incrementally parse a SOAP response, yielding each element in `tags` as soon as it closes
+
+    `chunks` is any iterable of bytes (e.g. `response.iter_content()`), so the
+    body is never held in memory as a whole. A yielded element is only valid
+    until the caller asks for the next one: it is then cleared and detached
+    from its parent, which keeps peak memory at roughly one element's size.
+    When `tee_path` is set the raw bytes are copied to that file as they arrive.
+    Bytes read and parser time (not the caller's time) go to METRICS.
+    """
+    parser = ET.XMLPullParser(events=('start', 'end'))
+    parents = []
+    tee = open(tee_path, 'wb') if tee_path else None
+    parse_seconds = 0.0
+    received = 0
+
+    def drain():
+        for event, elem in parser.read_events():
+            if event == 'start':
+                parents.append(elem)
+                continue
+
+            parents.pop()
+            if elem.tag in tags:
+                yield elem
+                elem.clear()
+                if parents:
+                    parents[-1].remove(elem)
+
+    try:
+        for chunk in chunks:
+            if tee:
+                tee.write(chunk)
+            received += len(chunk)
+            start = time.perf_counter()
+            parser.feed(chunk)
+            parse_seconds += time.perf_counter() - start
+            yield from drain()
+
+        start = time.perf_counter()
+        parser.close()
+        parse_seconds += time.perf_counter() - start
+        yield from drain()
+    finally:
+        if tee:
+            tee.close()
+        METRICS.observe('xml_parse', parse_seconds)
+        METRICS.count('bytes_received', received)
+
+def stream_soap(post, endpoint, headers, body, tags, tee_path=None):
+    """POST a SOAP request and stream the response through `iter_elements`
+
+    `post` is `requests.post` or a Session's `post`. A non-200 response
+    raises EwsRequestError, so a failed call cannot pass for an empty one;
+    a body cut off part way raises TruncatedResponse once the elements that
+    did arrive have been yielded.
+    """
+    response = post(endpoint, headers=headers, data=body, stream=True)
+
+    try:
+        if response.status_code != 200:
+            raise EwsRequestError(f"Received status code {response.status_code}: {response.text}")
+
+        if tee_path:
+            print(f"Saving raw XML response to {tee_path}")
+
+        try:
+            yield from iter_elements(response.iter_content(chunk_size=CHUNK_SIZE), tags, tee_path=tee_path)
+        except STREAM_ERRORS as e:
+            raise TruncatedResponse(f"Response cut short: {e}") from e
+    finally:
+        response.close()
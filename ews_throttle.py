@@ -0,0 +1,257 @@
+import random
+import re
+import threading
+import time
+
+import requests
+
+from ews_client import qname
+from ews_stream import TruncatedResponse
+from ews_metrics import METRICS
+
+# Retry policy for throttled or transiently failing EWS calls
+DEFAULT_MAX_RETRIES = 5
+BASE_RETRY_DELAY = 0.5
+MAX_RETRY_DELAY = 60.0
+
+# Minimum time between two multiplicative decreases, so one burst of busy
+# responses from requests that were already in flight only halves the limit once
+DECREASE_COOLDOWN = 1.0
+
+# The throttling signal, and the per-item codes worth retrying
+BUSY_CODE = 'ErrorServerBusy'
+RETRYABLE_CODES = {
+    BUSY_CODE,
+    'ErrorInternalServerTransientError',
+    'ErrorTimeoutExpired',
+    'ErrorMailboxStoreUnavailable',
+    'ErrorConnectionFailed'
+}
+
+# HTTP statuses retried at the request level; 503 also counts as throttling
+RETRYABLE_STATUSES = {429, 502, 503, 504}
+
+BACK_OFF_PATTERN = re.compile(r'BackOffMilliseconds"?\s*>\s*(\d+)')
+
+def parse_back_off(text):
+    """Return the BackOffMilliseconds hint in a SOAP fault or response, in seconds, or None"""
+    match = BACK_OFF_PATTERN.search(text or '')
+    return int(match.group(1)) / 1000 if match else None
+
+class ConcurrencyController:
+    """AIMD limit on concurrent EWS requests, shared by every thread signed in as one account
+
+    Each successful request raises the limit by 1/limit (about one slot per
+    round of requests) up to `maximum`; each throttling signal halves it,
+    at most once per DECREASE_COOLDOWN, down to `minimum`. A server
+    BackOffMilliseconds hint also pauses new requests from every thread
+    until it has passed, since EWS throttles the account, not the connection.
+    """
+
+    def __init__(self, initial=8, minimum=1, maximum=None, max_retries=DEFAULT_MAX_RETRIES):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum or initial
+        self.max_retries = max_retries
+        self.active = 0
+        self.paused_until = 0.0
+        self.last_decrease = 0.0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while True:
+                wait = self.paused_until - time.monotonic()
+                if wait <= 0 and self.active < int(self.limit):
+                    self.active += 1
+                    return
+                self.condition.wait(timeout=wait if wait > 0 else None)
+
+    def release(self):
+        with self.condition:
+            self.active -= 1
+            self.condition.notify_all()
+
+    def on_success(self):
+        with self.condition:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+    def on_throttle(self, back_off=None):
+        """Halve the limit and honour the server's back-off hint (seconds)"""
+        now = time.monotonic()
+        with self.condition:
+            if now - self.last_decrease >= DECREASE_COOLDOWN:
+                self.limit = max(self.minimum, self.limit / 2)
+                self.last_decrease = now
+                print(f"Server busy: concurrency limit now {int(self.limit)}")
+            if back_off:
+                self.paused_until = max(self.paused_until, now + back_off)
+            limit = self.limit
+
+        METRICS.count('throttle_events')
+        METRICS.gauge('concurrency_limit', limit)
+
+    def retry_delay(self, attempt, back_off=None):
+        """Jittered exponential delay before retry number `attempt` (0-based), never shorter than `back_off`"""
+        ceiling = min(MAX_RETRY_DELAY, BASE_RETRY_DELAY * 2 ** attempt)
+        delay = random.uniform(ceiling / 2, ceiling)
+        if back_off:
+            delay = max(delay, back_off * random.uniform(1.0, 1.2))
+        return delay
+
+class ThrottledSession(requests.Session):
+    """A requests Session whose calls go through a ConcurrencyController
+
+    Every request waits for a slot before it is sent and gives it back once
+    the response headers are in (the body may still be streaming). HTTP 503
+    and SOAP faults carrying ErrorServerBusy shrink the limit and are
+    retried after the server's back-off hint; other retryable statuses,
+    connection errors and bodies cut off while they were read are retried
+    with jittered backoff. When retries run out the last response is
+    returned, so callers report it as before. Streamed bodies are read after
+    the session has returned; their consumers retry those (retry_failed_items,
+    ews_client.crawl_folder).
+    """
+
+    def __init__(self, controller):
+        super().__init__()
+        self.controller = controller
+
+    def request(self, method, url, **kwargs):
+        controller = self.controller
+        attempt = 0
+
+        # Encode SOAP bodies once, as UTF-8 like their Content-Type says, so bytes_sent counts bytes
+        if isinstance(kwargs.get('data'), str):
+            kwargs['data'] = kwargs['data'].encode('utf-8')
+
+        while True:
+            controller.acquire()
+            start = time.perf_counter()
+            try:
+                response = super().request(method, url, **kwargs)
+                error = None
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+                response, error = None, e
+            finally:
+                controller.release()
+                METRICS.observe('http_request', time.perf_counter() - start)
+                METRICS.count('http_requests')
+                METRICS.count('bytes_sent', len(kwargs.get('data') or b''))
+
+            # Streamed bodies are counted as they are parsed (ews_stream)
+            if response is not None and not kwargs.get('stream'):
+                METRICS.count('bytes_received', len(response.content))
+
+            back_off = None
+            throttled = False
+            if response is not None:
+                if response.status_code == 200:
+                    controller.on_success()
+                    return response
+
+                # Faults are small; reading one here leaves it cached on the response for the caller
+                busy = response.status_code == 500 and BUSY_CODE in response.text
+                throttled = busy or response.status_code in (429, 503)
+                if not throttled and response.status_code not in RETRYABLE_STATUSES:
+                    return response
+                back_off = parse_back_off(response.text) or _retry_after(response)
+
+            if throttled:
+                controller.on_throttle(back_off)
+
+            if attempt >= controller.max_retries:
+                if error is not None:
+                    raise error
+                return response
+
+            delay = controller.retry_delay(attempt, back_off)
+            reason = error or f"status {response.status_code}{' (server busy)' if throttled else ''}"
+            print(f"Request failed ({reason}); retry {attempt + 1}/{controller.max_retries} in {delay:.1f}s")
+            METRICS.count('http_retries')
+            if response is not None:
+                response.close()
+            time.sleep(delay)
+            attempt += 1
+
+def _retry_after(response):
+    value = response.headers.get('Retry-After')
+    return float(value) if value and value.isdigit() else None
+
+class ResponseCodes:
+    """Collects per-item ResponseCodes (and any back-off hint) from a streamed multi-item response
+
+    Feed it the TAGS elements alongside the item elements; response messages
+    map positionally onto the requested ids, so `position` is the index of
+    the id whose items are currently streaming.
+    """
+
+    TAGS = {qname('m', 'ResponseCode'), qname('t', 'Value')}
+
+    def __init__(self):
+        self.codes = []
+        self.back_off = None
+
+    @property
+    def position(self):
+        return len(self.codes) - 1
+
+    def truncate(self):
+        """Drop the last code after a cut-off response: its item may not have arrived in full"""
+        del self.codes[-1:]
+
+    def feed(self, elem):
+        if elem.tag == qname('m', 'ResponseCode'):
+            self.codes.append(elem.text)
+        elif elem.get('Name') == 'BackOffMilliseconds' and elem.text and elem.text.isdigit():
+            self.back_off = max(self.back_off or 0, int(elem.text) / 1000)
+
+def retry_failed_items(session, item_ids, attempt, what='GetItem'):
+    """Run `attempt(ids, codes)` and re-run it for just the ids that failed transiently
+
+    `attempt` issues one multi-item request for the given id tuples, keeps
+    whatever succeeded and feeds the response to `codes` (a ResponseCodes).
+    Ids answered with a code in RETRYABLE_CODES, or missing because the
+    response was cut short, are retried with jittered backoff;
+    ErrorServerBusy also shrinks the session's concurrency limit. Ids with
+    any other error (e.g. ErrorItemNotFound) are reported and skipped.
+    Returns the id tuples still failing when the retries ran out, so callers
+    can tell an incomplete batch from a complete one; a request that fails
+    outright raises ews_stream.EwsRequestError.
+    """
+    controller = getattr(session, 'controller', None) or ConcurrencyController()
+    pending = list(item_ids)
+
+    for retry in range(controller.max_retries + 1):
+        codes = ResponseCodes()
+        try:
+            attempt(pending, codes)
+        except TruncatedResponse as e:
+            # Keep what arrived before the cut; the ids without a code are retried below
+            print(f"{what}: {e}")
+            codes.truncate()
+
+        failed = []
+        for index, entry in enumerate(pending):
+            code = codes.codes[index] if index < len(codes.codes) else 'ErrorConnectionFailed'
+            if code in RETRYABLE_CODES:
+                failed.append(entry)
+            elif code != 'NoError':
+                print(f"Skipping item {entry[0][-16:]}: {code}")
+
+        if BUSY_CODE in codes.codes:
+            controller.on_throttle(codes.back_off)
+
+        if not failed:
+            return []
+
+        if retry < controller.max_retries:
+            delay = controller.retry_delay(retry, codes.back_off)
+            print(f"{what}: {len(failed)} of {len(pending)} items failed transiently; retrying them in {delay:.1f}s")
+            METRICS.count('item_retries', len(failed))
+            time.sleep(delay)
+        pending = failed
+
+    print(f"{what}: giving up on {len(pending)} items after {controller.max_retries} retries")
+    return pending
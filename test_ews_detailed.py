@@ -1,17 +1,29 @@
-import requests
-import xml.etree.ElementTree as ET
-import base64
 from datetime import datetime
 import json
-import re
+import logging
+import os
+import sys
 
-# Constants
-EWS_ENDPOINT = "https://ews.mail.us-east-1.awsapps.com/EWS/Exchange.asmx"
-EMAIL = "j.black@weroofamerica.com"
-PASSWORD = "RestoreMastersLLC2024"
+from ews_client import (
+    EMAIL, DEFAULT_PAGE_SIZE, DEFAULT_SYNC_CHANGES,
+    create_auth_headers, sync_folder_items, folder_id_element, option_from_argv
+)
+from ews_stream import numbered_path
+from ews_metrics import instrument
+from ews_loader import EmailLoader
+from ews_attachments import AttachmentStore
+from ews_search import SearchIndex
+from ews_compact import EmailTable
+from ews_store import DEFAULT_STORE_PATH, MessageStore
+from ews_sinks import open_sink, iter_records, skip_until, temp_path_for
+from ews_profiles import DETAILED_PROFILE, INDEX_PROFILE, get_profile, fetches_body, build_item_shape, profile_from_argv
+from ews_fetch import (
+    DEFAULT_BATCH_SIZE, DEFAULT_MAX_BATCH_BYTES, DEFAULT_WORKERS,
+    create_session, batch_item_ids, fetch_in_order, iter_folder_item_ids, fetch_detailed_batch, fetch_with_store
+)
 
-# SOAP template for FindItem operation to get IDs first
-FIND_ITEMS_TEMPLATE = """<?xml version="1.0" encoding="utf-8"?>
+# SOAP template for SyncFolderItems to pull only the changes since the last run
+SYNC_FOLDER_ITEMS_TEMPLATE = """<?xml version="1.0" encoding="utf-8"?>
 <soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/"
                xmlns:t="http://schemas.microsoft.com/exchange/services/2006/types"
                xmlns:m="http://schemas.microsoft.com/exchange/services/2006/messages">
@@ -19,260 +31,308 @@ FIND_ITEMS_TEMPLATE = """<?xml version="1.0" encoding="utf-8"?>
     <t:RequestServerVersion Version="Exchange2010_SP2" />
   </soap:Header>
   <soap:Body>
-    <m:FindItem Traversal="Shallow">
+    <m:SyncFolderItems>
       <m:ItemShape>
         <t:BaseShape>IdOnly</t:BaseShape>
       </m:ItemShape>
-      <m:IndexedPageItemView MaxEntriesReturned="10" Offset="0" BasePoint="Beginning" />
-      <m:ParentFolderIds>
+      <m:SyncFolderId>
         <t:DistinguishedFolderId Id="inbox" />
-      </m:ParentFolderIds>
-    </m:FindItem>
+      </m:SyncFolderId>
+      {sync_state}
+      <m:MaxChangesReturned>{max_changes}</m:MaxChangesReturned>
+    </m:SyncFolderItems>
   </soap:Body>
 </soap:Envelope>"""
 
-# SOAP template for GetItem operation to get detailed info including MIME content
-GET_ITEM_TEMPLATE = """<?xml version="1.0" encoding="utf-8"?>
-<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/"
-               xmlns:t="http://schemas.microsoft.com/exchange/services/2006/types"
-               xmlns:m="http://schemas.microsoft.com/exchange/services/2006/messages">
-  <soap:Header>
-    <t:RequestServerVersion Version="Exchange2010_SP2" />
-  </soap:Header>
-  <soap:Body>
-    <m:GetItem>
-      <m:ItemShape>
-        <t:BaseShape>AllProperties</t:BaseShape>
-        <t:IncludeMimeContent>true</t:IncludeMimeContent>
-      </m:ItemShape>
-      <m:ItemIds>
-        {item_ids}
-      </m:ItemIds>
-    </m:GetItem>
-  </soap:Body>
-</soap:Envelope>"""
+# Local files used by the detailed export and the incremental sync mode;
+# the output may also be .jsonl, .jsonl.gz or .jsonl.zst (see ews_sinks)
+OUTPUT_PATH = 'ews_detailed_emails.json'
+SYNC_STATE_PATH = 'ews_sync_state.json'
+RAW_RESPONSE_PATH = 'raw_ews_detailed_response.xml'
 
-def create_auth_headers():
-    """Create authentication headers for EWS requests"""
-    auth_string = f"{EMAIL}:{PASSWORD}"
-    auth_bytes = auth_string.encode('ascii')
-    base64_bytes = base64.b64encode(auth_bytes)
-    base64_auth = base64_bytes.decode('ascii')
-    
-    return {
-        'Content-Type': 'text/xml; charset=utf-8',
-        'Authorization': f'Basic {base64_auth}'
-    }
+def iter_item_ids(session, headers, page_size=DEFAULT_PAGE_SIZE, resume_after=None):
+    """Yield (Id, ChangeKey, size) tuples for every message in the inbox, after `resume_after` if given"""
+    item_ids = iter_folder_item_ids(session, headers, folder_id_element('inbox'), page_size=page_size)
+    return skip_until(item_ids, resume_after)
 
-def extract_from_mime(mime_content):
-    """Extract sender information from MIME content"""
-    from_address = ""
-    from_name = ""
-    
-    # Look for standalone From: header line in MIME content
-    from_match = re.search(r'^From:\s*([^\r\n]+)', mime_content, re.IGNORECASE | re.MULTILINE)
-    if from_match and from_match.group(1):
-        from_header = from_match.group(1).strip()
-        
-        # Parse email address and name from the From header
-        if '<' in from_header and '>' in from_header:
-            # Format: "Name <email@example.com>"
-            from_name = from_header.split('<')[0].strip()
-            from_address = from_header.split('<')[1].split('>')[0].strip()
-        else:
-            # Format: "email@example.com"
-            from_address = from_header.strip()
-    
-    # If not found, try alternative patterns
-    if not from_address:
-        # Try to find any email pattern in the content
-        email_match = re.search(r'[\w\.-]+@[\w\.-]+\.\w+', mime_content)
-        if email_match:
-            from_address = email_match.group(0)
-    
-    # Debug: Print the first few lines of MIME content to help with debugging
-    print("\nFirst few lines of MIME content:")
-    lines = mime_content.split('\n')[:20]  # First 20 lines
-    for line in lines:
-        if line.startswith('From:') or line.startswith('Return-Path:') or line.startswith('Sender:'):
-            print(f"Found header: {line}")
-    
-    return from_name, from_address
+def iter_detailed_emails(page_size=DEFAULT_PAGE_SIZE, batch_size=DEFAULT_BATCH_SIZE,
+                         max_batch_bytes=DEFAULT_MAX_BATCH_BYTES, workers=DEFAULT_WORKERS, save_raw=False,
+                         profile=DETAILED_PROFILE, store_path=DEFAULT_STORE_PATH, resume_after=None,
+                         attachments_path=None):
+    """Yield detailed email information, in inbox order
 
-def get_detailed_emails():
-    """Get detailed email information including MIME content"""
+    IDs stream out of the paged FindItem crawl into GetItem batches capped by
+    `batch_size` items or `max_batch_bytes` of estimated MIME, which are fetched
+    by `workers` threads sharing one pooled keep-alive session. `profile`
+    picks the properties GetItem returns; the byte cap only applies to
+    profiles that download MIME. With `save_raw` each raw GetItem response is
+    copied to RAW_RESPONSE_PATH (batch N goes to raw_ews_detailed_response.N.xml).
+    Items whose ChangeKey matches the copy in the message store at
+    `store_path` are not fetched again; pass None to always fetch.
+    `resume_after` skips everything up to and including that email id.
+    With `attachments_path` each email carries attachment references and
+    the bodies are saved in that content-addressed directory. Request
+    failures are raised, so an export sink keeps its checkpoint for --resume.
+    """
     print(f"Connecting to WorkMail with email: {EMAIL}")
     
     headers = create_auth_headers()
+    session = create_session(workers)
+    store = MessageStore(store_path) if store_path else None
+    attachment_store = AttachmentStore(attachments_path) if attachments_path else None
+    
+    # Cached emails without attachment references must not satisfy a run that wants them
+    store_profile = f"{profile}+attachments" if attachment_store else profile
     
     try:
-        # Step 1: Get email IDs first
+        # Step 1: Page through the inbox collecting email IDs
         print("Getting email IDs from inbox...")
-        response = requests.post(EWS_ENDPOINT, headers=headers, data=FIND_ITEMS_TEMPLATE)
-        
-        if response.status_code != 200:
-            print(f"Error: Received status code {response.status_code}")
-            print(f"Response: {response.text}")
-            return []
-        
-        # Parse the XML response to get item IDs
-        root = ET.fromstring(response.content)
-        
-        # Define namespaces for XPath
-        namespaces = {
-            'soap': 'http://schemas.xmlsoap.org/soap/envelope/',
-            't': 'http://schemas.microsoft.com/exchange/services/2006/types',
-            'm': 'http://schemas.microsoft.com/exchange/services/2006/messages'
-        }
-        
-        # Extract item IDs
-        item_ids = []
-        items = root.findall('.//t:ItemId', namespaces)
-        
-        for item in items:
-            id_value = item.get('Id')
-            change_key = item.get('ChangeKey')
-            if id_value:
-                item_ids.append((id_value, change_key))
-        
-        print(f"Found {len(item_ids)} email IDs")
-        
-        if not item_ids:
-            return []
-        
-        # Step 2: Get detailed information for each email
-        # Create ItemId elements for the GetItem request
-        item_id_elements = ""
-        for id_value, change_key in item_ids:
-            item_id_elements += f'<t:ItemId Id="{id_value}" ChangeKey="{change_key}" />'
-        
-        # Create the GetItem request with the item IDs
-        get_item_request = GET_ITEM_TEMPLATE.format(item_ids=item_id_elements)
+        item_ids = iter_item_ids(session, headers, page_size=page_size, resume_after=resume_after)
         
+        # Step 2: Get detailed information batch by batch while the crawl continues
         print("Getting detailed email information...")
-        response = requests.post(EWS_ENDPOINT, headers=headers, data=get_item_request)
-        
-        if response.status_code != 200:
-            print(f"Error: Received status code {response.status_code}")
-            print(f"Response: {response.text}")
-            return []
+        if not get_profile(profile)['mime']:
+            max_batch_bytes = None
+        batches = batch_item_ids(item_ids, batch_size=batch_size, max_batch_bytes=max_batch_bytes)
+        item_shape = build_item_shape(profile, attachments=attachment_store is not None)
+        raw_path = RAW_RESPONSE_PATH if save_raw else None
         
-        # Save raw XML response to file for inspection
-        with open('raw_ews_detailed_response.xml', 'wb') as f:
-            f.write(response.content)
-        print("Raw detailed XML response saved to raw_ews_detailed_response.xml")
+        def fetch_batch(numbered):
+            tee_path = numbered_path(raw_path, numbered[0])
+            if store is not None:
+                return fetch_with_store(store, session, headers, numbered[1], item_shape, store_profile, tee_path,
+                                        attachment_store)
+            return fetch_detailed_batch(session, headers, numbered[1], item_shape, tee_path, attachment_store)
         
-        # Parse the XML response
-        root = ET.fromstring(response.content)
-        
-        # Extract detailed email information
-        emails = []
-        items = root.findall('.//t:Message', namespaces)
-        
-        print(f"Processing {len(items)} detailed emails")
-        
-        for item in items:
-            try:
-                # Extract basic properties
-                item_id = item.find('.//t:ItemId', namespaces)
-                id_value = item_id.get('Id') if item_id is not None else 'Unknown'
-                
-                subject_elem = item.find('.//t:Subject', namespaces)
-                subject = subject_elem.text if subject_elem is not None and subject_elem.text else '(No Subject)'
-                
-                # Extract MIME content
-                mime_content_elem = item.find('.//t:MimeContent', namespaces)
-                from_name = ""
-                from_address = ""
-                mime_content = ""
-                
-                if mime_content_elem is not None and mime_content_elem.text:
-                    # Decode base64 MIME content
-                    try:
-                        mime_bytes = base64.b64decode(mime_content_elem.text)
-                        mime_content = mime_bytes.decode('utf-8', errors='ignore')
-                        
-                        # Extract sender information from MIME content
-                        from_name, from_address = extract_from_mime(mime_content)
-                        
-                        # If we found a sender, print it for debugging
-                        if from_address:
-                            print(f"Found sender for email '{subject}': {from_name} <{from_address}>")
-                    except Exception as e:
-                        print(f"Error decoding MIME content: {e}")
-                
-                # If sender info not found in MIME, try other approaches
-                if not from_address:
-                    print(f"No sender found in MIME for email '{subject}', trying alternative methods")
-                    
-                    # Try to find Return-Path in the MIME content
-                    return_path_match = re.search(r'Return-Path:\s*<([^>]+)>', mime_content, re.IGNORECASE)
-                    if return_path_match and return_path_match.group(1):
-                        from_address = return_path_match.group(1).strip()
-                        print(f"Found Return-Path: {from_address}")
-                
-                # Last resort: Use a placeholder
-                if not from_address:
-                    from_address = "no-sender@workmail.aws"
-                    from_name = "AWS WorkMail"
-                
-                # Extract other properties
-                date_received_elem = item.find('.//t:DateTimeReceived', namespaces)
-                date_received = date_received_elem.text if date_received_elem is not None else None
-                
-                date_sent_elem = item.find('.//t:DateTimeSent', namespaces)
-                date_sent = date_sent_elem.text if date_sent_elem is not None else None
-                
-                has_attachments_elem = item.find('.//t:HasAttachments', namespaces)
-                has_attachments = has_attachments_elem.text.lower() == 'true' if has_attachments_elem is not None else False
-                
-                is_read_elem = item.find('.//t:IsRead', namespaces)
-                is_read = is_read_elem.text.lower() == 'true' if is_read_elem is not None else False
-                
-                display_to_elem = item.find('.//t:DisplayTo', namespaces)
-                display_to = display_to_elem.text if display_to_elem is not None else None
-                
-                # Create email object
-                email = {
-                    'id': id_value,
-                    'subject': subject,
-                    'from': from_address,
-                    'fromName': from_name,
-                    'to': display_to,
-                    'receivedDate': date_received,
-                    'sentDate': date_sent,
-                    'hasAttachments': has_attachments,
-                    'isRead': is_read
-                }
-                
-                emails.append(email)
-            except Exception as e:
-                print(f"Error processing detailed email: {e}")
+        for emails in fetch_in_order(enumerate(batches, 1), fetch_batch, workers=workers):
+            for email in emails:
+                yield email
+    
+    finally:
+        session.close()
+        if store is not None:
+            store.close()
+
+def get_detailed_emails(page_size=DEFAULT_PAGE_SIZE, batch_size=DEFAULT_BATCH_SIZE,
+                        max_batch_bytes=DEFAULT_MAX_BATCH_BYTES, workers=DEFAULT_WORKERS, save_raw=False,
+                        profile=DETAILED_PROFILE, store_path=DEFAULT_STORE_PATH, attachments_path=None, compact=False):
+    """Get detailed email information
+
+    With `compact` the emails come back in an ews_compact.EmailTable, which
+    iterates like the list of dicts but holds large mailboxes in a fraction
+    of the memory.
+    """
+    emails = iter_detailed_emails(page_size=page_size, batch_size=batch_size,
+                                  max_batch_bytes=max_batch_bytes, workers=workers, save_raw=save_raw,
+                                  profile=profile, store_path=store_path, attachments_path=attachments_path)
+    return EmailTable(emails) if compact else list(emails)
+
+def load_sync_state(state_path=SYNC_STATE_PATH):
+    """Load the SyncState token saved by the previous sync run, if any"""
+    if not os.path.exists(state_path):
+        return None
+    
+    with open(state_path) as f:
+        return json.load(f).get('syncState')
+
+def save_sync_state(sync_state, state_path=SYNC_STATE_PATH):
+    """Persist the SyncState token so the next run only receives newer changes"""
+    temp_path = f"{state_path}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump({'folder': 'inbox', 'syncState': sync_state, 'savedAt': datetime.utcnow().isoformat() + 'Z'}, f)
+    os.replace(temp_path, state_path)
+
+def write_detailed_output(emails, output_path=OUTPUT_PATH):
+    """Write the email dicts to the output, newest first"""
+    ordered = sorted(emails.values(), key=lambda email: email.get('receivedDate') or '', reverse=True)
+    
+    temp_path = temp_path_for(output_path)
+    with open_sink(temp_path, checkpoint_every=0) as sink:
+        for email in ordered:
+            sink.write(email)
+    os.replace(temp_path, output_path)
+
+def sync_detailed_emails(output_path=OUTPUT_PATH, state_path=SYNC_STATE_PATH,
+                         batch_size=DEFAULT_BATCH_SIZE, workers=DEFAULT_WORKERS, profile=DETAILED_PROFILE,
+                         store_path=DEFAULT_STORE_PATH, attachments_path=None, search_index=None,
+                         max_changes=DEFAULT_SYNC_CHANGES):
+    """Apply inbox changes since the last run to the local output using SyncFolderItems
+
+    Created and updated items are fetched with GetItem (or served from the
+    message store when their ChangeKey is already cached), deleted items are
+    dropped and read flag changes are patched in place. Changes are applied
+    in memory and the output file and SyncState token are written once at
+    the end. A round only counts as done once every item it created or
+    updated has been fetched; if one fails, the output and token are saved
+    as of the last complete round and the error is raised, so the next run
+    asks for the failed round's changes again (reapplying them is harmless).
+    Without a saved token the first run receives the whole inbox as creates;
+    a token whose output file is missing is discarded, so that case is a
+    full sync too. `attachments_path` works as in iter_detailed_emails. A
+    `search_index` (ews_search.SearchIndex) is updated with the same changes.
+    """
+    print(f"Connecting to WorkMail with email: {EMAIL}")
+    
+    headers = create_auth_headers()
+    session = create_session(workers)
+    sync_state = load_sync_state(state_path)
+    attachment_store = AttachmentStore(attachments_path) if attachments_path else None
+    store_profile = f"{profile}+attachments" if attachment_store else profile
+    item_shape = build_item_shape(profile, attachments=attachment_store is not None)
+    store = MessageStore(store_path) if store_path else None
+    counts = {'created': 0, 'updated': 0, 'deleted': 0, 'readFlagChanged': 0}
+    
+    # Start from the previous output only when it matches a saved sync state; a delta
+    # applied without it would rewrite the output with just the changed emails
+    emails = {}
+    if sync_state and os.path.exists(output_path):
+        emails = {email['id']: email for email in iter_records(output_path)}
+    elif sync_state:
+        print(f"Saved sync state has no output at {output_path}, discarding it")
+        sync_state = None
+    
+    print("Incremental sync from saved state..." if sync_state else "No saved sync state, running full sync...")
+    
+    if store is not None:
+        fetch_batch = lambda batch: fetch_with_store(store, session, headers, batch, item_shape, store_profile,
+                                                     attachment_store=attachment_store)
+    else:
+        fetch_batch = lambda batch: fetch_detailed_batch(session, headers, batch, item_shape,
+                                                         attachment_store=attachment_store)
+    
+    # The token of the last round whose changes were all applied
+    completed_state = None
+    
+    try:
+        for changes, sync_state in sync_folder_items(SYNC_FOLDER_ITEMS_TEMPLATE, headers, sync_state,
+                                                     max_changes=max_changes, session=session):
+            to_fetch = {}
+            change_types = {}
+            
+            for change in changes:
+                if change['type'] in ('Create', 'Update'):
+                    to_fetch[change['id']] = (change['id'], change['changeKey'])
+                    change_types.setdefault(change['id'], 'created' if change['type'] == 'Create' else 'updated')
+                elif change['type'] == 'Delete':
+                    to_fetch.pop(change['id'], None)
+                    emails.pop(change['id'], None)
+                    counts['deleted'] += 1
+                elif change['type'] == 'ReadFlagChange':
+                    if change['id'] in emails:
+                        emails[change['id']]['isRead'] = change['isRead']
+                    counts['readFlagChanged'] += 1
+            
+            print(f"Applying {len(changes)} changes ({len(to_fetch)} items to fetch)")
+            
+            deleted = [change['id'] for change in changes if change['type'] == 'Delete']
+            if store is not None and deleted:
+                store.delete_many(deleted)
+            if search_index is not None and deleted:
+                search_index.delete_many(deleted)
+            
+            # Only items that actually arrived are counted; ItemsNotFetched ends the run here
+            batches = batch_item_ids(to_fetch.values(), batch_size=batch_size)
+            for fetched in fetch_in_order(batches, fetch_batch, workers=workers):
+                for email in fetched:
+                    emails[email['id']] = email
+                    counts[change_types[email['id']]] += 1
+                    if search_index is not None:
+                        search_index.add(email)
+            
+            completed_state = sync_state
+    
+    finally:
+        session.close()
+        if store is not None:
+            store.close()
         
-        return emails
+        if completed_state is not None:
+            write_detailed_output(emails, output_path)
+            save_sync_state(completed_state, state_path)
     
-    except Exception as e:
-        print(f"Error fetching detailed emails: {e}")
-        return []
+    return counts
 
 if __name__ == "__main__":
+    # --debug shows per-email sender and MIME header details
+    logging.basicConfig(level=logging.DEBUG if '--debug' in sys.argv else logging.INFO, format='%(message)s')
+    
+    # --no-cache ignores the local message store and fetches every item
+    store_path = None if '--no-cache' in sys.argv else DEFAULT_STORE_PATH
+    
+    output_path = option_from_argv(sys.argv, '--output', OUTPUT_PATH)
+    
+    # --attachments DIR saves attachment bodies there (one file per distinct SHA-256); emails keep references
+    attachments_path = option_from_argv(sys.argv, '--attachments')
+    
+    # --index PATH keeps a local full-text search index up to date (query it with ews_search.py)
+    index_path = option_from_argv(sys.argv, '--index')
+    search_index = SearchIndex(index_path) if index_path else None
+    
+    # Indexing defaults to the body profile; other profiles only index subjects, senders and recipients
+    profile = profile_from_argv(sys.argv, INDEX_PROFILE if index_path else DETAILED_PROFILE)
+    if index_path and not fetches_body(profile):
+        print(f"Warning: the {profile} profile fetches no body, so --index will not cover body text")
+    
+    # --metrics PATH (.json or .prom), --trace cpu|memory and --stats report where the run spends its time
+    instrumentation = instrument(metrics_path=option_from_argv(sys.argv, '--metrics'),
+                                 trace_mode=option_from_argv(sys.argv, '--trace'), stats='--stats' in sys.argv)
+    
+    if '--sync' in sys.argv:
+        print("Starting EWS incremental sync...")
+        with instrumentation:
+            counts = sync_detailed_emails(output_path=output_path, store_path=store_path,
+                                          profile=profile,
+                                          attachments_path=attachments_path, search_index=search_index)
+        if search_index is not None:
+            search_index.close()
+        print(f"\nSync complete: {counts['created']} created, {counts['updated']} updated, "
+              f"{counts['deleted']} deleted, {counts['readFlagChanged']} read flag changes")
+        print(f"Results saved to {output_path}")
+        sys.exit(0)
+    
     print("Starting EWS detailed email test...")
-    emails = get_detailed_emails()
+    count = 0
+    
+    # --quiet skips the per-email summary, which costs real time on large mailboxes
+    quiet = '--quiet' in sys.argv
+    
+    # --db TARGET also loads every email into the app's tables (Postgres URL or SQLite path)
+    db_target = option_from_argv(sys.argv, '--db')
+    loader = EmailLoader(db_target) if db_target else None
+    
+    # Stream results to disk as they arrive; --resume continues an interrupted export
+    with instrumentation, open_sink(output_path, resume='--resume' in sys.argv, checkpoint_every=DEFAULT_PAGE_SIZE) as sink:
+        emails = iter_detailed_emails(save_raw='--save-raw' in sys.argv,
+                                      profile=profile,
+                                      store_path=store_path, resume_after=sink.last_id,
+                                      attachments_path=attachments_path)
+        
+        # Print each email as soon as its batch has been fetched
+        print("\nEmail Summary:")
+        for email in emails:
+            sink.write(email)
+            if loader is not None:
+                loader.add(email)
+            if search_index is not None:
+                search_index.add(email)
+            count += 1
+            if quiet:
+                continue
+            print(f"{count}. Subject: {email['subject']}")
+            print(f"   From: {email['fromName']} <{email['from']}>")
+            print(f"   To: {email.get('to', 'N/A')}")
+            print(f"   Received: {email['receivedDate']}")
+            print(f"   Sent: {email.get('sentDate', 'N/A')}")
+            print(f"   Read: {email['isRead']}, Attachments: {email['hasAttachments']}")
+            print()
     
-    # Print results
-    print(f"\nRetrieved {len(emails)} detailed emails from inbox")
-    print("\nEmail Summary:")
-    for i, email in enumerate(emails, 1):
-        print(f"{i}. Subject: {email['subject']}")
-        print(f"   From: {email['fromName']} <{email['from']}>")
-        print(f"   To: {email.get('to', 'N/A')}")
-        print(f"   Received: {email['receivedDate']}")
-        print(f"   Sent: {email.get('sentDate', 'N/A')}")
-        print(f"   Read: {email['isRead']}, Attachments: {email['hasAttachments']}")
-        print()
+    if loader is not None:
+        loader.close()
+        print(f"Loaded {loader.counts['emails']} emails and {loader.counts['recipients']} recipients into the database")
     
-    # Save full results to JSON file
-    with open('ews_detailed_emails.json', 'w') as f:
-        json.dump(emails, f, indent=2)
+    if search_index is not None:
+        search_index.close()
+        print(f"Search index updated: {index_path}")
     
-    print(f"Full results saved to ews_detailed_emails.json") 
\ No newline at end of file
+    print(f"\nRetrieved {count} detailed emails from inbox")
+    print(f"Full results saved to {output_path}")
@@ -1,15 +1,13 @@
-import requests
-import xml.etree.ElementTree as ET
-import base64
 from datetime import datetime
-import json
+import sys
 
-# Constants
-EWS_ENDPOINT = "https://ews.mail.us-east-1.awsapps.com/EWS/Exchange.asmx"
-EMAIL = "j.black@weroofamerica.com"
-PASSWORD = "RestoreMastersLLC2024"
+from ews_client import EMAIL, DEFAULT_PAGE_SIZE, create_auth_headers, crawl_folder, option_from_argv
+from ews_sinks import open_sink, skip_until
+from ews_decode import decode_message, resolve_sender
+from ews_profiles import DEFAULT_PROFILE, build_item_shape, profile_from_argv
+from ews_metrics import METRICS, timed, instrument
 
-# SOAP envelope template for FindItem operation with additional properties
+# SOAP envelope template for a paged FindItem operation; the item shape comes from a fetch profile
 SOAP_TEMPLATE = """<?xml version="1.0" encoding="utf-8"?>
 <soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/"
                xmlns:t="http://schemas.microsoft.com/exchange/services/2006/types"
@@ -19,14 +17,8 @@ SOAP_TEMPLATE = """<?xml version="1.0" encoding="utf-8"?>
   </soap:Header>
   <soap:Body>
     <m:FindItem Traversal="Shallow">
-      <m:ItemShape>
-        <t:BaseShape>AllProperties</t:BaseShape>
-        <t:BodyType>HTML</t:BodyType>
-        <t:AdditionalProperties>
-          <t:FieldURI FieldURI="item:InternetMessageHeaders" />
-        </t:AdditionalProperties>
-      </m:ItemShape>
-      <m:IndexedPageItemView MaxEntriesReturned="50" Offset="0" BasePoint="Beginning" />
+      {item_shape}
+      <m:IndexedPageItemView MaxEntriesReturned="{page_size}" Offset="{offset}" BasePoint="Beginning" />
       <m:ParentFolderIds>
         <t:DistinguishedFolderId Id="inbox" />
       </m:ParentFolderIds>
@@ -34,165 +26,119 @@ SOAP_TEMPLATE = """<?xml version="1.0" encoding="utf-8"?>
   </soap:Body>
 </soap:Envelope>"""
 
-def get_emails_from_inbox():
-    """Fetch emails from the inbox folder using EWS SOAP API"""
-    print(f"Connecting to WorkMail with email: {EMAIL}")
-    
-    # Create Basic Auth header
-    auth_string = f"{EMAIL}:{PASSWORD}"
-    auth_bytes = auth_string.encode('ascii')
-    base64_bytes = base64.b64encode(auth_bytes)
-    base64_auth = base64_bytes.decode('ascii')
-    
-    headers = {
-        'Content-Type': 'text/xml; charset=utf-8',
-        'Authorization': f'Basic {base64_auth}'
-    }
-    
+# Default export path; .jsonl, .jsonl.gz and .jsonl.zst are also accepted via --output
+OUTPUT_PATH = 'ews_emails.json'
+
+# Where raw FindItem pages are copied when a raw dump is requested
+RAW_RESPONSE_PATH = 'raw_ews_response.xml'
+
+@timed('email_build')
+def parse_email_item(item):
+    """Build an email dict from a FindItem t:Message element"""
     try:
-        # Make the SOAP request
-        print("Sending request to EWS endpoint...")
-        response = requests.post(EWS_ENDPOINT, headers=headers, data=SOAP_TEMPLATE)
+        # Extract basic properties in one pass over the item
+        record = decode_message(item)
+        subject = record.subject or '(No Subject)'
         
-        # Check if request was successful
-        if response.status_code != 200:
-            print(f"Error: Received status code {response.status_code}")
-            print(f"Response: {response.text}")
-            return []
+        # Extract sender information - try multiple approaches
+        # 1. Transport headers or the From mailbox, whichever the profile returned
+        from_name, from_address = resolve_sender(record)
         
-        # Save raw XML response to file for inspection
-        with open('raw_ews_response.xml', 'wb') as f:
-            f.write(response.content)
-        print("Raw XML response saved to raw_ews_response.xml")
+        # 2. If not found, try to extract from DisplayTo (might be reply emails)
+        if not from_address and record.display_to and '@' in record.display_to:
+            # This might be a reply, so the original sender could be the recipient
+            from_address = f"Reply to: {record.display_to}"
         
-        # Parse the XML response
-        print("Parsing response...")
-        root = ET.fromstring(response.content)
+        # 3. If still not found, try ReceivedBy
+        if not from_address and record.received_by_address:
+            from_address = record.received_by_address
+            from_name = record.received_by_name
         
-        # Define namespaces for XPath
-        namespaces = {
-            'soap': 'http://schemas.xmlsoap.org/soap/envelope/',
-            't': 'http://schemas.microsoft.com/exchange/services/2006/types',
-            'm': 'http://schemas.microsoft.com/exchange/services/2006/messages'
-        }
+        # 4. Last resort: Use a placeholder
+        if not from_address:
+            from_address = "no-sender@workmail.aws"
+            from_name = "AWS WorkMail"
         
-        # Extract emails
-        emails = []
-        items = root.findall('.//t:Items/t:Message', namespaces)
+        # Create email object
+        email = {
+            'id': record.id or 'Unknown',
+            'subject': subject,
+            'from': from_address,
+            'fromName': from_name,
+            'receivedDate': record.received_date,
+            'hasAttachments': record.has_attachments,
+            'isRead': record.is_read
+        }
         
-        print(f"Found {len(items)} emails")
+        # Add additional fields that might be useful
+        if record.display_to:
+            email['displayTo'] = record.display_to
         
-        for item in items:
-            try:
-                # Extract basic properties
-                item_id = item.find('.//t:ItemId', namespaces)
-                id_value = item_id.get('Id') if item_id is not None else 'Unknown'
-                
-                subject_elem = item.find('.//t:Subject', namespaces)
-                subject = subject_elem.text if subject_elem is not None and subject_elem.text else '(No Subject)'
-                
-                # Extract sender information - try multiple approaches
-                from_address = ''
-                from_name = ''
-                
-                # 1. Try to get from InternetMessageHeaders
-                headers = item.findall('.//t:InternetMessageHeader', namespaces)
-                for header in headers:
-                    header_name = header.get('HeaderName')
-                    if header_name and header_name.lower() == 'from' and header.text:
-                        # Try to parse email from header text (e.g., "Name <email@example.com>")
-                        from_header = header.text
-                        if '<' in from_header and '>' in from_header:
-                            from_name = from_header.split('<')[0].strip()
-                            from_address = from_header.split('<')[1].split('>')[0].strip()
-                        else:
-                            from_address = from_header
-                
-                # 2. If not found, try to extract from DisplayTo (might be reply emails)
-                if not from_address:
-                    display_to = item.find('.//t:DisplayTo', namespaces)
-                    if display_to is not None and display_to.text:
-                        # This is not ideal but can help identify some emails
-                        display_to_text = display_to.text
-                        if '@' in display_to_text:
-                            # This might be a reply, so the original sender could be the recipient
-                            from_address = f"Reply to: {display_to_text}"
-                
-                # 3. If still not found, check for other potential sender fields
-                if not from_address:
-                    # Try ReceivedBy
-                    received_by = item.find('.//t:ReceivedBy/t:Mailbox/t:EmailAddress', namespaces)
-                    if received_by is not None and received_by.text:
-                        from_address = received_by.text
-                        
-                        received_by_name = item.find('.//t:ReceivedBy/t:Mailbox/t:Name', namespaces)
-                        if received_by_name is not None and received_by_name.text:
-                            from_name = received_by_name.text
-                
-                # 4. Last resort: Use a placeholder
-                if not from_address:
-                    from_address = "no-sender@workmail.aws"
-                    from_name = "AWS WorkMail"
-                
-                # Extract date received
-                date_received_elem = item.find('.//t:DateTimeReceived', namespaces)
-                date_received = date_received_elem.text if date_received_elem is not None else None
-                
-                # Extract other properties
-                has_attachments_elem = item.find('.//t:HasAttachments', namespaces)
-                has_attachments = has_attachments_elem.text.lower() == 'true' if has_attachments_elem is not None else False
-                
-                is_read_elem = item.find('.//t:IsRead', namespaces)
-                is_read = is_read_elem.text.lower() == 'true' if is_read_elem is not None else False
-                
-                # Create email object
-                email = {
-                    'id': id_value,
-                    'subject': subject,
-                    'from': from_address,
-                    'fromName': from_name,
-                    'receivedDate': date_received,
-                    'hasAttachments': has_attachments,
-                    'isRead': is_read
-                }
-                
-                # Add additional fields that might be useful
-                display_to = item.find('.//t:DisplayTo', namespaces)
-                if display_to is not None and display_to.text:
-                    email['displayTo'] = display_to.text
-                
-                date_sent_elem = item.find('.//t:DateTimeSent', namespaces)
-                if date_sent_elem is not None and date_sent_elem.text:
-                    email['sentDate'] = date_sent_elem.text
-                
-                emails.append(email)
-            except Exception as e:
-                print(f"Error processing email: {e}")
+        if record.sent_date:
+            email['sentDate'] = record.sent_date
         
-        return emails
-    
+        return email
     except Exception as e:
-        print(f"Error fetching emails: {e}")
-        return []
+        print(f"Error processing email: {e}")
+        return None
+
+def iter_emails_from_inbox(page_size=DEFAULT_PAGE_SIZE, save_raw=False, profile=DEFAULT_PROFILE, resume_after=None):
+    """Yield emails from the inbox folder page by page using the EWS SOAP API
+
+    `profile` names the fetch profile (see ews_profiles) that decides which
+    properties FindItem returns; "summary" covers every output field. With
+    `save_raw` each raw FindItem page is also copied to RAW_RESPONSE_PATH
+    (page N goes to raw_ews_response.N.xml) as it streams in. `resume_after`
+    skips everything up to and including that email id. Request failures
+    are raised, so an export sink keeps its checkpoint for --resume.
+    """
+    print(f"Connecting to WorkMail with email: {EMAIL}")
+    
+    headers = create_auth_headers()
+    
+    print("Sending paged requests to EWS endpoint...")
+    tee_path = RAW_RESPONSE_PATH if save_raw else None
+    item_shape = build_item_shape(profile, find_item=True)
+    items = crawl_folder(SOAP_TEMPLATE, headers, page_size=page_size, tee_path=tee_path,
+                         template_fields={'item_shape': item_shape})
+    emails = (email for email in map(parse_email_item, items) if email is not None)
+    for email in skip_until(emails, resume_after, key=lambda email: email['id']):
+        METRICS.count('items')
+        yield email
+
+def get_emails_from_inbox(page_size=DEFAULT_PAGE_SIZE, save_raw=False, profile=DEFAULT_PROFILE):
+    """Fetch all emails from the inbox folder using EWS SOAP API"""
+    return list(iter_emails_from_inbox(page_size=page_size, save_raw=save_raw, profile=profile))
 
 if __name__ == "__main__":
     print("Starting EWS email test...")
-    emails = get_emails_from_inbox()
+    output_path = option_from_argv(sys.argv, '--output', OUTPUT_PATH)
+    count = 0
     
-    # Print results
-    print(f"\nRetrieved {len(emails)} emails from inbox")
-    print("\nEmail Summary:")
-    for i, email in enumerate(emails[:10], 1):  # Show first 10 emails
-        print(f"{i}. Subject: {email['subject']}")
-        print(f"   From: {email['fromName']} <{email['from']}>")
-        print(f"   To: {email.get('displayTo', 'N/A')}")
-        print(f"   Received: {email['receivedDate']}")
-        print(f"   Sent: {email.get('sentDate', 'N/A')}")
-        print(f"   Read: {email['isRead']}, Attachments: {email['hasAttachments']}")
-        print()
+    # --metrics PATH (.json or .prom), --trace cpu|memory and --stats report where the run spends its time
+    instrumentation = instrument(metrics_path=option_from_argv(sys.argv, '--metrics'),
+                                 trace_mode=option_from_argv(sys.argv, '--trace'), stats='--stats' in sys.argv)
     
-    # Save full results to JSON file
-    with open('ews_emails.json', 'w') as f:
-        json.dump(emails, f, indent=2)
+    # Stream results to disk as they arrive; --resume continues an interrupted export
+    with instrumentation, open_sink(output_path, resume='--resume' in sys.argv, checkpoint_every=DEFAULT_PAGE_SIZE) as sink:
+        emails = iter_emails_from_inbox(save_raw='--save-raw' in sys.argv,
+                                        profile=profile_from_argv(sys.argv),
+                                        resume_after=sink.last_id)
+        
+        # Print a summary of the first emails as soon as their page arrives
+        print("\nEmail Summary:")
+        for email in emails:
+            sink.write(email)
+            count += 1
+            if count > 10:  # Show first 10 emails
+                continue
+            print(f"{count}. Subject: {email['subject']}")
+            print(f"   From: {email['fromName']} <{email['from']}>")
+            print(f"   To: {email.get('displayTo', 'N/A')}")
+            print(f"   Received: {email['receivedDate']}")
+            print(f"   Sent: {email.get('sentDate', 'N/A')}")
+            print(f"   Read: {email['isRead']}, Attachments: {email['hasAttachments']}")
+            print()
     
-    print(f"Full results saved to ews_emails.json") 
\ No newline at end of file
+    print(f"\nRetrieved {count} emails from inbox")
+    print(f"Full results saved to {output_path}")
@@ -0,0 +1,37 @@
+import os
+import socket
+
+import pytest
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+# ews_client reads EWS_ENDPOINT at import time, so it has to point at the fake server before any ews_* import
+PORT = free_port()
+os.environ['EWS_ENDPOINT'] = f"http://127.0.0.1:{PORT}/EWS/Exchange.asmx"
+
+from ews_fakeserver import start_fake_server
+
+@pytest.fixture
+def fake_ews():
+    """Start a fake EWS server on the shared test port: `fake_ews(items=..., churn=...)`
+
+    `fake_ews.mailbox` is the FakeMailbox of the server started last.
+    """
+    servers = []
+
+    def start(**options):
+        options.setdefault('mime_size', 2048)
+        options.setdefault('attachment_size', 8192)
+        server, endpoint = start_fake_server(port=PORT, **options)
+        servers.append(server)
+        start.mailbox = server.mailbox
+        return endpoint
+
+    yield start
+
+    for server in servers:
+        server.shutdown()
+        server.server_close()
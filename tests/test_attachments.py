@@ -0,0 +1,81 @@
+import base64
+import hashlib
+import os
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+import pytest
+
+import ews_attachments
+import ews_crawler
+import ews_throttle
+from ews_attachments import AttachmentStore, extract_mime_attachments
+
+ITEMS = 14
+
+def crawl(tmp_path):
+    accounts = [{'email': 'user@example.com', 'password': 'secret', 'folders': ['inbox']}]
+    return list(ews_crawler.iter_mailbox_emails(accounts, page_size=ITEMS, batch_size=ITEMS, connections=1,
+                                                per_mailbox=1, store_path=str(tmp_path / 'messages.db'),
+                                                attachments_path=str(tmp_path / 'attachments')))
+
+def test_email_whose_attachments_were_given_up_on_is_not_stored(fake_ews, tmp_path, monkeypatch):
+    monkeypatch.setattr(ews_throttle, 'BASE_RETRY_DELAY', 0.01)
+    fake_ews(items=ITEMS)
+    mailbox = fake_ews.mailbox
+    get_attachment = mailbox.get_attachment
+
+    def busy_get_attachment(body):
+        # GetItem keeps working; only the attachment downloads answer ErrorServerBusy
+        mailbox.busy_rate = 1.0
+        try:
+            return get_attachment(body)
+        finally:
+            mailbox.busy_rate = 0.0
+
+    monkeypatch.setattr(mailbox, 'get_attachment', busy_get_attachment)
+    with pytest.raises(ews_crawler.CrawlFailed):
+        crawl(tmp_path)
+
+    monkeypatch.setattr(mailbox, 'get_attachment', get_attachment)
+    fetched = mailbox.calls['GetItem']
+    emails = crawl(tmp_path)
+
+    # The emails with attachments were left out of the store, so they are fetched again
+    assert mailbox.calls['GetItem'] == fetched + 1
+    attachments = [attachment for email in emails for attachment in email['attachments']]
+    assert attachments and all(attachment['sha256'] for attachment in attachments)
+
+def test_mime_attachments_are_deduplicated_and_streamed(tmp_path, monkeypatch):
+    quote = b'%PDF-1.4 quote\n' * 1000
+    large = bytes(range(256)) * (25 * 1024 * 4)
+    message = MIMEMultipart()
+    message.attach(MIMEText('See attached'))
+    for name, content in (('quote.pdf', quote), ('quote copy.pdf', quote), ('backup.bin', large)):
+        part = MIMEApplication(content)
+        part.add_header('Content-Disposition', 'attachment', filename=name)
+        message.attach(part)
+    mime_content = base64.b64encode(message.as_bytes()).decode('ascii')
+
+    writes = []
+    write = ews_attachments.BlobWriter.write
+
+    def record_write(blob, data):
+        writes.append(len(data))
+        write(blob, data)
+
+    monkeypatch.setattr(ews_attachments.BlobWriter, 'write', record_write)
+    store = AttachmentStore(str(tmp_path))
+    refs = extract_mime_attachments(mime_content, store)
+
+    assert [ref['name'] for ref in refs] == ['quote.pdf', 'quote copy.pdf', 'backup.bin']
+    assert refs[0]['sha256'] == refs[1]['sha256'] == hashlib.sha256(quote).hexdigest()
+    assert refs[2]['sha256'] == hashlib.sha256(large).hexdigest()
+    assert refs[2]['size'] == len(large)
+    stored = [name for _, _, names in os.walk(str(tmp_path)) for name in names]
+    assert sorted(stored) == sorted({refs[0]['sha256'], refs[2]['sha256']})
+
+    # The 25 MB body goes to disk a chunk at a time, never as one piece
+    assert max(writes) <= ews_attachments.EXTRACT_CHUNK
+    assert len(writes) > len(large) // ews_attachments.EXTRACT_CHUNK
@@ -0,0 +1,57 @@
+import test_ews_detailed
+import test_ews_emails
+from ews_compact import EmailTable, load_table
+
+def test_listing_and_detailed_emails_round_trip(fake_ews, tmp_path):
+    fake_ews(items=300)
+    listing = list(test_ews_emails.iter_emails_from_inbox(profile='summary'))
+    detailed = list(test_ews_detailed.iter_detailed_emails(store_path=None))
+
+    for emails in (listing, detailed):
+        table = EmailTable(emails)
+        assert list(table) == emails
+        assert table[-1] == emails[-1]
+        assert not table.extras
+
+    # Listing dicts have displayTo and no 'to'; nothing is added on the way back
+    assert 'to' not in EmailTable(listing)[0]
+
+    path = str(tmp_path / 'export.jsonl')
+    EmailTable(detailed).write(path)
+    assert list(load_table(path)) == detailed
+
+def test_values_a_column_cannot_hold_round_trip():
+    emails = [
+        {'id': None, 'subject': None, 'isRead': None, 'receivedDate': 'yesterday'},
+        {'id': 'x', 'hasAttachments': 1, 'recipients': [{'type': 'to', 'address': 'a@example.com', 'name': None,
+                                                          'extra': True}]},
+        {'subject': 'Re: été \U0001F600', 'recipients': [], 'mailbox': None, 'body': 'hello'},
+        {}
+    ]
+
+    table = EmailTable(emails)
+
+    assert list(table) == emails
+    assert list(table.column('isRead')) == [None, None, None, None]
+    assert list(table.column('recipients')) == [None, emails[1]['recipients'], [], None]
+
+def test_recipients_are_stored_as_columns():
+    recipients = [{'type': 'to', 'address': 'sales@example.com', 'name': 'Sales Team'},
+                  {'type': 'cc', 'address': 'boss@example.com', 'name': 'Boss'}]
+    emails = [{'id': f'AAMkAD{index:040d}', 'subject': f'Quote {index}', 'from': f'sender{index % 50}@example.com',
+               'fromName': f'Sender {index % 50}', 'to': 'Sales Team', 'receivedDate': '2025-01-01T00:00:00Z',
+               'sentDate': '2025-01-01T00:00:00Z', 'hasAttachments': False, 'isRead': True,
+               'recipients': recipients} for index in range(5000)]
+
+    table = EmailTable(emails)
+
+    assert not table.extras
+    assert list(table) == emails
+    # Well under the ~1.3 KB each of these dicts takes
+    assert table.nbytes() / len(table) < 100
+
+def test_nbytes_counts_the_extras():
+    small = EmailTable([{'id': 'a'}])
+    with_body = EmailTable([{'id': 'a', 'body': 'x' * 10000}])
+
+    assert with_body.nbytes() - small.nbytes() >= 10000
@@ -0,0 +1,71 @@
+import os
+import subprocess
+import sys
+from collections import Counter
+
+import pytest
+
+import ews_crawler
+import ews_throttle
+
+ITEMS = 30
+
+def test_crawls_every_folder_of_every_mailbox(fake_ews):
+    fake_ews(items=ITEMS)
+    accounts = [{'email': f'user{number}@example.com', 'password': 'secret', 'folders': ['inbox', 'Folder 1']}
+                for number in range(2)]
+
+    emails = list(ews_crawler.iter_mailbox_emails(accounts, page_size=10, batch_size=7, connections=4,
+                                                  per_mailbox=2, store_path=None))
+
+    counts = Counter((email['mailbox'], email['folder']) for email in emails)
+    assert counts == {(account['email'], folder): ITEMS for account in accounts for folder in ('inbox', 'Folder 1')}
+    assert all(email['from'].endswith('@example.com') for email in emails)
+
+def test_failed_batches_are_reported_after_the_rest_of_the_crawl(fake_ews, monkeypatch):
+    monkeypatch.setattr(ews_throttle, 'BASE_RETRY_DELAY', 0.01)
+    fake_ews(items=ITEMS)
+    accounts = [{'email': 'user@example.com', 'password': 'secret', 'folders': ['inbox', 'Folder 1']}]
+    # Every GetItem item answers ErrorServerBusy, so retry_failed_items gives up on all of them
+    fake_ews.mailbox.busy_rate = 1.0
+
+    with pytest.raises(ews_crawler.CrawlFailed) as failed:
+        list(ews_crawler.iter_mailbox_emails(accounts, page_size=ITEMS, batch_size=ITEMS, connections=2,
+                                             per_mailbox=2, store_path=None))
+
+    assert {(failure['mailbox'], failure['folder']) for failure in failed.value.failures} == {
+        ('user@example.com', 'inbox'), ('user@example.com', 'Folder 1')}
+
+def test_unavailable_server_is_reported_not_swallowed(fake_ews, monkeypatch):
+    monkeypatch.setattr(ews_throttle, 'BASE_RETRY_DELAY', 0.01)
+    fake_ews(items=ITEMS)
+    fake_ews.mailbox.available = False
+    accounts = [{'email': 'user@example.com', 'password': 'secret', 'folders': ['inbox']}]
+
+    with pytest.raises(ews_crawler.CrawlFailed) as failed:
+        list(ews_crawler.iter_mailbox_emails(accounts, page_size=10, batch_size=10, connections=2,
+                                             per_mailbox=1, store_path=None))
+
+    assert [failure['mailbox'] for failure in failed.value.failures] == ['user@example.com']
+    assert '503' in failed.value.failures[0]['error']
+
+def test_library_modules_do_not_import_the_scripts():
+    # A fresh interpreter, since this session has already imported everything
+    code = "import sys, ews_crawler, ews_lazy; print(sorted(name for name in sys.modules if name.startswith('test_ews')))"
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    assert result.stdout.strip() == '[]'
+
+def test_each_set_of_credentials_is_throttled_separately():
+    accounts = [{'email': 'a@example.com', 'password': 'one'}, {'email': 'b@example.com', 'password': 'two'},
+                {'email': 'shared1@example.com'}, {'email': 'shared2@example.com'}]
+
+    sessions = ews_crawler.account_sessions(accounts, connections=16, per_mailbox=4)
+
+    assert sessions[0].controller is not sessions[1].controller
+    assert sessions[2] is sessions[3]
+    assert sessions[2].controller not in (sessions[0].controller, sessions[1].controller)
+
+    sessions[0].controller.on_throttle(back_off=5)
+    assert sessions[1].controller.paused_until == 0.0
+    assert sessions[1].controller.limit == 4
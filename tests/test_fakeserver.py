@@ -0,0 +1,67 @@
+import bench_ews
+import test_ews_detailed
+import test_ews_emails
+from ews_fakeserver import FakeMailbox
+
+ITEMS = 60
+
+def test_bench_server_starts_without_unbuffered_output(monkeypatch):
+    monkeypatch.delenv('PYTHONUNBUFFERED', raising=False)
+    process, endpoint = bench_ews.start_server({'items': 10, 'mime-size': 1024, 'latency': 0.0})
+    try:
+        assert process.poll() is None
+        assert endpoint.startswith('http://127.0.0.1:')
+    finally:
+        process.terminate()
+        process.wait()
+
+def test_listing_returns_every_item_in_order(fake_ews):
+    fake_ews(items=ITEMS)
+    mailbox = FakeMailbox(items=ITEMS)
+
+    emails = list(test_ews_emails.iter_emails_from_inbox(page_size=25, profile='summary'))
+
+    assert [email['id'] for email in emails] == [mailbox.item_id(index) for index in range(ITEMS)]
+    assert emails[7]['subject'] == 'Synthetic message 7'
+    assert (emails[7]['fromName'], emails[7]['from']) == mailbox.sender(7)
+
+def test_detailed_profiles_agree(fake_ews):
+    fake_ews(items=ITEMS)
+    mailbox = FakeMailbox(items=ITEMS)
+
+    by_profile = {
+        profile: list(test_ews_detailed.iter_detailed_emails(page_size=25, batch_size=10, workers=4,
+                                                             profile=profile, store_path=None))
+        for profile in ('headers', 'full')
+    }
+
+    for emails in by_profile.values():
+        assert [email['id'] for email in emails] == [mailbox.item_id(index) for index in range(ITEMS)]
+        for index, email in enumerate(emails):
+            assert (email['fromName'], email['from']) == mailbox.sender(index)
+            assert email['receivedDate'] == mailbox.received(index)
+            assert email['hasAttachments'] == mailbox.has_attachments(index)
+            assert email['isRead'] == (index % 3 == 0)
+
+    assert by_profile['headers'][0]['recipients'] == [
+        {'type': 'to', 'address': 'sales@example.com', 'name': 'Sales Team'}
+    ]
+
+def test_attachments_are_stored_once_per_digest(fake_ews, tmp_path):
+    fake_ews(items=ITEMS)
+
+    emails = list(test_ews_detailed.iter_detailed_emails(batch_size=10, workers=2, store_path=None,
+                                                         attachments_path=str(tmp_path / 'attachments')))
+
+    with_attachments = [email for email in emails if email['attachments']]
+    assert len(with_attachments) == len(range(0, ITEMS, 7))
+    digests = {attachment['sha256'] for email in with_attachments for attachment in email['attachments']}
+    stored = [path for path in (tmp_path / 'attachments').rglob('*') if path.is_file()]
+    assert len(stored) == len(digests)
+
+def test_listing_with_a_body_profile(fake_ews):
+    fake_ews(items=ITEMS)
+
+    emails = list(test_ews_emails.iter_emails_from_inbox(page_size=25, profile='body'))
+
+    assert len(emails) == ITEMS
@@ -0,0 +1,85 @@
+import threading
+
+import pytest
+
+import ews_throttle
+from ews_fetch import ItemsNotFetched, create_session
+from ews_client import create_auth_headers
+from ews_lazy import DetailLoader, list_emails
+from ews_metrics import METRICS
+from ews_stream import EwsRequestError
+
+def lazy_requests():
+    return METRICS.snapshot()['counters'].get('lazy_requests', 0)
+
+def make_loader(**options):
+    return DetailLoader(create_session(4), create_auth_headers(), **options)
+
+def test_prefetch_loads_several_emails_in_one_request(fake_ews):
+    fake_ews(items=50)
+    loader = make_loader()
+    emails = list_emails(loader, limit=20)
+    before = lazy_requests()
+
+    loader.prefetch(emails[:3], 'body')
+    bodies = [email.body for email in emails[:3]]
+
+    assert len(emails) == 20
+    assert lazy_requests() - before == 1
+    assert bodies[1].startswith('Synthetic message 1 ')
+
+def test_concurrent_accesses_share_a_request(fake_ews):
+    fake_ews(items=50)
+    # A wide window so thread start-up jitter cannot split the group
+    loader = make_loader(window=0.2)
+    emails = list_emails(loader, limit=10)
+    before = lazy_requests()
+    bodies = {}
+
+    def open_email(email):
+        bodies[email['id']] = email.body
+
+    threads = [threading.Thread(target=open_email, args=(email,)) for email in emails]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(bodies) == 10 and all(bodies.values())
+    assert lazy_requests() - before == 1
+
+def test_items_given_up_on_raise_and_are_not_cached(fake_ews, monkeypatch):
+    monkeypatch.setattr(ews_throttle, 'BASE_RETRY_DELAY', 0.01)
+    fake_ews(items=10)
+    loader = make_loader(window=0)
+    emails = list_emails(loader, limit=3)
+    fake_ews.mailbox.busy_rate = 1.0
+
+    with pytest.raises(ItemsNotFetched):
+        emails[0].body
+
+    fake_ews.mailbox.busy_rate = 0.0
+    assert emails[0].body.startswith('Synthetic message 0 ')
+
+def test_failed_request_reaches_every_waiter(fake_ews, monkeypatch):
+    monkeypatch.setattr(ews_throttle, 'BASE_RETRY_DELAY', 0.01)
+    fake_ews(items=10)
+    loader = make_loader(window=0.2)
+    emails = list_emails(loader, limit=4)
+    fake_ews.mailbox.available = False
+    errors = {}
+
+    def open_email(email):
+        try:
+            email.body
+        except EwsRequestError as e:
+            errors[email['id']] = e
+
+    threads = [threading.Thread(target=open_email, args=(email,)) for email in emails]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(errors) == 4
+    assert not loader.cache
@@ -0,0 +1,162 @@
+import os
+import sqlite3
+from contextlib import contextmanager
+
+import pytest
+
+import ews_loader
+from ews_loader import EMAIL_COLUMNS, EmailLoader, load_emails
+
+def make_email(index, folder='inbox', recipients=None, attachments=None):
+    email = {'id': f'AAMkAD{index:06d}', 'subject': f'Quote {index}', 'from': 'sender@example.com',
+             'fromName': 'Sender', 'receivedDate': '2025-01-01T00:00:00Z', 'hasAttachments': bool(attachments),
+             'isRead': False, 'folder': folder}
+    email['recipients'] = recipients if recipients is not None else [
+        {'type': 'to', 'address': 'sales@example.com', 'name': 'Sales Team'}
+    ]
+    email['attachments'] = attachments or []
+    return email
+
+def rows(path, sql):
+    with sqlite3.connect(path) as connection:
+        return connection.execute(sql).fetchall()
+
+def test_loading_twice_is_idempotent(tmp_path):
+    path = str(tmp_path / 'emails.db')
+    emails = [make_email(index, attachments=[{'name': 'quote.pdf', 'contentType': 'application/pdf', 'size': 10}])
+              for index in range(30)]
+
+    load_emails(emails, path, batch_size=7)
+    first = rows(path, 'SELECT id, email_id FROM emails ORDER BY email_id')
+    load_emails(emails, path, batch_size=7)
+
+    assert rows(path, 'SELECT id, email_id FROM emails ORDER BY email_id') == first
+    assert len(first) == 30
+    assert rows(path, 'SELECT COUNT(*) FROM email_recipients') == [(30,)]
+    assert rows(path, 'SELECT COUNT(*) FROM email_attachments') == [(30,)]
+    assert rows(path, 'SELECT COUNT(*) FROM email_folders') == [(1,)]
+
+def test_changed_recipients_and_attachments_replace_the_old_rows(tmp_path):
+    path = str(tmp_path / 'emails.db')
+    load_emails([make_email(1, attachments=[{'name': 'quote.pdf'}]), make_email(2)], path)
+
+    recipients = [{'type': 'to', 'address': 'boss@example.com', 'name': 'Boss'},
+                  {'type': 'cc', 'address': 'sales@example.com', 'name': None}]
+    load_emails([make_email(1, recipients=recipients, attachments=[{'name': 'invoice.pdf'}, {'name': 'photo.jpg'}])],
+                path)
+
+    joined = 'FROM {table} child JOIN emails ON emails.id = child.email_id WHERE emails.email_id = ?'
+    with sqlite3.connect(path) as connection:
+        changed = connection.execute('SELECT recipient_type, email_address, display_name '
+                                     + joined.format(table='email_recipients') + ' ORDER BY recipient_type DESC',
+                                     ('AAMkAD000001',)).fetchall()
+        files = connection.execute('SELECT file_name ' + joined.format(table='email_attachments') + ' ORDER BY file_name',
+                                   ('AAMkAD000001',)).fetchall()
+        untouched = connection.execute('SELECT email_address ' + joined.format(table='email_recipients'),
+                                       ('AAMkAD000002',)).fetchall()
+
+    assert changed == [('to', 'boss@example.com', 'Boss'), ('cc', 'sales@example.com', None)]
+    assert files == [('invoice.pdf',), ('photo.jpg',)]
+    assert untouched == [('sales@example.com',)]
+
+def test_folders_map_to_workmail_folder_names(tmp_path):
+    path = str(tmp_path / 'emails.db')
+    folders = ['inbox', 'Inbox', 'sentitems', 'deleteditems', 'drafts', 'junkemail', 'Projects/Roofing']
+
+    load_emails([make_email(index, folder=folder) for index, folder in enumerate(folders)], path)
+
+    assert rows(path, 'SELECT folder_id, display_name FROM email_folders ORDER BY folder_id') == [
+        ('DELETED_ITEMS', 'Deleted Items'), ('DRAFTS', 'Drafts'), ('INBOX', 'Inbox'), ('JUNK_EMAIL', 'Junk Email'),
+        ('Projects/Roofing', 'Roofing'), ('SENT_ITEMS', 'Sent Items')
+    ]
+    assert rows(path, "SELECT COUNT(*) FROM emails JOIN email_folders ON email_folders.id = emails.folder_id "
+                      "WHERE email_folders.folder_id = 'INBOX'") == [(2,)]
+
+def test_optional_columns_are_written_and_kept_when_absent(tmp_path):
+    path = str(tmp_path / 'emails.db')
+    full = dict(make_email(1), body='Please quote the roof', importance='High',
+                internetMessageId='<quote-1@example.com>', size=2048)
+    query = "SELECT body, importance, internet_message_id, size FROM emails WHERE email_id = 'AAMkAD000001'"
+
+    load_emails([full], path)
+    written = rows(path, query)
+    load_emails([make_email(1)], path)
+    kept = rows(path, query)
+    load_emails([dict(full, body='Updated quote')], path)
+
+    assert written == kept == [('Please quote the roof', 'High', '<quote-1@example.com>', 2048)]
+    assert rows(path, query)[0][0] == 'Updated quote'
+
+class RecordingConnection:
+    """Stands in for a psycopg connection, recording the SQL the Postgres code paths send"""
+
+    def __init__(self):
+        self.statements = []
+        self.copied = {}
+
+    def execute(self, sql, params=()):
+        self.statements.append((sql, params))
+
+    def cursor(self):
+        return self
+
+    @contextmanager
+    def copy(self, sql):
+        rows = self.copied[sql] = []
+
+        class Copy:
+            def write_row(self, row):
+                rows.append(row)
+        yield Copy()
+
+def postgres_loader():
+    loader = EmailLoader.__new__(EmailLoader)
+    loader.postgres = True
+    loader.marker = '%s'
+    loader.connection = RecordingConnection()
+    return loader
+
+def test_postgres_dialect_sql():
+    loader = postgres_loader()
+    email_row = tuple(f'value {index}' for index in range(len(EMAIL_COLUMNS)))
+
+    loader._upsert_emails([email_row, email_row])
+    loader._delete_children('email_recipients', ['row-1', 'row-2'])
+    loader._bulk_insert('email_recipients', ews_loader.RECIPIENT_COLUMNS, [('r1', 'row-1', 'to', 'a@example.com', None)])
+
+    (upsert, params), (delete, delete_params) = loader.connection.statements
+    assert upsert.startswith(f"INSERT INTO emails ({', '.join(EMAIL_COLUMNS)}) VALUES (%s")
+    assert upsert.count('%s') == 2 * len(EMAIL_COLUMNS) and params == list(email_row) * 2
+    assert 'body = COALESCE(excluded.body, emails.body)' in upsert
+    assert 'internet_message_id = COALESCE(excluded.internet_message_id, emails.internet_message_id)' in upsert
+    assert 'subject = excluded.subject' in upsert
+    assert delete == 'DELETE FROM email_recipients WHERE email_id = ANY(%s::uuid[])'
+    assert delete_params == (['row-1', 'row-2'],)
+    assert loader.connection.copied == {
+        'COPY email_recipients (id, email_id, recipient_type, email_address, display_name) FROM STDIN':
+            [('r1', 'row-1', 'to', 'a@example.com', None)]
+    }
+
+@pytest.mark.skipif(not os.environ.get('DATABASE_URL', '').startswith(('postgres://', 'postgresql://'))
+                    or ews_loader.psycopg is None, reason='needs DATABASE_URL pointing at Postgres and psycopg')
+def test_loads_into_postgres():
+    target = os.environ['DATABASE_URL']
+    emails = [dict(make_email(index, folder='Loader test', attachments=[{'name': 'quote.pdf'}]),
+                   id=f'LoaderTest{index:06d}', body=f'Body {index}', size=100 + index) for index in range(5)]
+
+    try:
+        load_emails(emails, target, batch_size=2)
+        counts = load_emails(emails, target, batch_size=2)
+
+        with ews_loader.psycopg.connect(target) as connection:
+            loaded = connection.execute("SELECT email_id, body, size FROM emails WHERE email_id LIKE 'LoaderTest%' "
+                                        "ORDER BY email_id").fetchall()
+            attachments = connection.execute("SELECT COUNT(*) FROM email_attachments JOIN emails ON emails.id = "
+                                             "email_attachments.email_id WHERE emails.email_id LIKE 'LoaderTest%'").fetchone()
+        assert counts['emails'] == 5
+        assert loaded == [(email['id'], email['body'], email['size']) for email in emails]
+        assert attachments == (5,)
+    finally:
+        with ews_loader.psycopg.connect(target) as connection:
+            connection.execute("DELETE FROM emails WHERE email_id LIKE 'LoaderTest%'")
+            connection.execute("DELETE FROM email_folders WHERE folder_id = 'Loader test'")
@@ -0,0 +1,18 @@
+import pstats
+from concurrent.futures import ThreadPoolExecutor
+
+import ews_metrics
+
+def busy_work():
+    return sum(index * index for index in range(20000))
+
+def test_cpu_trace_covers_worker_threads(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+
+    with ews_metrics.trace('cpu'):
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            list(executor.map(lambda _: busy_work(), range(4)))
+
+    stats = pstats.Stats(str(tmp_path / ews_metrics.CPU_PROFILE_PATH)).stats
+    calls = sum(entry[1] for function, entry in stats.items() if function[2] == 'busy_work')
+    assert calls == 4
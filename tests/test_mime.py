@@ -0,0 +1,62 @@
+import base64
+
+import pytest
+
+from ews_mime import DECODE_CHUNK, decode_header_block, extract_mime_addresses, parse_header_block, pick_sender
+
+def encode(message):
+    return base64.b64encode(message.encode('utf-8')).decode('ascii')
+
+@pytest.mark.parametrize('newline', ['\r\n', '\n'])
+def test_folded_headers_are_unfolded(newline):
+    headers = newline.join(['From: Sales', '\tTeam <sales@example.com>', 'To: Boss <boss@example.com>,',
+                            ' Office <office@example.com>', 'Subject: Quote', '', 'Body'])
+
+    addresses = extract_mime_addresses(encode(headers))
+
+    assert addresses['from'] == [('Sales Team', 'sales@example.com')]
+    assert addresses['to'] == [('Boss', 'boss@example.com'), ('Office', 'office@example.com')]
+
+@pytest.mark.parametrize('newline', ['\r\n', '\n'])
+def test_header_block_stops_at_the_blank_line(newline):
+    message = newline.join(['From: a@example.com', 'Subject: Hi', '', 'From: body@example.com', ''])
+
+    header_bytes = decode_header_block(encode(message))
+
+    assert header_bytes == (newline.join(['From: a@example.com', 'Subject: Hi', '']) + newline).encode('ascii')
+    assert parse_header_block(header_bytes, {'from'}) == {'from': 'a@example.com'}
+
+def test_encoded_words_in_display_names():
+    message = ('From: =?utf-8?B?' + base64.b64encode('Zoë Müller'.encode('utf-8')).decode('ascii')
+               + '?= <zoe@example.com>\r\nCc: =?iso-8859-1?Q?Ren=E9_Dupont?= <rene@example.com>\r\n\r\n')
+
+    addresses = extract_mime_addresses(encode(message))
+
+    assert addresses['from'] == [('Zoë Müller', 'zoe@example.com')]
+    assert addresses['cc'] == [('René Dupont', 'rene@example.com')]
+
+# Each DECODE_CHUNK of base64 decodes to this many bytes
+CHUNK_BYTES = DECODE_CHUNK // 4 * 3
+
+@pytest.mark.parametrize('split', range(5))
+def test_blank_line_across_a_chunk_edge(split):
+    # Pad the headers so the final CRLF CRLF starts `split` bytes before the first chunk ends
+    prefix = 'From: Sales <sales@example.com>\r\nX-Padding: '
+    padding = 'x' * (CHUNK_BYTES - split - len(prefix))
+    headers = f"{prefix}{padding}\r\n\r\n"
+    message = headers + 'B' * 3 * CHUNK_BYTES
+
+    header_bytes = decode_header_block(encode(message))
+
+    assert header_bytes == headers.encode('ascii')
+    assert extract_mime_addresses(encode(message))['from'] == [('Sales', 'sales@example.com')]
+
+def test_sender_falls_back_from_from_to_sender_to_return_path():
+    base = 'Return-Path: <bounce@example.com>\r\n'
+    with_sender = 'Sender: Assistant <assistant@example.com>\r\n' + base
+    with_from = 'From: Boss <boss@example.com>\r\n' + with_sender
+
+    assert pick_sender(extract_mime_addresses(encode(with_from + '\r\n'))) == ('Boss', 'boss@example.com')
+    assert pick_sender(extract_mime_addresses(encode(with_sender + '\r\n'))) == ('Assistant', 'assistant@example.com')
+    assert pick_sender(extract_mime_addresses(encode(base + '\r\n'))) == ('', 'bounce@example.com')
+    assert pick_sender(extract_mime_addresses(encode('Subject: Hi\r\n\r\n'))) == ('', '')
@@ -0,0 +1,17 @@
+import pytest
+
+from ews_profiles import FETCH_PROFILES, GET_ITEM_ONLY_FIELDS, build_item_shape
+
+@pytest.mark.parametrize('name', sorted(FETCH_PROFILES))
+def test_find_item_shapes_only_ask_for_find_item_properties(name):
+    shape = build_item_shape(name, find_item=True, attachments=True)
+
+    assert 'IncludeMimeContent' not in shape
+    for field in GET_ITEM_ONLY_FIELDS:
+        assert f'"{field}"' not in shape
+
+def test_get_item_shape_keeps_the_body():
+    shape = build_item_shape('body', attachments=True)
+
+    assert '"item:Body"' in shape and '"item:Attachments"' in shape
+    assert '<t:BodyType>Text</t:BodyType>' in shape
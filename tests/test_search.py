@@ -0,0 +1,20 @@
+import test_ews_detailed
+from ews_profiles import INDEX_PROFILE, DETAILED_PROFILE, fetches_body
+from ews_search import SearchIndex
+
+def test_index_profile_fetches_the_body():
+    assert fetches_body(INDEX_PROFILE)
+    assert fetches_body('full')
+    assert not fetches_body(DETAILED_PROFILE)
+
+def test_body_profile_makes_bodies_searchable(fake_ews, tmp_path):
+    fake_ews(items=20)
+
+    with SearchIndex(str(tmp_path / 'index.db')) as index:
+        for email in test_ews_detailed.iter_detailed_emails(profile=INDEX_PROFILE, store_path=None):
+            index.add(email)
+        ids = index.search('body:lorem', limit=100)
+        from_sender = index.search('from:sender7@example.com')
+
+    assert len(ids) == 20
+    assert len(from_sender) == 1
@@ -0,0 +1,54 @@
+import os
+
+import pytest
+
+import ews_throttle
+import test_ews_detailed
+from ews_sinks import ResumePointNotFound, open_sink, iter_records, checkpoint_path_for
+from ews_stream import EwsRequestError
+
+ITEMS = 60
+
+def export(path, resume=False, outage_after=None, mailbox=None):
+    with open_sink(path, resume=resume, checkpoint_every=10) as sink:
+        for email in test_ews_detailed.iter_detailed_emails(batch_size=5, workers=1, store_path=None,
+                                                            resume_after=sink.last_id):
+            sink.write(email)
+            if sink.count == outage_after:
+                mailbox.available = False
+    return sink
+
+def test_interrupted_export_resumes(fake_ews, tmp_path, monkeypatch):
+    monkeypatch.setattr(ews_throttle, 'BASE_RETRY_DELAY', 0.01)
+    fake_ews(items=ITEMS)
+    mailbox = fake_ews.mailbox
+    path = str(tmp_path / 'export.jsonl')
+
+    with pytest.raises(EwsRequestError):
+        export(path, outage_after=25, mailbox=mailbox)
+    interrupted = len(list(iter_records(path)))
+
+    assert os.path.exists(checkpoint_path_for(path))
+    assert 25 <= interrupted < ITEMS
+
+    mailbox.available = True
+    sink = export(path, resume=True)
+
+    assert [email['id'] for email in iter_records(path)] == [mailbox.item_id(index) for index in range(ITEMS)]
+    assert sink.count == ITEMS
+    assert not os.path.exists(checkpoint_path_for(path))
+
+def test_missing_resume_point_keeps_the_checkpoint(fake_ews, tmp_path):
+    fake_ews(items=ITEMS)
+    path = str(tmp_path / 'export.jsonl')
+
+    # An interrupted run whose last record has since been deleted from the folder
+    sink = open_sink(path, checkpoint_every=1)
+    sink.write({'id': 'deleted-since-the-checkpoint'})
+    sink.raw.close()
+
+    with pytest.raises(ResumePointNotFound):
+        export(path, resume=True)
+
+    assert os.path.exists(checkpoint_path_for(path))
+    assert [email['id'] for email in iter_records(path)] == ['deleted-since-the-checkpoint']
@@ -0,0 +1,30 @@
+import test_ews_detailed
+
+ITEMS = 40
+
+def export(tmp_path):
+    return list(test_ews_detailed.iter_detailed_emails(batch_size=10, workers=2, store_path=str(tmp_path / 'messages.db')))
+
+def test_second_export_sends_no_get_item(fake_ews, tmp_path):
+    fake_ews(items=ITEMS)
+    first = export(tmp_path)
+    mailbox = fake_ews.mailbox
+    fetched = mailbox.calls['GetItem']
+
+    second = export(tmp_path)
+
+    assert fetched == ITEMS // 10
+    assert mailbox.calls['GetItem'] == fetched
+    assert second == first
+
+def test_changed_change_key_is_fetched_again(fake_ews, tmp_path):
+    fake_ews(items=ITEMS)
+    first = export(tmp_path)
+    mailbox = fake_ews.mailbox
+    fetched = mailbox.calls['GetItem']
+
+    mailbox.versions[5] = 1
+    second = export(tmp_path)
+
+    assert mailbox.calls['GetItem'] == fetched + 1
+    assert [email['id'] for email in second] == [email['id'] for email in first]
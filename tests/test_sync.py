@@ -0,0 +1,69 @@
+import pytest
+
+import ews_throttle
+import test_ews_detailed
+from ews_fetch import ItemsNotFetched
+from ews_sinks import iter_records
+
+ITEMS = 40
+
+def sync(tmp_path, output_name='inbox.jsonl', max_changes=512):
+    return test_ews_detailed.sync_detailed_emails(output_path=str(tmp_path / output_name),
+                                                  state_path=str(tmp_path / 'state.json'),
+                                                  batch_size=10, workers=2, store_path=None,
+                                                  max_changes=max_changes)
+
+def test_incremental_sync_keeps_unchanged_emails(fake_ews, tmp_path):
+    fake_ews(items=ITEMS, churn=3)
+
+    assert sync(tmp_path)['created'] == ITEMS
+    counts = sync(tmp_path)
+
+    assert counts['created'] == 0 and counts['updated'] == 3
+    assert len(list(iter_records(str(tmp_path / 'inbox.jsonl')))) == ITEMS
+
+def test_missing_output_forces_full_sync(fake_ews, tmp_path):
+    fake_ews(items=ITEMS, churn=3)
+    sync(tmp_path)
+    (tmp_path / 'inbox.jsonl').unlink()
+
+    counts = sync(tmp_path)
+
+    assert counts['created'] == ITEMS
+    assert len(list(iter_records(str(tmp_path / 'inbox.jsonl')))) == ITEMS
+
+def test_new_output_path_forces_full_sync(fake_ews, tmp_path):
+    fake_ews(items=ITEMS)
+    sync(tmp_path)
+
+    sync(tmp_path, output_name='other.jsonl')
+
+    assert len(list(iter_records(str(tmp_path / 'other.jsonl')))) == ITEMS
+
+def test_failed_fetches_are_synced_again(fake_ews, tmp_path, monkeypatch):
+    monkeypatch.setattr(ews_throttle, 'BASE_RETRY_DELAY', 0.01)
+    fake_ews(items=ITEMS)
+    mailbox = fake_ews.mailbox
+    fetch_detailed_batch = test_ews_detailed.fetch_detailed_batch
+    batches = []
+
+    # Rounds of ten changes, one batch each: the server starts failing every item in the third round
+    def fetch_then_fail(*args, **kwargs):
+        batches.append(args[2])
+        if len(batches) == 3:
+            mailbox.busy_rate = 1.0
+        return fetch_detailed_batch(*args, **kwargs)
+
+    monkeypatch.setattr(test_ews_detailed, 'fetch_detailed_batch', fetch_then_fail)
+    with pytest.raises(ItemsNotFetched):
+        sync(tmp_path, max_changes=10)
+
+    assert test_ews_detailed.load_sync_state(str(tmp_path / 'state.json')) == 'pos:20'
+    assert len(list(iter_records(str(tmp_path / 'inbox.jsonl')))) == 20
+
+    mailbox.busy_rate = 0.0
+    counts = sync(tmp_path, max_changes=10)
+
+    assert counts['created'] == ITEMS - 20
+    assert sorted(email['id'] for email in iter_records(str(tmp_path / 'inbox.jsonl'))) == \
+        sorted(mailbox.item_id(index) for index in range(ITEMS))
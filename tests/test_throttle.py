@@ -0,0 +1,49 @@
+import test_ews_detailed
+from ews_client import EWS_ENDPOINT
+from ews_fakeserver import FakeMailbox
+from ews_fetch import create_session
+from ews_metrics import METRICS
+from ews_throttle import ConcurrencyController
+
+ITEMS = 40
+
+def detailed_ids(page_size=10, **options):
+    emails = test_ews_detailed.iter_detailed_emails(page_size=page_size, batch_size=5, store_path=None, **options)
+    return [email['id'] for email in emails]
+
+def test_busy_server_backs_off_and_every_item_arrives(fake_ews, monkeypatch):
+    limits = []
+    on_throttle = ConcurrencyController.on_throttle
+
+    def record_limit(controller, back_off=None):
+        on_throttle(controller, back_off)
+        limits.append(controller.limit)
+
+    monkeypatch.setattr(ConcurrencyController, 'on_throttle', record_limit)
+    # One page, so all eight batches are requested at once and each takes long enough to overlap
+    fake_ews(items=ITEMS, busy_rate=0.1, max_concurrency=2, latency=0.05)
+
+    ids = detailed_ids(page_size=ITEMS, workers=8)
+
+    assert ids == [FakeMailbox(items=ITEMS).item_id(index) for index in range(ITEMS)]
+    assert limits and min(limits) < 8
+
+def test_truncated_responses_are_retried(fake_ews):
+    fake_ews(items=ITEMS, truncate_rate=0.5)
+
+    ids = detailed_ids(workers=4)
+
+    assert ids == [FakeMailbox(items=ITEMS).item_id(index) for index in range(ITEMS)]
+    # Four FindItem pages and eight GetItem batches, plus the requests sent again
+    calls = fake_ews.mailbox.calls
+    assert calls['FindItem'] + calls['GetItem'] > ITEMS // 10 + ITEMS // 5
+
+def test_bytes_sent_counts_encoded_bytes(fake_ews):
+    fake_ews(items=1)
+    session = create_session(1)
+    body = '<m:Ping>Zoë</m:Ping>'
+    before = METRICS.snapshot()['counters'].get('bytes_sent', 0)
+
+    session.post(EWS_ENDPOINT, data=body)
+
+    assert METRICS.snapshot()['counters']['bytes_sent'] - before == len(body.encode('utf-8'))